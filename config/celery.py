@@ -1,4 +1,4 @@
-import os, time, csv, io, random
+import os, time, csv, io, tempfile, threading
 from celery import Celery, task
 from channels import Group
 
@@ -10,6 +10,9 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings_dev')
 app = Celery('linkage')
 app.config_from_object('django.conf:settings')
 
+PROGRESS_INTERVAL = 2 # seconds between two progress updates of a running job (JobStatus write + message)
+LOG_INTERVAL = 30 # seconds between two writes of the log of a running job
+
 def save_or_retry(obj):
     for i in range(20):
         try:
@@ -19,11 +22,111 @@ def save_or_retry(obj):
             print("couldn't save final result, retry=", i, 'error=', e)
         time.sleep(1)
 
-@task()
-def process_graph(graph_pk, result_pk=None, ws_delay=0):
+def send_job_message(graph, kind, retries=1):
+    """Tell the jobs page of the user that a job changed, retried for the final messages"""
+    for i in range(retries):
+        try:
+            Group("jobs-%d" % graph.user_id).send({
+                'text': '%d - %s' % (graph.pk, kind)
+            })
+            return True
+        except Exception as e:
+            print("[warning] couldn't send the job message", kind, 'retry=', i, 'error=', e)
+            if i + 1 < retries:
+                time.sleep(1)
+    return False
+
+class ProgressThrottle:
+    """
+    Coalesce the progress updates of a running job
+
+    The last step and progress are written to the JobStatus of the graph, and the jobs page
+    notified, at most every PROGRESS_INTERVAL seconds. The log is written every LOG_INTERVAL.
+    An update within the interval is written at its end, close() writes the pending one at
+    the end of the job.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.state = None
+        self.log = None
+        self.dirty = False
+        self.flushed_at = 0
+        self.log_flushed_at = time.time()
+        self.lock = threading.RLock()
+        self.timer = None
+
+    def update(self, step=None, progress=None, log=None):
+        with self.lock:
+            if step is not None:
+                self.state = (step, progress)
+            if log is not None:
+                self.log = log
+            self.dirty = True
+            wait = PROGRESS_INTERVAL - (time.time() - self.flushed_at)
+            if wait <= 0:
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(wait, self._trailing_flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _trailing_flush(self):
+        from django.db import connection
+
+        try:
+            self.flush()
+        finally:
+            # the connection of the timer thread
+            connection.close()
+
+    def flush(self, final=False):
+        from core.models import Graph, JobStatus
+
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.dirty:
+                return
+            try:
+                if self.state:
+                    JobStatus.objects.update_or_create(graph=self.graph,
+                        defaults={'step': self.state[0], 'progress': self.state[1]})
+                if self.log is not None and (final or time.time() - self.log_flushed_at >= LOG_INTERVAL):
+                    Graph.objects.filter(pk=self.graph.pk).update(job_log=self.log)
+                    self.log_flushed_at = time.time()
+                send_job_message(self.graph, 'UPDATE')
+            except Exception as e:
+                print("[warning] couldn't save the job progress", str(e))
+            self.dirty = False
+            self.flushed_at = time.time()
+
+    def close(self):
+        """Write the pending update now, before the final state of the job"""
+        self.flush(final=True)
+
+# acks_late: the job is delivered again if the worker dies, and resumed from its checkpoint
+@task(acks_late=True)
+def process_graph(graph_pk, result_pk=None, ws_delay=0, resume=True):
+    # delivered again while still running (past the visibility_timeout), the run directory
+    # of the job is leased so that a single worker runs linkage-cpp in it
+    try:
+        lease = graph_processing.run_dirs.lock_run(result_pk if result_pk else graph_pk)
+    except graph_processing.run_dirs.Busy:
+        print('Graph {} is already processed by another worker'.format(graph_pk))
+        return None
+    with lease:
+        return _process_graph(graph_pk, result_pk, ws_delay, resume)
+
+
+def _process_graph(graph_pk, result_pk, ws_delay, resume):
     print('Processing graph {}'.format(graph_pk))
 
-    from core.models import Graph, ProcessingResult
+    from django.conf import settings
+    from django.utils import timezone
+    from core.models import Graph, ProcessingResult, JobStatus
+    from core import result_cache, response_cache
 
     t = time.time()
 
@@ -39,68 +142,213 @@ def process_graph(graph_pk, result_pk=None, ws_delay=0):
     n_repeat = global_preferences['linkage_cpp__n_repeat']
     max_inner_lda = global_preferences['linkage_cpp__max_inner_lda']
     max_outer_lda = global_preferences['linkage_cpp__max_outer_lda']
+    n_jobs = global_preferences['linkage_cpp__n_jobs']
+    patience = global_preferences['linkage_cpp__search_patience']
+    cache_size = global_preferences['linkage_cpp__result_cache_size']
+    # within the visibility_timeout of the broker, past it the job is delivered again
+    timeout = min(global_preferences['linkage_cpp__timeout'] or settings.LINKAGE_JOB_MAX_TIME,
+        settings.LINKAGE_JOB_MAX_TIME)
+    cpu_limit = global_preferences['linkage_cpp__cpu_limit']
+    memory_limit = global_preferences['linkage_cpp__memory_limit']
+    run_backend = global_preferences['linkage_cpp__run_backend']
+    search = graph.job_param_search
+
+    digest = result_cache.data_digest(graph.arrays)
+
+    def cache_key(n_topics, n_clusters):
+        return result_cache.result_key(digest, graph.directed, n_topics, n_clusters,
+            n_repeat, max_inner_lda, max_outer_lda)
+
+    # a rerun job shows as running again, its progress is then followed in JobStatus
+    graph.job_progress = 0
+    graph.job_current_step = 'Clustering'
+    graph.save()
+    JobStatus.objects.update_or_create(graph=graph, defaults={'step': 'Clustering', 'progress': 0})
+
+    progress = ProgressThrottle(graph)
 
     def update(log, kq_done, msg):
-        graph.job_log = log
         kq_todo = (
             (param_max_clusters - param_clusters + 1)
                 * (param_max_topics - param_topics + 1)
         ) * n_repeat
-        graph.job_current_step = 'Clustering (%d/%d models)' % (kq_done, kq_todo)
-        graph.job_progress = kq_done / kq_todo
+        if search == 'adaptive':
+            # the number of models is not known in advance, kq_todo is the full grid
+            step = 'Clustering (%d models, at most %d)' % (kq_done, kq_todo)
+        else:
+            step = 'Clustering (%d/%d models)' % (kq_done, kq_todo)
 
         # do not send yet as a finished job, wait for processing results to be saved
         if kq_done == kq_todo:
             return
 
-        try:
-            graph.save()
-            Group("jobs-%d" % graph.user.pk).send({
-                'text': '%d - UPDATE' % graph.pk
-            })
-        except Exception as e: 
-            print("[warning] couldn't save the job progress", str(e))
-
-    results, log = graph_processing.process(
-        graph.edges, graph.tdm,
-        param_clusters, param_topics,
-        result_pk if result_pk else random.randint(0, 10000),
-        param_max_clusters, param_max_topics,
-        update=update, n_repeat=n_repeat,
-        max_inner_lda=max_inner_lda, max_outer_lda=max_outer_lda,
-        directed=graph.directed)
+        progress.update(step, kq_done / kq_todo, log)
 
-    graph.job_current_step = 'Clustering'
-    graph.job_log = log
-    graph.job_time = (time.time() - t) / 100
-    graph.job_progress = 1;
-
-    for group, result in results.items():
+    def save_result(group, result):
+        # saved as soon as linkage-cpp is done with this (K, Q), the best model so far can be opened
         db_result = ProcessingResult(
             graph=graph,
             param_clusters=result['n_clusters'],
             param_topics=result['n_topics']
         )
-        db_result.clusters_mat = result['clusters']
-        db_result.topics_mat = result['topics']
-        db_result.topics_per_edges_mat = result['topics_per_edges']
-        db_result.rho_mat = result['rho_mat']
-        db_result.pi_mat = result['pi_mat']
-        db_result.theta_qr_mat = result['theta_qr_mat']
+        db_result.set_matrices(
+            clusters_mat=result['clusters'],
+            topics_mat=result['topics'],
+            topics_per_edges_mat=result['topics_per_edges'],
+            rho_mat=result['rho_mat'],
+            pi_mat=result['pi_mat'],
+            theta_qr_mat=result['theta_qr_mat'],
+        )
         db_result.crit = result['crit']
+        # a failed model (no crit, no output files) is saved as such, without clusters to rank
+        if result['crit'] is not None:
+            db_result.update_top_nodes()
+            db_result.update_quotient()
+        # the failed models (no crit) are computed again by the next job
+        if cache_size > 0 and result['crit'] is not None:
+            db_result.cache_key = cache_key(result['n_topics'], result['n_clusters'])
+            db_result.cache_used_at = timezone.now()
         save_or_retry(db_result)
+        update_layout(db_result)
+        progress.update()
+
+    def update_layout(db_result):
+        # the graph is laid out in parallel by spacialize_graph, which places the clusters
+        # of the results saved before it is done, the ones saved after are placed here
+        layout_key = Graph.objects.filter(pk=graph.pk).values_list('layout_key', flat=True).first()
+        if layout_key:
+            graph.layout_key = layout_key
+            db_result.update_layout()
+            save_or_retry(db_result)
+
+    # the results saved before an interruption are kept, only the missing ones are computed,
+    # and the failed models again
+    done = {}
+    if resume:
+        ProcessingResult.objects.filter(graph=graph, crit=None).delete()
+        for topics, clusters, crit in ProcessingResult.objects.filter(graph=graph) \
+                .values_list('param_topics', 'param_clusters', 'crit'):
+            done['%d,%d' % (topics, clusters)] = crit
+    else:
+        # from scratch, a job delivered again after a crash replaces the results saved before it
+        ProcessingResult.objects.filter(graph=graph).delete()
+
+    # the (K, Q) already computed on the same edges and tdm with the same parameters are cloned
+    cache_hits = 0
+    if cache_size > 0:
+        for clusters in range(param_clusters, param_max_clusters + 1):
+            for topics in range(param_topics, param_max_topics + 1):
+                group = '%d,%d' % (topics, clusters)
+                if group in done:
+                    continue
+                cached = result_cache.lookup(cache_key(topics, clusters))
+                if cached is not None:
+                    update_layout(result_cache.clone(cached, graph))
+                    done[group] = cached.crit
+                    cache_hits += 1
+
+    def cancelled():
+        # cancelled from the jobs page, or deleted
+        return not Graph.objects.filter(pk=graph.pk, job_cancel_requested=False).exists()
+
+    stats = {}
+    try:
+        try:
+            results, log = graph_processing.process(
+                graph.text_data('edges'), graph.text_data('tdm'),
+                param_clusters, param_topics,
+                # a stable run directory per graph, to find the checkpoint of an interrupted job
+                result_pk if result_pk else graph.pk,
+                param_max_clusters, param_max_topics,
+                update=update, n_repeat=n_repeat,
+                max_inner_lda=max_inner_lda, max_outer_lda=max_outer_lda,
+                directed=graph.directed, n_jobs=n_jobs,
+                search=search, patience=patience, stats=stats, on_result=save_result,
+                resume=resume, done=done,
+                timeout=timeout, cancelled=cancelled,
+                cpu_limit=cpu_limit or None, memory_limit=memory_limit * 2**20 or None,
+                run_backend=run_backend, tmpfs_root=settings.LINKAGE_TMPFS_ROOT)
+        finally:
+            # the last progress is written before the final state of the job
+            progress.close()
+    except (graph_processing.runner.Timeout, graph_processing.runner.Cancelled) as e:
+        if not Graph.objects.filter(pk=graph.pk).exists():
+            return None # deleted while running
+        graph.job_error_log = 'Clustering cancelled' if isinstance(e, graph_processing.runner.Cancelled) \
+            else 'Clustering took too long'
+        graph.job_progress = 1
+        save_or_retry(graph)
+        response_cache.invalidate(graph)
+        send_job_message(graph, 'DONE', retries=20)
+        return None
+
+    if stats['warnings']:
+        log += '[linkage-web] warnings:\n' + ''.join('    %s\n' % warning for warning in stats['warnings'])
+
+    if cache_size > 0:
+        result_cache.record(cache_hits, len(results))
+        result_cache.evict(cache_size)
+        log += '[linkage-web] result cache: %d models reused, %d computed (hit rate: %.0f%%)\n' % (
+            cache_hits, len(results), 100 * result_cache.hit_rate())
+
+    graph.job_current_step = 'Clustering'
+    graph.job_log = log
+    graph.job_models_skipped = stats['models_skipped']
+    graph.job_time = (time.time() - t) / 100
+    graph.job_progress = 1;
 
+    # the final state is saved in the Graph row before the message is sent
     save_or_retry(graph)
+    JobStatus.objects.filter(graph=graph).update(step=graph.job_current_step, progress=1)
+    response_cache.invalidate(graph)
+
+    if global_preferences['linkage_layout__iterations'] and multilevel_layout(graph, global_preferences):
+        # the layout bumps the version of the results, the export is built after it
+        spacialize_graph.delay(graph.pk, multilevel=True)
+    else:
+        prebuild_export(graph, global_preferences)
 
     time.sleep(ws_delay)
 
-    Group("jobs-%d" % graph.user.pk).send({
-        'text': '%d - DONE' % graph.pk
-    })
+    send_job_message(graph, 'DONE', retries=20)
 
     return None
 
 
+def prebuild_export(graph, global_preferences):
+    """Queue build_export for the current version of the results if the graph is big enough"""
+    from core.models import ProcessingResult
+
+    prebuild_size = global_preferences['linkage_export__prebuild_size']
+    if prebuild_size and graph.counts()[0] * ProcessingResult.objects.filter(graph=graph).count() >= prebuild_size:
+        build_export.delay(graph.pk)
+
+
+@task()
+def build_export(graph_pk):
+    """Write the zip export of all the results of a graph to disk, served instead of streaming it"""
+    from core import models
+    from django.conf import settings
+
+    graph = models.Graph.objects.get(pk=graph_pk)
+    path = models.export_path(graph)
+    if os.path.exists(path):
+        return
+    os.makedirs(settings.LINKAGE_EXPORTS_ROOT, exist_ok=True)
+    results = models.ProcessingResult.objects \
+        .filter(graph=graph) \
+        .order_by('-crit') \
+        .exclude(crit=None)
+    with tempfile.NamedTemporaryFile(dir=settings.LINKAGE_EXPORTS_ROOT, suffix='.tmp', delete=False) as f:
+        for chunk in models.iter_export_zip(graph, results):
+            f.write(chunk)
+    os.rename(f.name, path)
+
+    # the exports of the previous versions of the results
+    models.remove_exports(graph, keep=path)
+    print('export built', path)
+
+
 @task()
 def retrieve_graph_data(graph_pk, method, **params):
     from core import third_party_import, models
@@ -108,9 +356,7 @@ def retrieve_graph_data(graph_pk, method, **params):
     graph = models.Graph.objects.get(pk=graph_pk)
     graph.job_current_step = 'Retrieving data'
     graph.save()
-    Group("jobs-%d" % graph.user.pk).send({
-        'text': '%d - STEP UPDATE' % graph.pk
-    })
+    send_job_message(graph, 'STEP UPDATE')
 
     ignore_self_loop = params.pop('ignore_self_loop', True)
     filter_largest_subgraph = params.pop('filter_largest_subgraph', False)
@@ -137,9 +383,7 @@ def retrieve_graph_data(graph_pk, method, **params):
         graph.job_progress = 1.0
         graph.save()
         time.sleep(1)
-        Group("jobs-%d" % graph.user.pk).send({
-            'text': '%d - ERROR' % graph.pk
-        })
+        send_job_message(graph, 'ERROR', retries=20)
         if exception_triggered:
             raise exception_triggered
         return
@@ -151,65 +395,134 @@ def save_csv(graph_pk, csv_content):
     graph = models.Graph.objects.get(pk=graph_pk)
     graph.original_csv = csv_content
     graph.save()
+    graph.update_status(has_original_csv=len(csv_content) > 0)
     print('CSV SAVED')
 
 
 @task()
-def import_graph_data(graph_pk, csv_content, filter_largest_subgraph=False, ignore_self_loop=True):
-    open('last_graph.csv','w').write(csv_content)
+def import_graph_data(graph_pk, csv_content, filter_largest_subgraph=False, ignore_self_loop=True, csv_path=None):
+    if csv_path is None:
+        open('last_graph.csv','w').write(csv_content)
     # print('received csv_content:', csv_content[:100])
     from core import models
+    from django.conf import settings
     graph = models.Graph.objects.get(pk=graph_pk)
 
     graph.job_current_step = 'Making the graph'
     graph.save()
-    Group("jobs-%d" % graph.user.pk).send({
-        'text': '%d - STEP UPDATE' % graph.pk
-    })
+    send_job_message(graph, 'STEP UPDATE')
+
+    from dynamic_preferences.registries import global_preferences_registry
+    global_preferences = global_preferences_registry.manager()
+    import_options = {
+        'n_workers': global_preferences['linkage_import__n_workers'],
+        'stem_cache_size': global_preferences['linkage_import__stem_cache_size'],
+        'stem_cache_dir': settings.LINKAGE_STEM_CACHE_DIR,
+    }
 
     error = None
     try:
-        data = models.graph_data_from_links(csv_content,
-            filter_largest_subgraph=filter_largest_subgraph,
-            ignore_self_loop=True, # TODO: remove self loop concept from linkage
-            directed=graph.directed)
-        for key in data:
-            setattr(graph, key, data[key])
+        if csv_path:
+            # big uploads are streamed from disk instead of being loaded in memory
+            try:
+                with tempfile.TemporaryDirectory() as out_dir:
+                    paths = models.stream_graph_data(csv_path, out_dir,
+                        filter_largest_subgraph=filter_largest_subgraph,
+                        ignore_self_loop=True, # TODO: remove self loop concept from linkage
+                        directed=graph.directed,
+                        **import_options)
+                    # parsed from the files, never loaded whole
+                    with models.open_graph_data(paths) as data:
+                        graph.set_data(**data)
+            finally:
+                # also when the import fails, the upload is not kept
+                os.remove(csv_path)
+        else:
+            data = models.graph_data_from_links(csv_content,
+                filter_largest_subgraph=filter_largest_subgraph,
+                ignore_self_loop=True, # TODO: remove self loop concept from linkage
+                directed=graph.directed,
+                **import_options)
+            graph.set_data(**data)
         # duplicate keys triggered "duplicate key value violates unique constraint "core_graph_pkey" because of this fix
         # graph.save(force_insert=True) # https://sentry.io/linkage/linkage/issues/314092204/ "Save with update_fields did not affect any rows."
         graph.save()
+        graph.update_stats()
     except Exception as e:
         graph.job_error_log = 'Error while importing'
         graph.job_progress = 1.0
         graph.save()
         time.sleep(1)
-        Group("jobs-%d" % graph.user.pk).send({
-            'text': '%d - ERROR' % graph.pk
-        })
+        send_job_message(graph, 'ERROR', retries=20)
         raise e
 
-    if len(graph.labels.strip()) < 2:
+    if len(graph.arrays.labels) == 0:
         graph.job_error_log = 'No data to process for this graph'
         graph.job_progress = 1.0
         graph.save()
         time.sleep(1)
-        Group("jobs-%d" % graph.user.pk).send({
-            'text': '%d - ERROR' % graph.pk
-        })
+        send_job_message(graph, 'ERROR', retries=20)
         return
 
-    # TODO: re-enable spacialization
-    # spacialize_graph.delay(graph.pk)
+    # the big graphs are laid out from their clusters at the end of the clustering
+    if global_preferences['linkage_layout__iterations'] and not multilevel_layout(graph, global_preferences):
+        spacialize_graph.delay(graph.pk)
     # save_csv.delay(graph.pk, csv_content)
     process_graph.delay(graph.pk, ws_delay=2)
 
 
+def multilevel_layout(graph, global_preferences):
+    """
+    Whether the graph is big enough to be laid out from its clusters, and there are processes to lay
+    them out in parallel: on one process the clusters take as long as the flat layout with as many
+    iterations, plus the refinement of the whole graph
+    """
+    multilevel_nodes = global_preferences['linkage_layout__multilevel_nodes']
+    return bool(multilevel_nodes) and global_preferences['linkage_layout__n_workers'] > 1 \
+        and graph.counts()[1] >= multilevel_nodes
+
+
 @task()
-def spacialize_graph(graph_pk):
-    from core import models
+def spacialize_graph(graph_pk, multilevel=None):
+    """
+    Lay the graph out once for all, the clusters of its results are placed at the center of their nodes.
+    The multilevel layout (the default for the big graphs if `multilevel` is None) starts from the
+    clusters of the best result, the graphs without results yet are laid out flat.
+    """
+    from core import models, response_cache
+
+    from dynamic_preferences.registries import global_preferences_registry
+    global_preferences = global_preferences_registry.manager()
+
     graph = models.Graph.objects.get(pk=graph_pk)
-    
-    print('spacialize', graph.pk)
-    spacialize(graph.edges, graph.labels, graph.pk)
-    print('spacialize DONE', graph.pk)
+    if multilevel is None:
+        multilevel = multilevel_layout(graph, global_preferences)
+    best = models.ProcessingResult.objects.filter(graph=graph).exclude(crit=None).order_by('-crit').first() \
+        if multilevel else None
+    clusters = best.clusters() if best else None
+
+    def deleted():
+        return not models.Graph.objects.filter(pk=graph_pk).exists()
 
+    print('spacialize', graph.pk, 'multilevel' if clusters is not None else 'flat')
+    t = time.time()
+    if clusters is not None:
+        positions = spacialize(graph.links(), len(graph.arrays.labels),
+            global_preferences['linkage_layout__multilevel_iterations'], cancelled=deleted,
+            clusters=clusters, pi=best.matrix('pi_mat'),
+            n_workers=global_preferences['linkage_layout__n_workers'])
+    else:
+        positions = spacialize(graph.links(), len(graph.arrays.labels),
+            global_preferences['linkage_layout__iterations'], cancelled=deleted)
+    if deleted():
+        return
+    graph.set_layout(positions)
+    save_or_retry(graph)
+    for result in models.ProcessingResult.objects.filter(graph=graph):
+        result.update_layout(positions)
+        save_or_retry(result)
+    response_cache.invalidate(graph)
+    if models.Graph.objects.filter(pk=graph_pk, job_progress__gte=1).exists():
+        # laid out after the end of the job, the export of the previous version is orphaned
+        prebuild_export(graph, global_preferences)
+    print('spacialize DONE', graph.pk, '%.1fs' % (time.time() - t))
@@ -101,6 +101,23 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'collected_static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'user_uploads')
+# content-addressed store of the graphs and results arrays (see core.array_store)
+LINKAGE_ARRAYS_ROOT = os.path.join(BASE_DIR, 'arrays')
+# zip exports of the big jobs, built by config.celery.build_export
+LINKAGE_EXPORTS_ROOT = os.path.join(BASE_DIR, 'exports')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # responses of the finished jobs (see core.response_cache), shared by the processes
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'responses_cache'),
+        'TIMEOUT': 7 * 24 * 3600,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
 
 # CELERY
 BROKER_URL = 'redis://localhost:6379'
@@ -109,6 +126,12 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+# longest clustering job, in seconds: linkage_cpp__timeout is capped to it
+LINKAGE_JOB_MAX_TIME = 6 * 3600
+# process_graph is acked at its end: a job still unacked after this delay is delivered to another
+# worker. Just above the longest job, so that the job of a crashed worker is resumed soon and a job
+# still running is not delivered twice (see graph_processing.run_dirs.lock_run)
+BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': LINKAGE_JOB_MAX_TIME + 600}
 
 CHANNEL_LAYERS = {
     "default": {
@@ -133,6 +156,12 @@ CAN_LOGIN_AS = lambda request, target_user: request.user.is_superuser
 
 LINKAGE_ENTERPRISE = False
 
+# directory of the on-disk stemming cache shared by the imports (None to only cache in memory)
+LINKAGE_STEM_CACHE_DIR = None
+
+# memory-backed filesystem used by the 'tmpfs' run backend of linkage-cpp (see graph_processing.run_dirs)
+LINKAGE_TMPFS_ROOT = '/dev/shm'
+
 
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 524288000
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.apps import apps
 from django.conf import settings
 
-from core.models import Graph, ProcessingResult
+from core.models import Graph, ProcessingResult, CacheStat
 
 
 admin.site.site_header = 'Linkage'
@@ -27,6 +27,11 @@ class ProcessingResultAdmin(admin.ModelAdmin):
     exclude = ('topics_per_edges_mat', 'topics_mat')
 
 
+@admin.register(CacheStat)
+class CacheStatAdmin(admin.ModelAdmin):
+    list_display = ('name', 'hits', 'misses', 'hit_rate')
+
+
 # auto-register all models
 app = apps.get_app_config('core')
 
@@ -0,0 +1,199 @@
+"""
+Content-addressed store of numpy arrays
+
+A bundle of named arrays is saved as .npy files in a directory named after the
+sha256 of their content: identical bundles are only stored once and the arrays
+are loaded memory-mapped, without copying them.
+
+Also holds the converters between the ASCII formats used by linkage-cpp and
+the frontend ("row col value" coordinate matrices, space separated CSV rows)
+and their array counterparts.
+"""
+import csv, hashlib, io, os, re, shutil, sys, tempfile, time
+
+import numpy as np
+from django.conf import settings
+
+csv.field_size_limit(sys.maxsize) # http://stackoverflow.com/questions/15063936/csv-error-field-larger-than-field-limit-131072
+
+
+def _path(key):
+    return os.path.join(settings.LINKAGE_ARRAYS_ROOT, key[:2], key)
+
+
+def put(arrays):
+    """Store a {name: array} bundle, returns its key"""
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    digest = hashlib.sha256()
+    for name in sorted(arrays):
+        array = arrays[name]
+        digest.update(('%s %s %s\n' % (name, array.dtype.str, array.shape)).encode())
+        digest.update(array.reshape(-1).view(np.uint8)) # without copying the array
+    key = digest.hexdigest()
+
+    path = _path(key)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path))
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), array)
+        try:
+            os.rename(tmp_path, path)
+        except OSError: # the same bundle has been stored in the meantime
+            shutil.rmtree(tmp_path)
+    return key
+
+
+def array_path(key, name):
+    """Path of the .npy file of one array of a bundle"""
+    return os.path.join(_path(key), name + '.npy')
+
+
+def get(key, name, mmap=True):
+    """Load one array of a bundle, memory-mapped (read-only) by default"""
+    return np.load(array_path(key, name), mmap_mode='r' if mmap else None)
+
+
+def exists(key):
+    return bool(key) and os.path.isdir(_path(key))
+
+
+def clean(referenced, min_age=24 * 3600, dry_run=False):
+    """
+    Remove the bundles whose key is not in `referenced`, and the leftovers of interrupted puts,
+    stored more than `min_age` seconds ago: a bundle is stored before the row referencing it is
+    saved. Returns the number of directories removed and their size in bytes.
+    """
+    root = settings.LINKAGE_ARRAYS_ROOT
+    if not os.path.isdir(root):
+        return 0, 0
+    before = time.time() - min_age
+    removed, size = 0, 0
+    for prefix in os.listdir(root):
+        for name in os.listdir(os.path.join(root, prefix)):
+            path = os.path.join(root, prefix, name)
+            if name in referenced or os.path.getmtime(path) > before:
+                continue
+            removed += 1
+            size += sum(os.path.getsize(os.path.join(path, file)) for file in os.listdir(path))
+            if not dry_run:
+                shutil.rmtree(path, ignore_errors=True)
+    return removed, size
+
+
+class StringTable:
+    """Strings stored as one utf-8 buffer plus the offset of each string in it"""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+    @classmethod
+    def from_text(cls, text):
+        """From a space separated CSV row, like Graph.labels and Graph.dictionnary, a string or a text file"""
+        rows = list(csv.reader([text] if isinstance(text, str) else text, delimiter=' '))
+        return cls.from_strings(rows[0] if rows else [])
+
+    @classmethod
+    def load(cls, key, name):
+        return cls(get(key, name), get(key, name + '.offsets'))
+
+    def arrays(self, name):
+        return {name: self.data, name + '.offsets': self.offsets}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('string table index out of range')
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def to_text(self):
+        output = io.StringIO()
+        csv.writer(output, delimiter=' ').writerow(list(self))
+        return output.getvalue()
+
+
+SP_MAT_BLOCK = 1 << 18 # characters of a coordinate matrix parsed at once
+
+
+def _line_blocks(text):
+    """Blocks of whole lines of about SP_MAT_BLOCK characters of a string or a text file"""
+    if isinstance(text, str):
+        start = 0
+        while start < len(text):
+            end = text.find('\n', start + SP_MAT_BLOCK)
+            end = len(text) if end == -1 else end + 1
+            yield text[start:end]
+            start = end
+        return
+    rest = ''
+    while True:
+        block = text.read(SP_MAT_BLOCK)
+        if not block:
+            break
+        end = block.rfind('\n') + 1
+        if end:
+            yield rest + block[:end]
+            rest = block[end:]
+        else:
+            rest += block
+    if rest:
+        yield rest
+
+
+def parse_sp_mat(text):
+    """
+    ASCII coordinate matrix ("row col value" lines), a string or a text file -> int32 array of
+    shape (n, 3), parsed a block of lines at a time: the memory used beyond the text is the array
+    """
+    if isinstance(text, str):
+        n_lines = text.count('\n') + 1
+    else:
+        # a first pass on the file to allocate the array once
+        start = text.tell()
+        n_lines = 1 + sum(block.count('\n') for block in iter(lambda: text.read(SP_MAT_BLOCK), ''))
+        text.seek(start)
+    values = np.empty(3 * n_lines, dtype=np.int32)
+    n_values = 0
+    for block in _line_blocks(text):
+        block = np.array(block.split(), dtype=np.float64)
+        values[n_values:n_values + len(block)] = block
+        n_values += len(block)
+    return values[:n_values].reshape(-1, 3)
+
+
+def format_sp_mat(array):
+    """int array of shape (n, 3) -> ASCII coordinate matrix, as written by graph_data_from_links"""
+    return ''.join('%d %d %d\r\n' % tuple(row) for row in array.tolist())
+
+
+def parse_txt_mat(text):
+    """ASCII matrix written by linkage-cpp (rows of space or comma separated values) -> float32 2d array"""
+    rows = [[value for value in re.split(r'[\s,]+', line) if value] for line in text.split('\n')]
+    rows = [row for row in rows if row]
+    if len(set(len(row) for row in rows)) > 1:
+        raise ValueError('rows of different lengths')
+    return np.array(rows, dtype=np.float64).astype('<f4').reshape(len(rows), len(rows[0]) if rows else 0)
+
+
+def format_txt_mat(array, delimiter=' '):
+    """2d array -> ASCII matrix, one row per line"""
+    return ''.join(delimiter.join('%.7g' % value for value in row) + '\n' for row in array.tolist())
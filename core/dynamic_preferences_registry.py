@@ -1,6 +1,6 @@
 # blog/dynamic_preferences_registry.py
 
-from dynamic_preferences.types import IntegerPreference, Section
+from dynamic_preferences.types import IntegerPreference, ChoicePreference, Section
 from dynamic_preferences.registries import global_preferences_registry
 
 # we create some section objects to link related preferences together
@@ -26,3 +26,115 @@ class LDARepeatTitle(IntegerPreference):
     section = linkage_cpp
     name = 'n_repeat'
     default = 4
+
+
+@global_preferences_registry.register
+class LinkageJobs(IntegerPreference):
+    section = linkage_cpp
+    name = 'n_jobs'
+    default = 1
+
+
+@global_preferences_registry.register
+class LinkageSearchPatience(IntegerPreference):
+    section = linkage_cpp
+    name = 'search_patience'
+    default = 2
+
+
+@global_preferences_registry.register
+class LinkageResultCacheSize(IntegerPreference):
+    section = linkage_cpp
+    name = 'result_cache_size'
+    default = 1000
+
+
+@global_preferences_registry.register
+class LinkageTimeout(IntegerPreference):
+    section = linkage_cpp
+    name = 'timeout'
+    default = 0 # seconds for a whole job, 0 for settings.LINKAGE_JOB_MAX_TIME (the most allowed)
+
+
+@global_preferences_registry.register
+class LinkageCPULimit(IntegerPreference):
+    section = linkage_cpp
+    name = 'cpu_limit'
+    default = 0 # CPU seconds per linkage-cpp process, 0 for no limit
+
+
+@global_preferences_registry.register
+class LinkageMemoryLimit(IntegerPreference):
+    section = linkage_cpp
+    name = 'memory_limit'
+    default = 0 # MB per linkage-cpp process, 0 for no limit
+
+
+@global_preferences_registry.register
+class LinkageRunBackend(ChoicePreference):
+    section = linkage_cpp
+    name = 'run_backend'
+    choices = (
+        ('disk', 'Disk'),
+        ('tmpfs', 'tmpfs (LINKAGE_TMPFS_ROOT)'),
+        ('fifo', 'Disk, inputs through named pipes (experimental, falls back to disk)'),
+    )
+    default = 'disk'
+
+
+linkage_import = Section('linkage_import')
+
+
+@global_preferences_registry.register
+class ImportWorkers(IntegerPreference):
+    section = linkage_import
+    name = 'n_workers'
+    default = 1
+
+
+@global_preferences_registry.register
+class ImportStemCacheSize(IntegerPreference):
+    section = linkage_import
+    name = 'stem_cache_size'
+    default = 100000
+
+
+linkage_export = Section('linkage_export')
+
+
+@global_preferences_registry.register
+class ExportPrebuildSize(IntegerPreference):
+    section = linkage_export
+    name = 'prebuild_size'
+    default = 1000000 # edges x results from which the zip export is built on disk when a job ends, 0 to never
+
+
+linkage_layout = Section('linkage_layout')
+
+
+@global_preferences_registry.register
+class LayoutIterations(IntegerPreference):
+    section = linkage_layout
+    name = 'iterations'
+    default = 100 # of ForceAtlas2 after the import, 0 to not lay the graphs out
+
+
+@global_preferences_registry.register
+class LayoutMultilevelNodes(IntegerPreference):
+    section = linkage_layout
+    name = 'multilevel_nodes'
+    default = 50000 # nodes from which the graphs are laid out from their clusters once clustered, 0 to never
+
+
+@global_preferences_registry.register
+class LayoutMultilevelIterations(IntegerPreference):
+    section = linkage_layout
+    name = 'multilevel_iterations'
+    default = 30 # of ForceAtlas2 on each cluster
+
+
+@global_preferences_registry.register
+class LayoutWorkers(IntegerPreference):
+    section = linkage_layout
+    name = 'n_workers'
+    default = 1 # processes laying the clusters out in parallel, the multilevel layout needs at least 2
@@ -0,0 +1,150 @@
+"""
+HTTP layer shared by the bibliographic importers (core.third_party_import)
+
+    resp = http_fetch.get(url, params=params)
+    for resp in http_fetch.get_many((url, params) for params in pages):
+        ...
+
+The connections are pooled in one requests.Session per process. At most a few
+requests run at the same time on each host, spaced by the minimum interval of
+the host if any (the NCBI E-utilities allow 3 requests per second without an
+API key). Connection errors, timeouts, 429 and 5xx responses are retried with
+an exponential backoff, or after the Retry-After delay given by the server.
+"""
+import collections, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+TIMEOUT = 60 # seconds to connect, or without receiving anything
+RETRIES = 4
+BACKOFF = 1 # seconds before the first retry, doubled for each of the next ones
+MAX_RETRY_AFTER = 120 # seconds, longer Retry-After delays are shortened
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_IN_FLIGHT = 16 # requests of get_many fetched ahead of the one being read
+
+PER_HOST = 4 # requests at the same time on a host
+# (requests at the same time, seconds between two requests) for the hosts with their own limits
+HOST_LIMITS = {
+    'eutils.ncbi.nlm.nih.gov': (3, 1 / 3),
+    'www.medrxiv.org': (20, 0),
+}
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+_hosts = {}
+
+
+class _Host:
+    """Requests in flight and time of the next request allowed on a host"""
+
+    def __init__(self, concurrency, interval):
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.interval = interval
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, delay):
+        """No request for `delay` seconds, when the host says it gets too many"""
+        with self.lock:
+            self.next_time = max(self.next_time, time.monotonic() + delay)
+
+
+def session():
+    """Session of this process, the pooled connections are not shared with the forked processes"""
+    global _session, _session_pid
+    with _lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=max(MAX_IN_FLIGHT, PER_HOST,
+                *[concurrency for concurrency, _ in HOST_LIMITS.values()]))
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+            _session_pid = os.getpid()
+        return _session
+
+
+def _host(url):
+    host = urlsplit(url).netloc
+    with _lock:
+        if host not in _hosts:
+            _hosts[host] = _Host(*HOST_LIMITS.get(host, (PER_HOST, 0)))
+        return _hosts[host]
+
+
+def _retry_after(resp):
+    """Seconds to wait given by the Retry-After header of `resp`, None if missing"""
+    value = resp.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(delay, 0), MAX_RETRY_AFTER)
+
+
+def get(url, params=None, **kwargs):
+    """
+    requests.get through the shared session, within the limits of the host, retried,
+    requests.HTTPError is raised for the error statuses once the retries are exhausted
+    """
+    host = _host(url)
+    kwargs.setdefault('timeout', TIMEOUT)
+    for attempt in range(RETRIES + 1):
+        with host.slots:
+            host.wait()
+            try:
+                resp = session().get(url, params=params, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == RETRIES:
+                    raise
+                resp, error = None, e
+        if resp is not None:
+            if resp.status_code not in RETRY_STATUSES or attempt == RETRIES:
+                resp.raise_for_status()
+                return resp
+            error = resp.status_code
+
+        delay = _retry_after(resp) if resp is not None else None
+        if delay is None:
+            delay = BACKOFF * 2 ** attempt
+        if resp is not None and resp.status_code == 429:
+            host.pause(delay)
+        print('HTTP error for %s (%s), retry in %.1fs' % (url, error, delay))
+        time.sleep(delay)
+
+
+def get_many(requests_params, max_in_flight=MAX_IN_FLIGHT, **kwargs):
+    """
+    Responses to the (url, params) of `requests_params`, in the same order, fetched concurrently
+    with at most `max_in_flight` of them ahead of the one being read
+    """
+    with ThreadPoolExecutor(max_in_flight) as executor:
+        pending = collections.deque()
+        try:
+            for url, params in requests_params:
+                pending.append(executor.submit(get, url, params, **kwargs))
+                if len(pending) >= max_in_flight:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # stopped early or failed, the requests not started yet are dropped
+            for future in pending:
+                future.cancel()
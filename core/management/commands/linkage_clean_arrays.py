@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from core import models, array_store
+
+# the fields of the models holding keys of the array store
+KEY_FIELDS = (
+    (models.Graph, ('data_key', 'layout_key')),
+    (models.ProcessingResult, ('data_key', 'top_nodes_key', 'quotient_key', 'cluster_layout_key')),
+)
+
+class Command(BaseCommand):
+    help = 'remove the bundles of the array store no graph or result refers to anymore'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=float, default=24,
+            help='hours since the bundles were stored, the recent ones may be about to be referenced')
+        parser.add_argument('--dry-run', action='store_true', help='only count the bundles to remove')
+
+    def handle(self, *args, **options):
+        referenced = set()
+        for model, fields in KEY_FIELDS:
+            for keys in model.objects.values_list(*fields).iterator():
+                referenced.update(keys)
+        referenced.discard('')
+
+        removed, size = array_store.clean(referenced, options['min_age'] * 3600, options['dry_run'])
+        print('%s %d bundles (%.1f MB), %d referenced' % ('would remove' if options['dry_run'] else 'removed',
+            removed, size / 2**20, len(referenced)))
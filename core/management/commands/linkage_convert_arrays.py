@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from core import models
+
+class Command(BaseCommand):
+    help = 'move the text data of old graphs and results to the array store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('graph_id', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        graphs = models.Graph.objects.filter(data_key='')
+        results = models.ProcessingResult.objects.filter(data_key='')
+        if options['graph_id']:
+            graphs = graphs.filter(pk__in=options['graph_id'])
+            results = results.filter(graph__pk__in=options['graph_id'])
+
+        for graph_pk in graphs.values_list('pk', flat=True):
+            graph = models.Graph.objects.get(pk=graph_pk)
+            graph.set_data(graph.edges, graph.tdm, graph.labels, graph.dictionnary)
+            graph.save()
+            graph.update_stats()
+            print('graph:', graph.pk, 'converted to', graph.data_key)
+
+        for result_pk in results.values_list('pk', flat=True):
+            result = models.ProcessingResult.objects.get(pk=result_pk)
+            result.set_matrices(**{name: getattr(result, name) for name in result.MATRICES})
+            result.save()
+            print('result:', result.pk, 'converted to', result.data_key)
@@ -6,6 +6,9 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('graph_id', nargs='+', type=int)
+        parser.add_argument('--mode', choices=('auto', 'flat', 'multilevel'), default='auto',
+            help='multilevel starts from the clusters of the best result, auto for the big graphs with several '
+            'linkage_layout n_workers only')
 
     def handle(self, *args, **options):
         for graph_id in options['graph_id']:
@@ -17,5 +20,5 @@ class Command(BaseCommand):
                 raise CommandError('Graph "%s" does not exist' % graph_id)
 
             from config.celery import spacialize_graph
-            spacialize_graph.delay(graph.pk)
+            spacialize_graph.delay(graph.pk, multilevel={'auto': None, 'flat': False, 'multilevel': True}[options['mode']])
             print('job launched')
@@ -40,26 +40,23 @@ class Command(BaseCommand):
                 job_param_clusters_max=0,
                 job_param_topics_max=0,
                 job_progress=1,
-                labels=labels,
-                edges=X,
                 magic_too_big_to_display_X=True,
-                dictionnary=dictionnary,
-                tdm='0 0 1',
                 user=models.User.objects.get(pk=options['user_id'][0]),
             )
+            graph.set_data(edges=X, tdm='0 0 1', labels=labels, dictionnary=dictionnary)
 
-            result = models.ProcessingResult.objects.create(
-                graph=graph,
+            result = models.ProcessingResult(graph=graph, crit=1)
+            result.set_matrices(
                 clusters_mat=clusters,
                 topics_mat=beta,
                 topics_per_edges_mat=phi_sum,
                 rho_mat=rho,
                 pi_mat=pi,
                 theta_qr_mat=theta_qr,
-                crit=1,
             )
 
             print('graph', graph)
             graph.save()
+            graph.update_stats()
             print('result', result)
             result.save()
@@ -6,6 +6,8 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('graph_id', nargs='+', type=int)
+        parser.add_argument('--resume', action='store_true',
+            help='keep the existing results and the finished repetitions, only compute the missing ones and the failed ones')
 
     def handle(self, *args, **options):
         for graph_id in options['graph_id']:
@@ -15,11 +17,16 @@ class Command(BaseCommand):
             except models.Graph.DoesNotExist:
                 raise CommandError('Graph "%s" does not exist' % graph_id)
 
-            results = models.ProcessingResult.objects.filter(graph=graph)
-            print('removing', len(results), 'results')
-            results.delete()
+            graph.job_cancel_requested = False
+            graph.job_error_log = ''
+            graph.save()
+
+            if not options['resume']:
+                results = models.ProcessingResult.objects.filter(graph=graph)
+                print('removing', len(results), 'results')
+                results.delete()
 
             from config.celery import process_graph
-            process_graph.delay(graph.pk)
+            process_graph.delay(graph.pk, resume=options['resume'])
 
             print('job launched')
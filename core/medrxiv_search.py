@@ -1,7 +1,7 @@
-import requests
 from urllib.parse import quote_plus, urljoin
 from bs4 import BeautifulSoup
-from minet import multithreaded_fetch
+
+from . import http_fetch
 
 
 def extract_paper_data(url, html):
@@ -32,7 +32,7 @@ def search(q, verbose=False, limit=None):
     base_url = base_url.format(q, results_per_page)
 
     if verbose: print('fetch first page')
-    resp = requests.get(base_url)
+    resp = http_fetch.get(base_url)
     soup = BeautifulSoup(resp.text, 'lxml')
     links = list(extract_links(soup))
 
@@ -46,15 +46,12 @@ def search(q, verbose=False, limit=None):
                 last_page += 1
 
         pages_url = [base_url+str(page) for page in range(1, last_page)]
-        for result in multithreaded_fetch(pages_url, domain_parallelism=20):
-            if result.error is not None:
-                raise Exception(result.error)
-            else:
-                if verbose: print('page:', result.url)
-                html = result.response.data.decode('utf-8')
-                soup = BeautifulSoup(html, 'lxml')
-                links += extract_links(soup)
-                if verbose: print('links:', len(links))
+        for url, resp in zip(pages_url, http_fetch.get_many(((url, None) for url in pages_url), max_in_flight=20)):
+            if verbose: print('page:', url)
+            html = resp.content.decode('utf-8')
+            soup = BeautifulSoup(html, 'lxml')
+            links += extract_links(soup)
+            if verbose: print('links:', len(links))
 
     if limit is not None:
         links = links[:limit]
@@ -63,13 +60,10 @@ def search(q, verbose=False, limit=None):
     if verbose: print('fetching papers')
     papers = []
 
-    for result in multithreaded_fetch(links, domain_parallelism=20):
-        if result.error is not None:
-            raise Exception(result.error)
-        else:
-            html = result.response.data.decode('utf-8')
-            papers.append(extract_paper_data(result.url, html))
-            if verbose: print(len(papers), '/', len(links))
+    for url, resp in zip(links, http_fetch.get_many(((url, None) for url in links), max_in_flight=20)):
+        html = resp.content.decode('utf-8')
+        papers.append(extract_paper_data(url, html))
+        if verbose: print(len(papers), '/', len(links))
 
     return papers
 
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_auto_20180615_1307'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='graph',
+            name='data_key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 11:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_graph_data_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingresult',
+            name='data_key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
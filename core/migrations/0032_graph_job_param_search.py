@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0031_processingresult_data_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='graph',
+            name='job_param_search',
+            field=models.CharField(choices=[('grid', 'Full grid'), ('adaptive', 'Adaptive')], default='grid', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='graph',
+            name='job_models_skipped',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 14:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0033_result_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='graph',
+            name='job_cancel_requested',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 15:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0034_graph_job_cancel_requested'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobStatus',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('step', models.TextField(blank=True, default='')),
+                ('progress', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('graph', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='status', to='core.Graph')),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 16:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0035_jobstatus'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobstatus',
+            name='has_original_csv',
+            field=models.NullBooleanField(default=None),
+        ),
+        migrations.AddField(
+            model_name='jobstatus',
+            name='n_edges',
+            field=models.IntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='jobstatus',
+            name='n_nodes',
+            field=models.IntegerField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 16:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0036_jobstatus_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobstatus',
+            name='stats',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
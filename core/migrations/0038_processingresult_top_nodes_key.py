@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 17:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0037_jobstatus_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingresult',
+            name='top_nodes_key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 17:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0038_processingresult_top_nodes_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='graph',
+            name='results_updated_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='graph',
+            name='results_version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
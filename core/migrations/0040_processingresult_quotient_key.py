@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 19:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0039_graph_results_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingresult',
+            name='quotient_key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
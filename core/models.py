@@ -1,4 +1,4 @@
-import json
+import json, collections, contextlib
 
 from django.db import models
 from django.contrib.humanize.templatetags.humanize import naturaltime
@@ -21,6 +21,11 @@ class Graph(models.Model): # = Job
     job_param_topics = models.IntegerField(default=2)
     job_param_clusters_max = models.IntegerField(default=5)
     job_param_topics_max = models.IntegerField(default=5)
+    # 'grid' evaluates every (K, Q), 'adaptive' skips the regions with a lower crit
+    job_param_search = models.CharField(max_length=10, default='grid',
+        choices=(('grid', 'Full grid'), ('adaptive', 'Adaptive')))
+    job_models_skipped = models.IntegerField(default=0)
+    job_cancel_requested = models.BooleanField(default=False)
     job_error_log = models.TextField(blank=True, default='')
     job_current_step = models.TextField(blank=True, default='Initialize')
 
@@ -35,7 +40,16 @@ class Graph(models.Model): # = Job
 
     original_csv = models.TextField(blank=True, default='')
 
+    # key in core.array_store of the binary edges/tdm/labels/dictionnary,
+    # the text fields above are only filled for the graphs imported before
+    data_key = models.CharField(max_length=64, blank=True, default='')
+    # key in core.array_store of the positions of the nodes, see layout()
+    layout_key = models.CharField(max_length=64, blank=True, default='')
+
     cluster_to_cluster_cutoff = models.FloatField(default=10**(-8))
+    # bumped each time the results or their labels change, see core.response_cache
+    results_version = models.IntegerField(default=0)
+    results_updated_at = models.DateTimeField(null=True, blank=True, default=None)
 
     magic_too_big_to_display_X = models.BooleanField(default=False)
     directed = models.BooleanField(default=True)
@@ -43,12 +57,156 @@ class Graph(models.Model): # = Job
     user = models.ForeignKey(User)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # text columns that can weigh megabytes, deferred when listing the jobs
+    HEAVY_FIELDS = ('edges', 'tdm', 'labels', 'dictionnary', 'original_csv', 'job_log')
+
+    def job_state(self):
+        """(step, progress) of the job, a running clustering updates its JobStatus instead of the graph"""
+        if self.job_progress < 1 and self.job_error_log == '':
+            try:
+                return self.status.step, self.status.progress
+            except JobStatus.DoesNotExist:
+                pass
+        return self.job_current_step, self.job_progress
+
+    def update_status(self, **fields):
+        """Update the JobStatus of the graph, created from the graph fields if missing"""
+        JobStatus.objects.get_or_create(graph=self,
+            defaults={'step': self.job_current_step, 'progress': self.job_progress})
+        JobStatus.objects.filter(graph=self).update(**fields)
+
+    def update_stats(self, stats=None):
+        """
+        Store the statistics of the graph and its number of edges and nodes in the JobStatus,
+        to be done once the data is set. They are computed from the data if not given
+        or computed by graph_data_from_links.
+        """
+        from graph_processing.stats import graph_stats
+
+        stats = stats or getattr(self, '_stats', None)
+        if stats is None:
+            arrays = self.arrays
+            stats = graph_stats(arrays.edges, arrays.tdm, len(arrays.labels), len(arrays.dictionnary),
+                directed=self.directed)
+        self.update_status(n_edges=stats['n_edges'], n_nodes=stats['n_nodes'], stats=json.dumps(stats))
+        return stats
+
+    def stats(self):
+        """Statistics of the graph (see graph_processing.stats), computed once for the graphs imported before"""
+        try:
+            if self.status.stats:
+                return json.loads(self.status.stats)
+        except JobStatus.DoesNotExist:
+            pass
+        return self.update_stats()
+
+    def counts(self):
+        """(n_edges, n_nodes) from the JobStatus, computed once for the graphs imported before"""
+        try:
+            if self.status.n_edges is not None:
+                return self.status.n_edges, self.status.n_nodes
+        except JobStatus.DoesNotExist:
+            pass
+        stats = self.update_stats()
+        return stats['n_edges'], stats['n_nodes']
+
+    def has_original_csv(self):
+        try:
+            if self.status.has_original_csv is not None:
+                return self.status.has_original_csv
+        except JobStatus.DoesNotExist:
+            pass
+        has_original_csv = len(self.original_csv) > 0
+        self.update_status(has_original_csv=has_original_csv)
+        return has_original_csv
+
     def get_absolute_url(self):
         return reverse('result', kwargs={'pk': self.pk})
 
     def __str__(self):
         return '"{}" {}'.format(self.name, naturaltime(self.created_at))
 
+    def set_data(self, edges, tdm, labels, dictionnary, stats=None):
+        """
+        Store the graph data given in the ASCII format of graph_data_from_links as binary arrays,
+        as strings or as the text files of open_graph_data, its JSON `stats` are stored by
+        update_stats() once the graph is saved
+        """
+        from core import array_store
+
+        arrays = {
+            'edges': array_store.parse_sp_mat(edges),
+            'tdm': array_store.parse_sp_mat(tdm),
+        }
+        arrays.update(array_store.StringTable.from_text(labels).arrays('labels'))
+        arrays.update(array_store.StringTable.from_text(dictionnary).arrays('dictionnary'))
+        self.data_key = array_store.put(arrays)
+        self.edges = self.tdm = self.labels = self.dictionnary = ''
+        self._arrays = None
+        self._stats = json.loads(stats) if stats else None
+
+    @property
+    def arrays(self):
+        """
+        GraphArrays of the graph: edges and tdm as int32 (n, 3) coordinate arrays,
+        labels and dictionnary as StringTables, memory-mapped from the array store
+        """
+        from core import array_store
+
+        if getattr(self, '_arrays', None) is None or self._arrays_key != self.data_key:
+            if self.data_key:
+                self._arrays = GraphArrays(
+                    edges=array_store.get(self.data_key, 'edges'),
+                    tdm=array_store.get(self.data_key, 'tdm'),
+                    labels=array_store.StringTable.load(self.data_key, 'labels'),
+                    dictionnary=array_store.StringTable.load(self.data_key, 'dictionnary'),
+                )
+            else:
+                self._arrays = GraphArrays(
+                    edges=array_store.parse_sp_mat(self.edges),
+                    tdm=array_store.parse_sp_mat(self.tdm),
+                    labels=array_store.StringTable.from_text(self.labels),
+                    dictionnary=array_store.StringTable.from_text(self.dictionnary),
+                )
+            self._arrays_key = self.data_key
+        return self._arrays
+
+    def links(self):
+        """(source, target) of the edges, in the order of the columns of the topics_per_edges_mat of the results"""
+        import numpy as np
+
+        edges = self.arrays.edges
+        return edges[edges[:, 2] != 0][:, :2].astype(np.int64)
+
+    def set_layout(self, positions):
+        """Store the (n_nodes, 2) positions computed by graph_processing.layout"""
+        import numpy as np
+        from core import array_store
+
+        self.layout_key = array_store.put({'positions': np.asarray(positions, dtype=np.float32)})
+
+    def layout(self):
+        """(n_nodes, 2) float32 positions of the nodes, None until laid out"""
+        from core import array_store
+
+        if not self.layout_key or not array_store.exists(self.layout_key):
+            return None
+        return array_store.get(self.layout_key, 'positions')
+
+    def text_data(self, name):
+        """ASCII version of edges/tdm/labels/dictionnary, for linkage-cpp and the frontend"""
+        from core import array_store
+
+        if not self.data_key:
+            return getattr(self, name)
+        array = getattr(self.arrays, name)
+        if name in ('edges', 'tdm'):
+            return array_store.format_sp_mat(array)
+        return array.to_text()
+
+
+GraphArrays = collections.namedtuple('GraphArrays', ['edges', 'tdm', 'labels', 'dictionnary'])
+
 
 @SaveTheChange
 class ProcessingResult(models.Model):
@@ -72,25 +230,317 @@ class ProcessingResult(models.Model):
     # json of {node/cluster : infos (pos + custom label)}
     nodes_meta = models.TextField(blank=True, default='')
 
+    # key in core.array_store of the float32 matrices, the text fields above
+    # are only filled for the results made before (or matrices that are not 2d)
+    data_key = models.CharField(max_length=64, blank=True, default='')
+
+    # key in core.result_cache of the inputs of this result, empty once evicted
+    cache_key = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    cache_used_at = models.DateTimeField(null=True, blank=True, default=None)
+
+    # key in core.array_store of the nodes of each cluster ranked by degree, see top_nodes()
+    top_nodes_key = models.CharField(max_length=64, blank=True, default='')
+    # key in core.array_store of the graph of the clusters, see quotient()
+    quotient_key = models.CharField(max_length=64, blank=True, default='')
+    # key in core.array_store of the positions of the clusters in the layout of the graph, see cluster_layout()
+    cluster_layout_key = models.CharField(max_length=64, blank=True, default='')
+
     created_at = models.DateTimeField(auto_now_add=True)
 
+    MATRICES = ('clusters_mat', 'topics_mat', 'topics_per_edges_mat', 'rho_mat', 'pi_mat', 'theta_qr_mat')
+    TXT_DELIMITERS = {'rho_mat': ','} # the others are space separated
+
     def __str__(self):
         return '{} ({}) K={}, Q={}'.format(naturaltime(self.created_at), self.graph.name,
             self.param_clusters, self.param_topics)
 
-    def serialize(self):
+    def set_matrices(self, **matrices):
+        """Store the ASCII matrices written by linkage-cpp as float32 arrays"""
+        from core import array_store
+
+        arrays = {}
+        for name in self.MATRICES:
+            text = matrices.get(name, '')
+            try:
+                arrays[name] = array_store.parse_txt_mat(text)
+                setattr(self, name, '')
+            except ValueError:
+                setattr(self, name, text)
+        self.data_key = array_store.put(arrays)
+
+    def matrix(self, name):
+        """float32 2d array of a matrix, memory-mapped from the array store"""
+        from core import array_store
+
+        text = getattr(self, name)
+        if text or not self.data_key:
+            return array_store.parse_txt_mat(text)
+        return array_store.get(self.data_key, name)
+
+    def text_matrix(self, name):
+        from core import array_store
+
+        text = getattr(self, name)
+        if text or not self.data_key:
+            return text
+        return array_store.format_txt_mat(self.matrix(name), self.TXT_DELIMITERS.get(name, ' '))
+
+    def binary_matrix(self, name):
+        """{dtype, shape, data} with the base64 of the little-endian float32 values"""
+        import base64
+
+        try:
+            matrix = self.matrix(name)
+        except ValueError:
+            return self.text_matrix(name)
         return {
-            'clusters_mat': self.clusters_mat,
-            'topics_mat': self.topics_mat,
-            'topics_per_edges_mat': self.topics_per_edges_mat,
-            'rho_mat': self.rho_mat,
-            'pi_mat': self.pi_mat,
-            'theta_qr_mat': self.theta_qr_mat,
+            'dtype': 'float32',
+            'shape': list(matrix.shape),
+            'data': base64.b64encode(matrix.astype('<f4', copy=False).tobytes()).decode('ascii'),
+        }
+
+    def clusters(self):
+        """int64 cluster of each node, None for a failed model (no crit, linkage-cpp wrote no clusters)"""
+        import numpy as np
+
+        if self.crit is None:
+            return None
+        clusters = self.matrix('clusters_mat')
+        if not clusters.size:
+            return None
+        return clusters[0].astype(np.int64)
+
+    def update_top_nodes(self):
+        """Rank the nodes of each cluster by degree once for all, stored in the array store, not for a failed model"""
+        import numpy as np
+        from core import array_store
+
+        clusters = self.clusters()
+        if clusters is None:
+            return
+        n_nodes, n_clusters = len(clusters), int(clusters.max()) + 1 if len(clusters) else 0
+
+        # sources and targets in the order of the edges
+        ends = self.graph.links().ravel()
+        ends = ends[ends < n_nodes]
+        degrees = np.bincount(ends, minlength=n_nodes)
+        first_seen = np.zeros(n_nodes, dtype=np.int64)
+        seen, first_index = np.unique(ends, return_index=True)
+        first_seen[seen] = first_index
+
+        # the nodes without edges are not ranked, the ties are in the order the nodes are first seen
+        nodes = np.flatnonzero(degrees)
+        nodes = nodes[np.lexsort((first_seen[nodes], -degrees[nodes], clusters[nodes]))]
+        offsets = np.zeros(n_clusters + 1, dtype=np.int64)
+        np.cumsum(np.bincount(clusters[nodes], minlength=n_clusters), out=offsets[1:])
+
+        self.top_nodes_key = array_store.put({'nodes': nodes.astype(np.int32), 'offsets': offsets})
+
+    def _top_nodes_arrays(self):
+        import numpy as np
+        from core import array_store
+
+        if not array_store.exists(self.top_nodes_key):
+            # results made before
+            self.update_top_nodes()
+            if not self.top_nodes_key:
+                # failed model, no cluster
+                return np.zeros(0, dtype=np.int32), np.zeros(1, dtype=np.int64)
+            self.save()
+        return array_store.get(self.top_nodes_key, 'nodes'), array_store.get(self.top_nodes_key, 'offsets')
+
+    def top_nodes(self, cluster=None, offset=0, limit=None):
+        """
+        Nodes of `cluster` ranked by decreasing degree, `limit` of them from `offset`,
+        or the list of the ranked nodes of every cluster if `cluster` is None
+        """
+        nodes, offsets = self._top_nodes_arrays()
+
+        def page(cluster):
+            start, end = offsets[cluster] + offset, offsets[cluster + 1]
+            if limit is not None:
+                end = min(end, start + limit)
+            return nodes[start:end].tolist()
+
+        if cluster is None:
+            return [page(cluster) for cluster in range(len(offsets) - 1)]
+        return page(cluster)
+
+    def n_top_nodes(self):
+        """Number of ranked nodes of each cluster"""
+        import numpy as np
+
+        _, offsets = self._top_nodes_arrays()
+        return np.diff(offsets).tolist()
+
+    def update_quotient(self):
+        """
+        Compute the graph of the clusters once for all, stored in the array store:
+        the number of nodes of each cluster, the number of edges from a cluster to another
+        and the topic with the highest total weight on these edges (-1 if none), not for a failed model
+        """
+        import numpy as np
+        from core import array_store
+
+        clusters = self.clusters()
+        if clusters is None:
+            return
+        links = self.graph.links()
+        n_clusters = max(int(clusters.max()) + 1 if len(clusters) else 0, self.param_clusters)
+
+        # the edges of the nodes beyond the clusters row are left out
+        inside = (links < len(clusters)).all(axis=1)
+        pairs = clusters[links[inside, 0]] * n_clusters + clusters[links[inside, 1]]
+        counts = np.bincount(pairs, minlength=n_clusters ** 2)
+
+        # the columns of topics_per_edges_mat are the edges in order, the first of the pairs
+        topics_per_edges = self.matrix('topics_per_edges_mat')
+        columns = np.flatnonzero(inside[:topics_per_edges.shape[1]])
+        weights = np.array([np.bincount(pairs[:len(columns)], weights=topic[columns], minlength=n_clusters ** 2)
+            for topic in topics_per_edges]).reshape(-1, n_clusters ** 2)
+        topics = np.where(weights.any(axis=0), weights.argmax(axis=0) if len(weights) else -1, -1)
+
+        self.quotient_key = array_store.put({
+            'sizes': np.bincount(clusters, minlength=n_clusters),
+            'counts': counts.reshape(n_clusters, n_clusters),
+            'topics': topics.reshape(n_clusters, n_clusters),
+        })
+
+    def quotient(self):
+        """Graph of the clusters as computed by update_quotient(), for the frontend"""
+        from core import array_store
+
+        if not array_store.exists(self.quotient_key):
+            # results made before
+            self.update_quotient()
+            if not self.quotient_key:
+                # failed model, no cluster
+                return {'sizes': [], 'edges': []}
+            self.save()
+        sizes = array_store.get(self.quotient_key, 'sizes')
+        counts = array_store.get(self.quotient_key, 'counts')
+        topics = array_store.get(self.quotient_key, 'topics')
+        pi = self.matrix('pi_mat')
+        if pi.shape != counts.shape:
+            pi = None
+        return {
+            'sizes': sizes.tolist(),
+            # [source cluster, target cluster, number of edges, topic, pi]
+            'edges': [[source, target, int(counts[source, target]), int(topics[source, target]),
+                    float(pi[source, target]) if pi is not None else None]
+                for source, target in zip(*[indexes.tolist() for indexes in counts.nonzero()])],
+        }
+
+    def update_layout(self, positions=None):
+        """Positions of the clusters, at the center of their nodes in the layout of the graph, not for a failed model"""
+        import numpy as np
+        from core import array_store
+
+        clusters = self.clusters()
+        positions = self.graph.layout() if positions is None else positions
+        if clusters is None or positions is None:
+            return
+        n = min(len(clusters), len(positions))
+        clusters, positions = clusters[:n], positions[:n].astype(np.float64)
+        sizes = np.bincount(clusters, minlength=self.param_clusters)
+        centers = np.stack([np.bincount(clusters, weights=positions[:, axis], minlength=len(sizes))
+            for axis in (0, 1)], axis=1) / np.maximum(sizes, 1)[:, None]
+        # the empty clusters are not placed
+        centers[sizes == 0] = np.nan
+        self.cluster_layout_key = array_store.put({'positions': centers.astype(np.float32)})
+
+    def cluster_layout(self):
+        """(n_clusters, 2) float32 positions of the clusters (nan for the empty ones), None until laid out"""
+        from core import array_store
+
+        if not self.cluster_layout_key or not array_store.exists(self.cluster_layout_key):
+            return None
+        return array_store.get(self.cluster_layout_key, 'positions')
+
+    def window_edges(self, source_clusters=None, target_clusters=None, offset=0, limit=None):
+        """
+        (indexes, total): indexes of the links going from a node of `source_clusters` to a node
+        of `target_clusters` (any cluster if None), `limit` of them from `offset`, and their total,
+        none for a failed model or with an end beyond the clusters row
+        """
+        import numpy as np
+
+        clusters = self.clusters()
+        if clusters is None:
+            return np.zeros(0, dtype=np.int64), 0
+        links = self.graph.links()
+        selected = (links < len(clusters)).all(axis=1)
+        links = np.where(selected[:, None], links, 0)
+        if source_clusters is not None:
+            selected &= np.isin(clusters[links[:, 0]], source_clusters)
+        if target_clusters is not None:
+            selected &= np.isin(clusters[links[:, 1]], target_clusters)
+        indexes = np.flatnonzero(selected)
+        end = len(indexes) if limit is None else offset + limit
+        return indexes[offset:end], len(indexes)
+
+    def serialize(self, binary=False, placeholders=None):
+        import numpy as np
+
+        placeholders = placeholders or {}
+        data = {}
+        for name in self.MATRICES:
+            if name in placeholders:
+                data[name] = placeholders[name]
+            else:
+                data[name] = self.binary_matrix(name) if binary else self.text_matrix(name)
+        data.update({
             'crit': self.crit,
             'param_clusters': self.param_clusters,
             'param_topics': self.param_topics,
             'nodes_meta': self.nodes_meta,
-        }
+        })
+        cluster_positions = self.cluster_layout()
+        # [x, y] of each cluster, null for the empty ones
+        data['cluster_positions'] = [None if np.isnan(x) else [x, y] for x, y in cluster_positions.round(3).tolist()] \
+            if cluster_positions is not None else None
+        return data
+
+
+class JobStatus(models.Model):
+    """
+    Step and progress of a running job, updated without writing the Graph row,
+    and the graph sizes, so the jobs page never reads the data columns of the graphs
+    """
+    graph = models.OneToOneField(Graph, related_name='status')
+    step = models.TextField(blank=True, default='')
+    progress = models.FloatField(default=0)
+    # None until computed
+    n_edges = models.IntegerField(null=True, blank=True, default=None)
+    n_nodes = models.IntegerField(null=True, blank=True, default=None)
+    has_original_csv = models.NullBooleanField(default=None)
+    # JSON of graph_processing.stats, empty until computed
+    stats = models.TextField(blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{}: {} ({:.0%})'.format(self.graph_id, self.step, self.progress)
+
+
+class CacheStat(models.Model):
+    """Hits and misses of a cache, shared by all the processes"""
+    name = models.CharField(max_length=50, unique=True)
+    hits = models.BigIntegerField(default=0)
+    misses = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return '{}: {:.1%} hits'.format(self.name, self.hit_rate)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+    @classmethod
+    def record(cls, name, hits=0, misses=0):
+        cls.objects.get_or_create(name=name)
+        cls.objects.filter(name=name).update(
+            hits=models.F('hits') + hits, misses=models.F('misses') + misses)
 
 
 class UserProfile(models.Model):
@@ -101,294 +551,440 @@ class UserProfile(models.Model):
         return '{}: {}'.format(self.user, self.org_type)
 
 
-def graph_data_from_links(links, filter_largest_subgraph=False, ignore_self_loop=True, directed=False):
-    print('start graph data')
-    import csv, random, io, sys, os
-    import collections
-    import time
-    import string
-    import Stemmer
+STREAM_BUFFER_SIZE = 1000000 # term counts kept in memory before spilling a sorted run to disk
+
+
+def _read_links(links):
+    """Iterate over the rows of the links, given as a path to a CSV file or as an iterable of rows"""
+    import csv, sys
 
     csv.field_size_limit(sys.maxsize) # http://stackoverflow.com/questions/15063936/csv-error-field-larger-than-field-limit-131072
 
-    import nltk.tokenize
-    from nltk.corpus import stopwords
-
-    stemmer = Stemmer.Stemmer('english')
-    stopwords = set(stopwords.words('english')).union(set(stopwords.words('french')))
-    punc_table = dict((ord(char), ' ') for char in string.punctuation if char not in '_-')
-
-    def tokenize(string):
-        string = string.translate(punc_table) # remove punctuation
-        for begin, end in nltk.tokenize.WhitespaceTokenizer().span_tokenize(string):
-            word = string[begin:end]
-            if not word.isdigit() and word not in stopwords:
-                yield word
-
-    X = io.StringIO()
-    X_writer = csv.writer(X, delimiter=' ')
-    DTM = io.StringIO()
-    DTM_writer = csv.writer(DTM, delimiter=' ')
-
-    links = list(csv.reader(io.StringIO(links)))
-
-    print('links loaded')
-
-    if filter_largest_subgraph:
-        # amazingly complex algorithm to find the subgraph and filter the links :)
-        groups = {}
-        groups_sizes = []
-        g = 0
-        for link in links:
-            if len(link) > 1:
-                source, target = link[0], link[1]
-                if source not in groups and target in groups:
-                    groups[source] = groups[target]
-                    groups_sizes[groups[target]] += 1
-                elif source in groups and target not in groups:
-                    groups[target] = groups[source]
-                    groups_sizes[groups[source]] += 1
-                elif source not in groups and target not in groups:
-                    groups[target], groups[source] = g, g
-                    groups_sizes.append(0)
-                    groups_sizes[g] += 2
-                    g += 1
-                elif groups[target] != groups[source]:
-                    if groups_sizes[groups[target]] > groups_sizes[groups[source]]:
-                        for node, group in groups.items():
-                            if group == groups[source]:
-                                groups[node] = groups[target]
-                    else:
-                        for node, group in groups.items():
-                            if group == groups[target]:
-                                groups[node] = groups[source]
-        best_group = groups_sizes.index(max(groups_sizes))
-
-        links = [link for link in links if len(link) > 1 and groups[link[0]] == best_group]
-
-        print('filtered largest subgraph')
-
-    if not directed:
-        # another amazing algo to symmetrize the links in case of undirected graphs
-        new_links = []
-        for link in links:
-            new_links.append(link)
-            new_links.append([link[1], link[0]] + link[2:])
-        links = new_links
-
-        print('symmetry forced')
-
-
-    nodes_i = {}  # fast lookup of index
-    terms_i = {}  # fast lookup of index
-    nodes = [] # labels
-    terms = [] # dictionnary
-    stemm_to_lemm = {}
-
-    def node_to_i(node):
-        if node in nodes_i:
-            return nodes_i[node]
-        nodes.append(node)
-        i = len(nodes) - 1
-        nodes_i[node] = i
-        return i
-
-    def term_to_i(term):
-        if term in terms_i:
-            return terms_i[term]
-        terms.append(term)
-        i = len(terms) - 1
-        terms_i[term] = i
-        return i
-
-    print('start making edges', len(links))
-
-    edges = collections.OrderedDict()
-    for link in links:
-        if len(link) > 1:
-
-            # tokenization
-            tokens = []
-            text = link[2] if len(link) > 2 else ''
-            tokens = list(tokenize(text))
-
-            # stemming
-            if len(tokens) > 0: # filter empty links
-                start = node_to_i(link[0])
-                end = node_to_i(link[1])
-                if not ignore_self_loop or start != end:
-                    edge_name = '%d,%d' % (start, end)
-                    if edge_name not in edges:
-                        edges[edge_name] = collections.Counter()
-                    doc_terms = edges[edge_name]
-                    for token, stemm in zip(tokens, stemmer.stemWords(tokens)):
-                        token = token.lower()
-                        if stemm in stemm_to_lemm:
-                            lemm = stemm_to_lemm[stemm]
-                        else:
-                            stemm_to_lemm[stemm] = token.lower()
-                            lemm = token
-                        doc_terms[lemm] += 1
-
-    print('edges made')
-
-    def key_to_order_for_tdm(edge_name):
-        start, end = [int(x) for x in edge_name.split(',')]
-        return start + end*len(nodes)
-
-    for curr_edge, edge_name in enumerate(sorted(edges.keys(), key=key_to_order_for_tdm)):
-        start, end = edge_name.split(',')
-        X_writer.writerow([start, end, 1])
-        for token, count in edges[edge_name].items():
-            DTM_writer.writerow([term_to_i(token), curr_edge, count])
-
-    # add empty link to make the matrix square if it's not already a square
-    start = end = len(nodes) - 1
-    edge_name = '%d,%d' % (start, end)
-    if edge_name not in edges:
-        X_writer.writerow([start, end, 0])
-
-    labels = io.StringIO()
-    labels_writer = csv.writer(labels, delimiter=' ')
-    labels_writer.writerow(nodes)
-
-    dictionnary = io.StringIO()
-    dictionnary_writer = csv.writer(dictionnary, delimiter=' ')
-    dictionnary_writer.writerow(terms)
+    if isinstance(links, str):
+        with open(links, newline='', encoding='utf-8') as f:
+            yield from csv.reader(f)
+    else:
+        yield from links
+
+
+def stream_graph_data(links, out_dir, filter_largest_subgraph=False, ignore_self_loop=True, directed=False,
+        buffer_size=STREAM_BUFFER_SIZE, n_workers=1, stem_cache_size=None, stem_cache_dir=None):
+    """
+    Streaming version of graph_data_from_links: the links are read one by one from a CSV
+    file path or an iterator of rows and `X.sp_mat`, `tdm.sp_mat`, `labels` and `dictionnary`
+    are written to out_dir.
+
+    The term counts per edge are spilled to sorted runs on disk every `buffer_size` tokens and
+    merged at the end, so the memory used only grows with the number of distinct nodes and terms.
+
+    The tokenization and stemming is spread over `n_workers` processes, the output is the
+    same whatever the number of workers. Each process keeps a cache of `stem_cache_size`
+    stemms, stored in `stem_cache_dir` if given (see core.text_processing.StemCache).
+
+    The statistics of the graph (see graph_processing.stats) are computed while the
+    edges are written and saved as JSON in `stats.json`.
+
+    Returns the paths of the written files, with the same keys as graph_data_from_links.
+    """
+    print('start graph data (streaming)')
+    import csv, os, tempfile
+    import collections
+    import heapq, itertools
+
+    from graph_processing.components import largest_component
+    from graph_processing.stats import GraphStats
+    from core.text_processing import process_links, STEM_CACHE_SIZE
+
+    if stem_cache_size is None:
+        stem_cache_size = STEM_CACHE_SIZE
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if filter_largest_subgraph and not isinstance(links, str):
+            # the filter needs two passes over the links, keep them on disk instead of in memory
+            spool_path = os.path.join(tmp_dir, 'links.csv')
+            with open(spool_path, 'w', newline='', encoding='utf-8') as spool:
+                csv.writer(spool).writerows(_read_links(links))
+            links = spool_path
+
+        def iter_links():
+            rows = _read_links(links)
+            if filter_largest_subgraph:
+                largest_subgraph = largest_component(
+                    (link[0], link[1]) for link in _read_links(links) if len(link) > 1)
+                print('filtered largest subgraph')
+                rows = (link for link in rows if len(link) > 1 and link[0] in largest_subgraph)
+            for link in rows:
+                yield link
+                # symmetrize the links in case of undirected graphs
+                if not directed and len(link) > 1:
+                    yield [link[1], link[0]] + link[2:]
+
+        nodes_i = {}  # fast lookup of index
+        terms_i = {}  # fast lookup of index
+        nodes = [] # labels
+        terms = [] # dictionnary
+
+        def node_to_i(node):
+            if node in nodes_i:
+                return nodes_i[node]
+            nodes.append(node)
+            i = len(nodes) - 1
+            nodes_i[node] = i
+            return i
+
+        def term_to_i(term):
+            if term in terms_i:
+                return terms_i[term]
+            terms.append(term)
+            i = len(terms) - 1
+            terms_i[term] = i
+            return i
+
+        # sorted runs of "start end term count", ordered like the final tdm (by end, then start)
+        runs = []
+        edges = {}
+
+        def flush_run():
+            run_path = os.path.join(tmp_dir, 'run%d' % len(runs))
+            with open(run_path, 'w', encoding='utf-8') as run:
+                for start, end in sorted(edges, key=lambda edge: (edge[1], edge[0])):
+                    for term, count in edges[start, end].items():
+                        run.write('%d\t%d\t%s\t%d\n' % (start, end, term, count))
+            runs.append(run_path)
+            edges.clear()
+
+        def read_run(run_path):
+            with open(run_path, encoding='utf-8') as run:
+                for line in run:
+                    start, end, term, count = line.rstrip('\n').split('\t')
+                    yield (int(end), int(start)), term, int(count)
+
+        print('start making edges')
+
+        n_buffered = 0
+        stats = {}
+        for source, target, lemms in process_links(iter_links(), ignore_self_loop, n_workers,
+                stem_cache_size=stem_cache_size, stem_cache_dir=stem_cache_dir, stats=stats):
+            start = node_to_i(source)
+            end = node_to_i(target)
+            if not ignore_self_loop or start != end:
+                if (start, end) not in edges:
+                    edges[start, end] = collections.Counter()
+                edges[start, end].update(lemms)
+                n_buffered += sum(lemms.values())
+                if n_buffered >= buffer_size:
+                    flush_run()
+                    n_buffered = 0
+        flush_run()
+
+        print('edges made, merging', len(runs), 'runs')
+        print('stem cache: hits=%d misses=%d' % (stats.get('stem_cache_hits', 0), stats.get('stem_cache_misses', 0)))
+
+        paths = {
+            'edges': os.path.join(out_dir, 'X.sp_mat'),
+            'tdm': os.path.join(out_dir, 'tdm.sp_mat'),
+            'labels': os.path.join(out_dir, 'labels'),
+            'dictionnary': os.path.join(out_dir, 'dictionnary'),
+            'stats': os.path.join(out_dir, 'stats.json'),
+        }
+        graph_stats = GraphStats(directed)
+
+        with open(paths['edges'], 'w', newline='', encoding='utf-8') as X, \
+                open(paths['tdm'], 'w', newline='', encoding='utf-8') as DTM:
+            X_writer = csv.writer(X, delimiter=' ')
+            DTM_writer = csv.writer(DTM, delimiter=' ')
+
+            # heapq.merge is stable, the counts of an edge are merged in the order of the runs
+            merged = heapq.merge(*[read_run(run_path) for run_path in runs], key=lambda record: record[0])
+            last_edge = None
+            for curr_edge, ((end, start), records) in enumerate(itertools.groupby(merged, key=lambda record: record[0])):
+                X_writer.writerow([start, end, 1])
+                doc_terms = collections.Counter()
+                for _, term, count in records:
+                    doc_terms[term] += count
+                graph_stats.add_edge(start, end, sum(doc_terms.values()))
+                for term, count in doc_terms.items():
+                    DTM_writer.writerow([term_to_i(term), curr_edge, count])
+                last_edge = (start, end)
+
+            # add empty link to make the matrix square if it's not already a square
+            start = end = len(nodes) - 1
+            if last_edge != (start, end):
+                X_writer.writerow([start, end, 0])
+
+    with open(paths['labels'], 'w', newline='', encoding='utf-8') as labels:
+        csv.writer(labels, delimiter=' ').writerow(nodes)
+
+    with open(paths['dictionnary'], 'w', newline='', encoding='utf-8') as dictionnary:
+        csv.writer(dictionnary, delimiter=' ').writerow(terms)
+
+    with open(paths['stats'], 'w', encoding='utf-8') as stats_file:
+        json.dump(graph_stats.result(len(nodes), len(terms)), stats_file)
 
     print('data done')
 
-    return {
-        'edges': X.getvalue(),
-        'tdm': DTM.getvalue(),
-        'labels': labels.getvalue(),
-        'dictionnary': dictionnary.getvalue()
-    }
+    return paths
 
 
-def export_to_zip(graph, results):
-    import csv, random, io, sys, os, zipfile
+def read_graph_data(paths):
+    """Load the files written by stream_graph_data as the strings stored in a Graph"""
+    data = {}
+    for key, path in paths.items():
+        with open(path, newline='', encoding='utf-8') as f:
+            data[key] = f.read()
+    return data
 
-    zip_out = io.BytesIO()
-    z = zipfile.ZipFile(zip_out, 'w')
 
-    # edges.csv
+@contextlib.contextmanager
+def open_graph_data(paths):
+    """
+    The files written by stream_graph_data opened for Graph.set_data, which parses them a block
+    at a time instead of loading them whole like read_graph_data
+    """
+    with contextlib.ExitStack() as files:
+        data = {key: files.enter_context(open(path, newline='', encoding='utf-8'))
+            for key, path in paths.items() if key != 'stats'}
+        with open(paths['stats'], encoding='utf-8') as f:
+            data['stats'] = f.read()
+        yield data
+
+
+def graph_data_from_links(links, filter_largest_subgraph=False, ignore_self_loop=True, directed=False, **options):
+    """In-memory version of stream_graph_data, the extra options are passed to it"""
+    import csv, io, tempfile
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        paths = stream_graph_data(csv.reader(io.StringIO(links)), out_dir,
+            filter_largest_subgraph=filter_largest_subgraph,
+            ignore_self_loop=ignore_self_loop,
+            directed=directed,
+            **options)
+        return read_graph_data(paths)
+
+
+EXPORT_CHUNK_SIZE = 1 << 20 # characters of a zip member generated at once
+EXPORT_CHUNK_ROWS = 50000 # rows of a matrix formatted at once
+
+
+class _ZipOutput:
+    """Unseekable file for zipfile, keeping what is written until it is popped"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _csv_chunks(rows):
+    import csv, io
+
     output = io.StringIO()
     writer = csv.writer(output)
-    labels = list(csv.reader([graph.labels], delimiter=' '))[0]
-    dictionnary = list(csv.reader([graph.dictionnary], delimiter=' '))[0]
-    for line in csv.reader(graph.edges.split('\n'), delimiter=' '):
-        if len(line) == 3:
-            source, target, val = line
-            if val == '0':
-                continue
-            writer.writerow([labels[int(source)], labels[int(target)]])
-    edges_csv = output.getvalue()
-    z.writestr('edges.csv', output.getvalue())
-    z.writestr('raw/X.sp_mat', graph.edges)
-    z.writestr('raw/labels', graph.labels)
-    z.writestr('raw/tdm.sp_mat', graph.tdm)
-    z.writestr('raw/dictionnary', graph.dictionnary)
+    for row in rows:
+        writer.writerow(row)
+        if output.tell() >= EXPORT_CHUNK_SIZE:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+    yield output.getvalue()
+
+
+def _object_array(values):
+    """1d numpy array of python objects, even if they are sequences"""
+    import numpy as np
+
+    values = list(values)
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
+
+
+def _graph_text_chunks(graph, name):
+    from core import array_store
+
+    if graph.data_key and name in ('edges', 'tdm'):
+        array = getattr(graph.arrays, name)
+        for start in range(0, len(array), EXPORT_CHUNK_ROWS):
+            yield array_store.format_sp_mat(array[start:start + EXPORT_CHUNK_ROWS])
+    else:
+        yield graph.text_data(name)
+
+
+def _result_text_chunks(result, name):
+    from core import array_store
+
+    if getattr(result, name) or not result.data_key:
+        yield result.text_matrix(name)
+        return
+    matrix = result.matrix(name)
+    # row by row, a row of topics_per_edges_mat has a value per edge
+    for row in range(len(matrix)):
+        yield array_store.format_txt_mat(matrix[row:row + 1], result.TXT_DELIMITERS.get(name, ' '))
+
+
+def links_topics(links, clusters, topics_per_edges):
+    """
+    Topic of each (source, target) link, the one with the highest value in its column of
+    topics_per_edges (n_topics for the links without a column), and its weight in the
+    export: 2 for the links inside a cluster, 1 for the others
+    """
+    import numpy as np
+
+    n_topics, n_columns = topics_per_edges.shape
+    n_columns = min(n_columns, len(links))
+    best_topics = np.full(len(links), n_topics, dtype=np.int64)
+    if n_topics and n_columns:
+        best_topics[:n_columns] = np.argmax(topics_per_edges[:, :n_columns], axis=0)
+    weights = np.where(clusters[links[:, 0]] == clusters[links[:, 1]], 2, 1)
+    return best_topics, weights
+
+
+def iter_export_zip(graph, results):
+    """
+    Zip export of the graph and its results, generated member by member:
+    only a chunk of a member is in memory at once
+    """
+    import itertools, zipfile
+    import numpy as np
+
+    if results is None:
+        results = []
+    elif isinstance(results, ProcessingResult):
+        results = [results]
+
+    output = _ZipOutput()
+    z = zipfile.ZipFile(output, 'w')
+
+    def member(name, chunks):
+        # the sizes are not known in advance, zip64 allows members of more than 2GB
+        with z.open(name, 'w', force_zip64=True) as f:
+            for chunk in chunks:
+                f.write(chunk.encode('utf-8'))
+                yield output.pop()
+        yield output.pop()
+
+    # the labels, clusters and topics of the edges are looked up with numpy, by chunks of edges
+    links = graph.links()
+    sources, targets = links[:, 0], links[:, 1]
+    labels = _object_array(graph.arrays.labels)
+    dictionnary = list(graph.arrays.dictionnary)
+
+    def link_rows(*columns):
+        """Rows of the links, `columns` are the arrays of a value per link"""
+        for start in range(0, len(links), EXPORT_CHUNK_ROWS):
+            chunk = slice(start, start + EXPORT_CHUNK_ROWS)
+            yield from zip(*(column[chunk] for column in columns))
+
+    class Labels:
+        """Labels of an array of nodes, looked up when sliced"""
+        def __init__(self, nodes):
+            self.nodes = nodes
+        def __getitem__(self, chunk):
+            return labels[self.nodes[chunk]]
+
+    # edges.csv
+    yield from member('edges.csv', _csv_chunks(link_rows(Labels(sources), Labels(targets))))
+    yield from member('raw/X.sp_mat', _graph_text_chunks(graph, 'edges'))
+    yield from member('raw/labels', _graph_text_chunks(graph, 'labels'))
+    yield from member('raw/tdm.sp_mat', _graph_text_chunks(graph, 'tdm'))
+    yield from member('raw/dictionnary', _graph_text_chunks(graph, 'dictionnary'))
+
+    # nodes in the order they are first seen in the links
+    seen, first_index = np.unique(links.ravel(), return_index=True)
+    nodes_seen = seen[np.argsort(first_index)]
 
     # clusters
-    for i, result in enumerate(results):
+    for result in results:
         prefix = 'k%d_q%d/' % (result.param_topics, result.param_clusters)
-        
+
         meta = json.loads(result.nodes_meta) if result.nodes_meta else {}
 
         # clusters.csv
-        output = io.StringIO()
-        writer = csv.writer(output)
-        clusters = list(csv.reader([result.clusters_mat], delimiter=' '))[0]
-        clusters = [int(c) for c in clusters if c != '']
-        clusters_labeleds = [None] * (max(clusters)+1)
-        c = 0
-        for cluster in clusters:
-            if cluster != '':
-                if clusters_labeleds[cluster] is None:
-                    clusters_labeleds[cluster] = []
-                clusters_labeleds[cluster].append(labels[c])
-                c += 1
-        for row in clusters_labeleds:
-            if row is None:
-                row = []
-            writer.writerow(row)
-        z.writestr(prefix + 'clusters.csv', output.getvalue())
+        clusters = result.matrix('clusters_mat')[0].astype(np.int64)
+        n_clusters = int(clusters.max()) + 1
+        clusters_labeleds = [[] for _ in range(n_clusters)]
+        for label, cluster in zip(labels, clusters.tolist()):
+            clusters_labeleds[cluster].append(label)
+        yield from member(prefix + 'clusters.csv', _csv_chunks(clusters_labeleds))
+        del clusters_labeleds
 
-        def cluster_name(cluster):
-            return meta.get('c-'+str(cluster),{}).get('label', cluster)
+        cluster_names = _object_array([meta.get('c-'+str(cluster),{}).get('label', cluster)
+            for cluster in range(n_clusters)])
 
         # nodes_with_clusters
-        output = io.StringIO()
-        writer = csv.writer(output)
-        nodes_done = set()
-        writer.writerow(['id', 'cluster'])
-        for line in csv.reader(graph.edges.split('\n'), delimiter=' '):
-            if len(line) == 3:
-                source, target, val = line
-                if val == '0':
-                    continue
-                for node in (source, target):
-                    if node not in nodes_done:
-                        writer.writerow([labels[int(node)], cluster_name(clusters[int(node)])])
-                        nodes_done.add(node)
-        z.writestr(prefix + 'nodes_with_clusters.csv', output.getvalue())
-
-        def topic_name(topic):
-            return meta.get('t-'+str(topic),{}).get('label', topic)
-
-        # edges_with_topics
-        output = io.StringIO()
-        writer = csv.writer(output)
-
-        topics = result.topics_per_edges_mat.split('\n')
-        topics = [[v for v in topic.split(' ') if v] for topic in topics if topic]
-
-        edge_i = 0
-        writer.writerow(['source', 'target', 'topic', 'weight'])
-        for line in csv.reader(graph.edges.split('\n'), delimiter=' '):
-            if len(line) == 3:
-                source, target, val = line
-                if val == '0':
-                    continue
-                best_topic = None
-                best_topic_value = None
-                for i, topic in enumerate(topics):
-                    if len(topic) > edge_i:
-                        val = float(topic[edge_i])
-                        if best_topic is None or val > best_topic_value:
-                            best_topic = i
-                            best_topic_value = val
-                weigth = 2 if clusters[int(source)] == clusters[int(target)] else 1
-                writer.writerow([labels[int(source)], labels[int(target)], topic_name(best_topic), weigth])
-                edge_i += 1
-        z.writestr(prefix + 'edges_with_topics.csv', output.getvalue())
+        yield from member(prefix + 'nodes_with_clusters.csv', _csv_chunks(itertools.chain(
+            [['id', 'cluster']],
+            zip(labels[nodes_seen], cluster_names[clusters[nodes_seen]]))))
+
+        # edges_with_topics, the last name (of topic None) is for the links without a topic
+        topics_per_edges = result.matrix('topics_per_edges_mat')
+        best_topics, weights = links_topics(links, clusters, topics_per_edges)
+        topic_names = _object_array([meta.get('t-'+str(topic),{}).get('label', topic)
+            for topic in list(range(len(topics_per_edges))) + [None]])
+        yield from member(prefix + 'edges_with_topics.csv', _csv_chunks(itertools.chain(
+            [['source', 'target', 'topic', 'weight']],
+            link_rows(Labels(sources), Labels(targets), topic_names[best_topics], _object_array(weights.tolist())))))
 
         # topics.csv
-        output = io.StringIO()
-        writer = csv.writer(output)
-        for topic in csv.reader(result.topics_mat.split('\n'), delimiter=' '):
-            c = 0
-            words = []
-            for word_perc in topic:
-                if word_perc:
-                    words.append((dictionnary[c], float(word_perc)))
-                    c += 1
-            words = sorted(words, key=lambda x: -x[1])
-            row = []
-            for w, p in words:
-                row.append(w)
-                row.append(p)
-            writer.writerow(row)
-        z.writestr(prefix + 'topics.csv', output.getvalue())
-
-        z.writestr(prefix + 'raw/clusters', result.clusters_mat)
-        z.writestr(prefix + 'raw/topics', result.topics_mat)
-        z.writestr(prefix + 'raw/topics_per_edges', result.topics_per_edges_mat)
-        z.writestr(prefix + 'raw/rho', result.rho_mat)
-        z.writestr(prefix + 'raw/PI', result.pi_mat)
-        z.writestr(prefix + 'raw/thetaQR', result.theta_qr_mat)
-        z.writestr(prefix + 'raw/crit', str(result.crit))
+        def topics():
+            for topic in result.matrix('topics_mat').tolist():
+                words = []
+                for c, word_perc in enumerate(topic):
+                    # the float32 value with the digits of format_txt_mat, as parsed from the text before
+                    words.append((dictionnary[c], float('%.7g' % word_perc)))
+                words = sorted(words, key=lambda x: -x[1])
+                row = []
+                for w, p in words:
+                    row.append(w)
+                    row.append(p)
+                yield row
+            # the empty line read after the last one of the text
+            yield []
+        yield from member(prefix + 'topics.csv', _csv_chunks(topics()))
+
+        yield from member(prefix + 'raw/clusters', _result_text_chunks(result, 'clusters_mat'))
+        yield from member(prefix + 'raw/topics', _result_text_chunks(result, 'topics_mat'))
+        yield from member(prefix + 'raw/topics_per_edges', _result_text_chunks(result, 'topics_per_edges_mat'))
+        yield from member(prefix + 'raw/rho', _result_text_chunks(result, 'rho_mat'))
+        yield from member(prefix + 'raw/PI', _result_text_chunks(result, 'pi_mat'))
+        yield from member(prefix + 'raw/thetaQR', _result_text_chunks(result, 'theta_qr_mat'))
+        yield from member(prefix + 'raw/crit', [str(result.crit)])
 
     z.close()
-    return zip_out.getvalue()
+    yield output.pop()
+
+
+def export_to_zip(graph, results):
+    return b''.join(iter_export_zip(graph, results))
+
+
+def export_path(graph):
+    """Zip export of all the results of the graph built by config.celery.build_export, named after their version"""
+    from django.conf import settings
+    import os
+
+    return os.path.join(settings.LINKAGE_EXPORTS_ROOT, '%d-%d.zip' % (graph.pk, graph.results_version))
+
+
+def remove_exports(graph, keep=None):
+    """Remove the zip exports of the graph built on disk, except the file `keep`"""
+    from django.conf import settings
+    import os
+
+    if not os.path.isdir(settings.LINKAGE_EXPORTS_ROOT):
+        return
+    for filename in os.listdir(settings.LINKAGE_EXPORTS_ROOT):
+        path = os.path.join(settings.LINKAGE_EXPORTS_ROOT, filename)
+        if filename.startswith('%d-' % graph.pk) and filename.endswith('.zip') and path != keep:
+            os.remove(path)
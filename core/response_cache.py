@@ -0,0 +1,53 @@
+"""
+Cache of the responses built from the results of the finished jobs
+
+The results of a job do not change once it is done, apart from the labels of
+the clusters and topics (nodes_meta) and the cluster to cluster cutoff: both
+bump Graph.results_version, like the end of a job. The version is part of the
+cache keys, which are also the ETags of the responses, so the entries of the
+previous versions are never read again and just expire.
+
+Nothing is cached while a job is running.
+"""
+import hashlib
+
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+
+CACHE_ALIAS = 'responses'
+
+
+def key(graph, *parts):
+    """Key of a response of a finished job, different for each version of its results, None while it runs"""
+    if graph.job_progress < 1:
+        return None
+    return hashlib.sha256(repr((graph.pk, graph.results_version) + parts).encode()).hexdigest()
+
+
+def last_modified(graph):
+    if graph.job_progress < 1:
+        return None
+    return graph.results_updated_at
+
+
+def get_or_build(key, build):
+    """Cached value of `key`, built with build() if missing or if `key` is None"""
+    if key is None:
+        return build()
+    cache = caches[CACHE_ALIAS]
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value)
+    return value
+
+
+def invalidate(graph):
+    """New version of the results of the graph, to be done each time they change"""
+    from core.models import Graph
+
+    now = timezone.now()
+    Graph.objects.filter(pk=graph.pk).update(results_version=F('results_version') + 1, results_updated_at=now)
+    graph.results_version += 1
+    graph.results_updated_at = now
@@ -0,0 +1,80 @@
+"""
+Cache of the linkage-cpp results, keyed by the hash of their inputs
+
+A ProcessingResult is a cache entry as long as it has a cache_key: a job on
+the same edges and tdm, with the same parameters, clones it instead of
+running linkage-cpp again. The least recently used entries are evicted
+once there are more than `linkage_cpp__result_cache_size` keys.
+"""
+import hashlib
+
+from django.utils import timezone
+
+from core.models import ProcessingResult, CacheStat
+
+STAT_NAME = 'results'
+
+
+def data_digest(arrays):
+    """Hash of the inputs of linkage-cpp in the GraphArrays of a graph"""
+    digest = hashlib.sha256()
+    for array in (arrays.edges, arrays.tdm):
+        digest.update(('%s\n' % (array.shape,)).encode())
+        digest.update(array.astype('<i4', copy=False).tobytes())
+    return digest.hexdigest()
+
+
+def result_key(digest, directed, n_topics, n_clusters, n_repeat, max_inner_lda, max_outer_lda):
+    return hashlib.sha256(('%s %d %d %d %d %d %d' % (digest, directed, n_topics, n_clusters,
+        n_repeat, max_inner_lda, max_outer_lda)).encode()).hexdigest()
+
+
+def lookup(key):
+    """The most recent result for this key, or None, the failed models (keyed before they were not) are skipped"""
+    result = ProcessingResult.objects.filter(cache_key=key).exclude(crit=None).order_by('-pk').first()
+    if result is not None:
+        ProcessingResult.objects.filter(cache_key=key).update(cache_used_at=timezone.now())
+    return result
+
+
+def clone(result, graph):
+    """Copy of a cached result for another graph, the matrices are shared in the array store"""
+    copy = ProcessingResult(
+        graph=graph,
+        param_clusters=result.param_clusters,
+        param_topics=result.param_topics,
+        crit=result.crit,
+        data_key=result.data_key,
+        top_nodes_key=result.top_nodes_key,
+        quotient_key=result.quotient_key,
+        cache_key=result.cache_key,
+        cache_used_at=timezone.now(),
+    )
+    for name in ProcessingResult.MATRICES:
+        setattr(copy, name, getattr(result, name))
+    copy.save()
+    return copy
+
+
+def evict(max_size):
+    """Forget the least recently used keys beyond `max_size`, the results themselves are kept"""
+    from django.db.models import Max
+
+    keys = ProcessingResult.objects.exclude(cache_key='') \
+        .values('cache_key') \
+        .annotate(used_at=Max('cache_used_at')) \
+        .order_by('-used_at') \
+        .values_list('cache_key', flat=True)
+    evicted = list(keys[max_size:])
+    if evicted:
+        ProcessingResult.objects.filter(cache_key__in=evicted).update(cache_key='')
+    return len(evicted)
+
+
+def record(hits, misses):
+    CacheStat.record(STAT_NAME, hits, misses)
+
+
+def hit_rate():
+    stat = CacheStat.objects.filter(name=STAT_NAME).first()
+    return stat.hit_rate if stat else 0
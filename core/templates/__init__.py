@@ -104,110 +104,88 @@ JS_LIBS = (
 )
 
 
-def top_nodes_per_clusters(graph, result):
-    labels = list(csv.reader([graph.labels], delimiter=' '))[0]
-    clusters = [int(x) for x in 
-        list(csv.reader([result.clusters_mat], delimiter=' '))[0]
-        if x is not '']
-
-    clusters_nodes = {}
-
-    def add_one(node):
-        cluster = clusters[node]
-        if cluster not in clusters_nodes:
-            clusters_nodes[cluster] = {}
-        clust_nodes = clusters_nodes[cluster]
-        if node not in clust_nodes:
-            clust_nodes[node] = 0
-        clust_nodes[node] += 1
-
-    for line in csv.reader(graph.edges.split('\n'), delimiter=' '):
-        if len(line) == 3:
-            source, target, val = line
-            if val == '0':
-                continue
-            add_one(int(source))
-            add_one(int(target))
-
-    def top_10(cluster):
-        nodes = clusters_nodes.get(cluster, {})
-        return [labels[node] for node, _ in
-                    sorted(nodes.items(), key=lambda it: -it[1]) #[:10]
-                ]
-    top_nodes = [top_10(cluster) for cluster in range(max(clusters) + 1)]
-
-    return top_nodes # [ [label1_for_cluster_1, label2], [label4_for_cluster_2, label3],.. ]
-
-
-def serialize_graph(graph, result, simple=False, scores=None):
-    count_edges = 0
-    for line in csv.reader(graph.edges.split('\n'), delimiter=' '):
-        if len(line) == 3:
-            source, target, val = line
-            if val == '0':
-                continue
-            count_edges += 1
-
-    n_nodes = len(list(csv.reader([graph.labels], delimiter=' '))[0])
+TOP_NODES_PAGE = 100 # top nodes per cluster sent with the results too big to be displayed
+
+
+def top_nodes_per_clusters(graph, result, offset=0, limit=None):
+    """Labels of the nodes of each cluster by decreasing degree, ranked once per result"""
+    labels = graph.arrays.labels
+    return [[labels[node] for node in nodes] for nodes in result.top_nodes(offset=offset, limit=limit)]
+    # [ [label1_for_cluster_1, label2], [label4_for_cluster_2, label3],.. ]
+
+
+def serialize_graph(graph, result, simple=False, scores=None, binary=False):
+    count_edges, n_nodes = graph.counts()
 
     # force magic_too_big_to_display_X for big graphs
     too_big = graph.magic_too_big_to_display_X
     if count_edges > 50000 or n_nodes > 15000:
         too_big = True
 
+    step, progress = graph.job_state()
+
     data = {
         'id': graph.pk,
-        'user': graph.user.pk,
+        'user': graph.user_id,
         'name': graph.name,
-        'labels': graph.labels,
-        'edges': graph.edges,
         'n_edges': count_edges,
         'n_labels': n_nodes,
-        'tdm': '0 0 1' if too_big else graph.tdm,
         'public': graph.public,
-        'dictionnary': graph.dictionnary,
         'directed': graph.directed,
         'created_at': naturaltime(graph.created_at),
         'url': graph.get_absolute_url(),
-        'log': graph.job_log,
-        'step': graph.job_current_step,
+        'step': step,
         'time_t': graph.job_time,
         'time': natural.date.compress(graph.job_time * 100),
-        'progress': graph.job_progress,
+        'progress': progress,
+        # results are saved while the clustering runs, only counted for the unfinished jobs
+        'n_results': graph.processingresult_set.count() if progress < 1 else None,
         'cluster_to_cluster_cutoff': graph.cluster_to_cluster_cutoff,
         'job_param_clusters': graph.job_param_clusters,
         'job_param_topics': graph.job_param_topics,
         'job_param_clusters_max': graph.job_param_clusters_max,
         'job_param_topics_max': graph.job_param_topics_max,
+        'job_param_search': graph.job_param_search,
+        'job_models_skipped': graph.job_models_skipped,
         'job_error_log': graph.job_error_log,
         'magic_too_big_to_display_X': too_big,
         'scores': scores,
-        'has_original_csv': len(graph.original_csv) > 0,
+        'has_original_csv': graph.has_original_csv(),
     }
-    if too_big:
-        data['edges'] = '0 0 1'
-        data['labels'] = '0 0'
-    if simple:
-        del data['tdm']
-        del data['dictionnary']
-        del data['labels']
-        del data['edges']
-        del data['log']
+    if not simple:
+        data['log'] = graph.job_log
+        # the ASCII versions are only built when sent
+        if too_big:
+            data['edges'] = '0 0 1'
+            data['labels'] = '0 0'
+            data['tdm'] = '0 0 1'
+        else:
+            data['edges'] = graph.text_data('edges')
+            data['labels'] = graph.text_data('labels')
+            data['tdm'] = graph.text_data('tdm')
+        positions = None if too_big else graph.layout()
+        # in mean edge lengths, None until laid out
+        data['positions'] = positions.round(3).tolist() if positions is not None else None
+        data['dictionnary'] = graph.text_data('dictionnary')
+        data['stats'] = graph.stats()
     if result:
         try:
             # for export
             if len(result) > 1:
-                data['results'] = [r.serialize() for r in result]
+                data['results'] = [r.serialize(binary=binary) for r in result]
         except TypeError:
-            data['result'] = result.serialize()
-            data['result']['top_nodes'] = top_nodes_per_clusters(graph, result)
+            data['result'] = result.serialize(binary=binary,
+                placeholders={'topics_per_edges_mat': '0 0 1'} if too_big else None)
+            data['result']['top_nodes'] = top_nodes_per_clusters(graph, result,
+                limit=TOP_NODES_PAGE if too_big else None)
             if too_big:
-                data['result']['topics_per_edges_mat'] = '0 0 1'
+                # what can be drawn without the edges
+                data['result']['quotient'] = result.quotient()
     return data
 
 
-def result(request, graph, result, scores):
-    serialized = serialize_graph(graph, result, scores=scores)
+def result(request, graph, serialized):
+    """Result page of the graph, `serialized` by serialize_graph"""
     return base((
         L.div('.container-fluid') / (
             header(request),
@@ -272,7 +250,7 @@ def result(request, graph, result, scores):
 
 
 def api_result(request, graph, result):
-    return serialize_graph(graph, result)
+    return serialize_graph(graph, result, binary='binary' in request.GET)
 
 
 def index(request, messages, import_type_selected='coauth', quota_exceeded=False, user_jobs=None, gmail_access_accepted=False):
@@ -551,6 +529,18 @@ def index(request, messages, import_type_selected='coauth', quota_exceeded=False
                                 ),                                 
                             ),
                         ),
+                        L.div('.form-group') / (
+                            L.div('.col-sm-3.control-label') / (' '),
+                            L.div('.col-sm-9') / (
+                                L.div('.checkbox') / (
+                                    L.label / (
+                                        L.input(name='adaptive_search', type='checkbox'),
+                                        ' ',
+                                        L.abbr(title='only refine the best (topics, clusters) found on a coarse scan instead of computing all of them (faster on large ranges)') / 'Adaptive model selection',
+                                    )
+                                ),
+                            ),
+                        ),
                         L.div('.form-group._clustering-options.hide') / (
                             L.div('#_slider_clusters'),
                         ),
@@ -923,7 +913,7 @@ def details(request, graph, results):
                                     L.td / str(result.param_topics),
                                     L.td / str(result.param_clusters),
                                     L.td / str(result.crit),
-                                    L.td / result.clusters_mat,
+                                    L.td / result.text_matrix('clusters_mat'),
                                 )
                             )
                         ) for result in results
@@ -0,0 +1,117 @@
+import csv, io, shutil, tempfile, zipfile
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from core import array_store, models
+from graph_processing.components import disjoint_set, largest_component
+from graph_processing.sample_graph import X, tdm
+
+
+class ResultsTestCase(TestCase):
+    """Results of the sample graph, with the array store in a temporary directory"""
+
+    def setUp(self):
+        self.arrays_root = tempfile.mkdtemp()
+        settings = override_settings(LINKAGE_ARRAYS_ROOT=self.arrays_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(shutil.rmtree, self.arrays_root)
+
+        edges = array_store.parse_sp_mat(X)
+        terms = array_store.parse_sp_mat(tdm)
+        self.n_nodes = int(edges[:, :2].max()) + 1
+        self.graph = models.Graph(name='sample', user=User.objects.create(username='sample'))
+        self.graph.set_data(X, tdm, ' '.join('node%d' % i for i in range(self.n_nodes)),
+            ' '.join('term%d' % i for i in range(int(terms[:, 0].max()) + 1)))
+        self.graph.save()
+
+    def result(self, clusters_mat='', crit=None, **matrices):
+        result = models.ProcessingResult(graph=self.graph, param_clusters=2, param_topics=2)
+        result.set_matrices(clusters_mat=clusters_mat, **matrices)
+        result.crit = crit
+        return result
+
+
+class FailedModelTests(ResultsTestCase):
+    """A model linkage-cpp failed on has no crit and no output files, so no matrix"""
+
+    def test_save_failed_model(self):
+        result = self.result()
+        self.assertIsNone(result.clusters())
+        result.update_top_nodes()
+        result.update_quotient()
+        result.save()
+
+        result = models.ProcessingResult.objects.get(pk=result.pk)
+        self.assertEqual(result.top_nodes_key, '')
+        self.assertEqual(result.top_nodes(), [])
+        self.assertEqual(result.n_top_nodes(), [])
+        self.assertEqual(result.quotient_key, '')
+        self.assertEqual(result.quotient(), {'sizes': [], 'edges': []})
+        result.update_layout([[0, 0]] * self.n_nodes)
+        self.assertEqual(result.cluster_layout_key, '')
+        self.assertEqual(result.window_edges()[1], 0)
+
+    def test_save_model(self):
+        clusters = ' '.join(str(i % 2) for i in range(self.n_nodes)) + '\n'
+        result = self.result(clusters, crit=-1.5)
+        result.update_top_nodes()
+        result.save()
+
+        self.assertEqual(len(result.n_top_nodes()), 2)
+        self.assertEqual(sorted(sum(result.top_nodes(), [])), sorted(set(sum(result.top_nodes(), []))))
+
+    def test_quotient_short_clusters(self):
+        # a clusters row shorter than the nodes, the edges of the other nodes are left out
+        n_nodes = self.n_nodes // 2
+        result = self.result(' '.join('0' for i in range(n_nodes)) + '\n', crit=-1.5)
+        result.update_quotient()
+        result.save()
+
+        links = self.graph.links()
+        quotient = result.quotient()
+        self.assertEqual(quotient['sizes'], [n_nodes, 0])
+        self.assertEqual([edge[:3] for edge in quotient['edges']], [[0, 0, int((links < n_nodes).all(axis=1).sum())]])
+
+
+class ExportTests(ResultsTestCase):
+
+    def test_topics_csv(self):
+        n_terms = len(self.graph.arrays.dictionnary)
+        topics_mat = ''.join(' '.join(value for value, _ in zip(values * n_terms, range(n_terms))) + '\n'
+            for values in (['0.1', '0.25', '1e-05', '0'], ['1', '0.3333333', '0.05']))
+        result = self.result(' '.join('0' for i in range(self.n_nodes)) + '\n', crit=-1.5, topics_mat=topics_mat)
+
+        # topics.csv as written from the text of topics_mat before the array store
+        expected = io.StringIO()
+        writer = csv.writer(expected)
+        for topic in csv.reader(topics_mat.split('\n'), delimiter=' '):
+            c = 0
+            words = []
+            for word_perc in topic:
+                if word_perc:
+                    words.append((self.graph.arrays.dictionnary[c], float(word_perc)))
+                    c += 1
+            words = sorted(words, key=lambda x: -x[1])
+            row = []
+            for w, p in words:
+                row.append(w)
+                row.append(p)
+            writer.writerow(row)
+
+        export = zipfile.ZipFile(io.BytesIO(models.export_to_zip(self.graph, [result])))
+        topics_csv = export.read('k2_q2/topics.csv').decode('utf-8')
+        self.assertEqual(topics_csv, expected.getvalue())
+
+
+class ComponentsTests(SimpleTestCase):
+
+    def test_largest_component_tie(self):
+        # two components of 4 nodes, the root of the first seen one (a) ends up added after x
+        edges = [('a', 'b'), ('x', 'y'), ('y', 'z'), ('z', 'w'), ('c', 'd'), ('d', 'b')]
+        components = disjoint_set(edges)
+        self.assertEqual([components.find(root) for root in components.roots()],
+            [components.find('a'), components.find('x')])
+        self.assertEqual(largest_component(edges), {'a', 'b', 'c', 'd'})
+        self.assertEqual(largest_component(edges[1:4] + edges[:1] + edges[4:]), {'x', 'y', 'z', 'w'})
@@ -0,0 +1,227 @@
+"""
+Tokenization and stemming of the links text for graph_data_from_links
+
+The links are cut in chunks that are processed in-process or spread over a
+process pool, the per-chunk results are merged in the order of the chunks so
+the output does not depend on the number of workers.
+"""
+import collections, os, sqlite3, string
+
+CHUNK_SIZE = 1000 # links per chunk sent to a worker
+STEM_CACHE_SIZE = 100000 # tokens kept in the stemming cache of each process
+
+CacheInfo = collections.namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class StemCache:
+    """
+    Bounded LRU cache of token -> stemm in front of the snowball stemmer
+
+    With a cache_dir, the cache is also stored on disk (one sqlite file per
+    language) and reloaded when the process restarts.
+    """
+
+    def __init__(self, language='english', maxsize=STEM_CACHE_SIZE, cache_dir=None):
+        import Stemmer
+
+        self.stemmer = Stemmer.Stemmer(language)
+        self.maxsize = maxsize
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        self.db = None
+        self.unsaved = {}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.db = sqlite3.connect(os.path.join(cache_dir, 'stems-%s.sqlite' % language), timeout=60)
+            self.db.execute('CREATE TABLE IF NOT EXISTS stems (token TEXT PRIMARY KEY, stemm TEXT)')
+            rows = self.db.execute('SELECT token, stemm FROM stems ORDER BY rowid DESC LIMIT ?', (maxsize,))
+            for token, stemm in reversed(rows.fetchall()):
+                self.cache[token] = stemm
+
+    def stem_words(self, tokens):
+        cache = self.cache
+        stemms = []
+        missing = []
+        for i, token in enumerate(tokens):
+            stemm = cache.get(token)
+            if stemm is None:
+                missing.append(i)
+            else:
+                cache.move_to_end(token)
+            stemms.append(stemm)
+        self.hits += len(tokens) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            for i, stemm in zip(missing, self.stemmer.stemWords([tokens[i] for i in missing])):
+                stemms[i] = stemm
+                cache[tokens[i]] = stemm
+                if self.db is not None:
+                    self.unsaved[tokens[i]] = stemm
+            while len(cache) > self.maxsize:
+                cache.popitem(last=False)
+        return stemms
+
+    def save(self):
+        """Write the new stemms to the disk cache, keeping only the `maxsize` most recent ones"""
+        if self.db is None or not self.unsaved:
+            return
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO stems VALUES (?, ?)', self.unsaved.items())
+            # the rowids grow with each insert, a range of the rowid index is deleted instead of
+            # sorting the table: the replaced tokens leave gaps, at most `maxsize` stemms are kept
+            self.db.execute('DELETE FROM stems WHERE rowid <= (SELECT MAX(rowid) FROM stems) - ?', (self.maxsize,))
+        self.unsaved = {}
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self.cache))
+
+
+def text_processor(stem_cache_size=STEM_CACHE_SIZE, stem_cache_dir=None):
+    import nltk.tokenize
+    from nltk.corpus import stopwords
+
+    stem_cache = StemCache('english', stem_cache_size, stem_cache_dir)
+    stopwords = set(stopwords.words('english')).union(set(stopwords.words('french')))
+    punc_table = dict((ord(char), ' ') for char in string.punctuation if char not in '_-')
+
+    def tokenize(string):
+        string = string.translate(punc_table) # remove punctuation
+        for begin, end in nltk.tokenize.WhitespaceTokenizer().span_tokenize(string):
+            word = string[begin:end]
+            if not word.isdigit() and word not in stopwords:
+                yield word
+
+    return tokenize, stem_cache
+
+
+# the stemmer, stopwords and stemming cache are kept between imports in each process
+_processor = None
+_processor_config = None
+
+
+def _init_worker(stem_cache_size=STEM_CACHE_SIZE, stem_cache_dir=None):
+    global _processor, _processor_config
+    config = (stem_cache_size, stem_cache_dir)
+    if _processor is None or _processor_config != config:
+        _processor = text_processor(stem_cache_size, stem_cache_dir)
+        _processor_config = config
+
+
+def cache_info():
+    """Hits/misses of the stemming cache of the current process"""
+    if _processor is None:
+        return None
+    return _processor[1].info()
+
+
+def stem_links(links, ignore_self_loop=True, stem_cache_size=STEM_CACHE_SIZE, stem_cache_dir=None):
+    """
+    Tokenize and stem a chunk of links
+
+    Returns (results, stemm_to_lemm, cache_counts):
+        - results: a (source, target, stemms) per link, stemms being None for the links
+          without any token, [] for the ignored self loops and else the (stemm, count)
+          in order of first occurrence
+        - stemm_to_lemm: the first token (lowercased) seen for each stemm in the chunk
+        - cache_counts: the (hits, misses) of the stemming cache for this chunk
+    """
+    _init_worker(stem_cache_size, stem_cache_dir)
+    tokenize, stem_cache = _processor
+    hits, misses = stem_cache.hits, stem_cache.misses
+
+    results = []
+    stemm_to_lemm = {}
+    for link in links:
+        if len(link) > 1:
+            text = link[2] if len(link) > 2 else ''
+            tokens = list(tokenize(text))
+            if len(tokens) == 0: # filter empty links
+                results.append((link[0], link[1], None))
+                continue
+            if ignore_self_loop and link[0] == link[1]:
+                results.append((link[0], link[1], []))
+                continue
+            stemms = collections.Counter()
+            for token, stemm in zip(tokens, stem_cache.stem_words(tokens)):
+                if stemm not in stemm_to_lemm:
+                    stemm_to_lemm[stemm] = token.lower()
+                stemms[stemm] += 1
+            results.append((link[0], link[1], list(stemms.items())))
+    stem_cache.save()
+    return results, stemm_to_lemm, (stem_cache.hits - hits, stem_cache.misses - misses)
+
+
+def _chunks(links, chunk_size):
+    chunk = []
+    for link in links:
+        chunk.append(link)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _pool(n_workers, stem_options):
+    try:
+        # celery workers are daemonic processes, only billiard (celery's fork of
+        # multiprocessing) allows them to have children
+        from billiard import Pool
+    except ImportError:
+        from multiprocessing import Pool
+    return Pool(n_workers, initializer=_init_worker, initargs=stem_options)
+
+
+def _stem_chunks(links, ignore_self_loop, n_workers, chunk_size, stem_options):
+    chunks = _chunks(links, chunk_size)
+    if n_workers <= 1:
+        for chunk in chunks:
+            yield stem_links(chunk, ignore_self_loop, *stem_options)
+        return
+
+    pool = _pool(n_workers, stem_options)
+    try:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(stem_links, (chunk, ignore_self_loop) + stem_options))
+            # bound the number of chunks in flight to keep the memory constant
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().get()
+        pool.close()
+        while pending:
+            yield pending.popleft().get()
+        pool.join()
+    finally:
+        pool.terminate()
+
+
+def process_links(links, ignore_self_loop=True, n_workers=1, chunk_size=CHUNK_SIZE,
+        stem_cache_size=STEM_CACHE_SIZE, stem_cache_dir=None, stats=None):
+    """
+    Yield (source, target, lemms) for each link with some text, lemms being a Counter
+    of the lemm counts in order of first occurrence (empty for the ignored self loops)
+
+    A stemm is lemmatized as the first token it comes from in the links, whatever the
+    number of workers. The stemming cache hits and misses of all the workers are summed
+    in the `stats` dict if given.
+    """
+    stemm_to_lemm = {}
+    stem_options = (stem_cache_size, stem_cache_dir)
+    for results, chunk_stemm_to_lemm, (hits, misses) in _stem_chunks(
+            links, ignore_self_loop, n_workers, chunk_size, stem_options):
+        if stats is not None:
+            stats['stem_cache_hits'] = stats.get('stem_cache_hits', 0) + hits
+            stats['stem_cache_misses'] = stats.get('stem_cache_misses', 0) + misses
+        for stemm, lemm in chunk_stemm_to_lemm.items():
+            if stemm not in stemm_to_lemm:
+                stemm_to_lemm[stemm] = lemm
+        for source, target, stemms in results:
+            if stemms is None:
+                continue
+            lemms = collections.Counter()
+            for stemm, count in stemms:
+                lemms[stemm_to_lemm[stemm]] += count
+            yield source, target, lemms
@@ -17,6 +17,11 @@ from django.conf import settings
 
 
 from .medrxiv_search import search as medrxiv_search
+from . import http_fetch
+
+RXIVIST_URL = 'https://api.rxivist.org/v1/papers'
+HAL_URL = 'https://api.archives-ouvertes.fr/search/'
+EUTILS_URL = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
 
 
 def arxiv_to_csv(q, limit=500):
@@ -44,15 +49,12 @@ def biorxiv_to_csv(q, limit=500):
         'page': 0,
     }
 
-    results = []
-
-    while True:
-        resp = requests.get('https://api.rxivist.org/v1/papers', params=params).json()
-        results += resp['results']
-        if resp['query']['current_page'] == resp['query']['final_page']:
-            break
-        else:
-            params['page'] += 1
+    # the number of pages is known from the first one, the next ones are fetched concurrently
+    resp = http_fetch.get(RXIVIST_URL, params=params).json()
+    results = resp['results']
+    pages = range(resp['query']['current_page'] + 1, resp['query']['final_page'] + 1)
+    for resp in http_fetch.get_many((RXIVIST_URL, dict(params, page=page)) for page in pages):
+        results += resp.json()['results']
 
     output = io.StringIO()
     writer = csv.writer(output)
@@ -94,13 +96,13 @@ def hal_to_csv(q, limit=500):
         'rows': limit,
     }
 
-    results = []
-    while True:
-        resp = requests.get('https://api.archives-ouvertes.fr/search/', params=params)
-        results += resp.json()['response']['docs']
-        if len(results) >= resp.json()['response']['numFound'] or len(results) > limit:
-            break
-        params['start'] = len(results)
+    # the number of results is known from the first page, the next ones are fetched concurrently
+    resp = http_fetch.get(HAL_URL, params=params).json()['response']
+    results = resp['docs']
+    if results:
+        starts = [start for start in range(len(results), resp['numFound'], len(results)) if start <= limit]
+        for resp in http_fetch.get_many((HAL_URL, dict(params, start=start)) for start in starts):
+            results += resp.json()['response']['docs']
 
     output = io.StringIO()
     writer = csv.writer(output)
@@ -136,9 +138,6 @@ def pubmed_to_csv(q, limit=500, use_keywords=False):
 
 
 def _pubmed_search(q, limit=500):
-    BASE = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
-    url = BASE + 'esearch.fcgi?db=pubmed&retmode=json&retmax=20&sort=relevance&term=fever'
-
     params = {
         'db': 'pubmed',
         'retmode': 'json',
@@ -146,7 +145,7 @@ def _pubmed_search(q, limit=500):
         'sort': 'relevance',
         'term': q,
     }
-    resp = requests.get(BASE + 'esearch.fcgi', params=params)
+    resp = http_fetch.get(EUTILS_URL + 'esearch.fcgi', params=params)
     ids = resp.json()['esearchresult']['idlist']
 
     print('PUBMED search for', q, ':', len(ids), 'papers found')
@@ -161,13 +160,12 @@ def _chunks(l, n):
 
 
 def _pubmed_content(ids):
-    for chunk in _chunks(ids, 100):
-        params = {
-            'db': 'pubmed',
-            'retmode': 'xml',
-            'id': ','.join(chunk),
-        }
-        resp = requests.get('https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi', params=params)
+    chunks = ((EUTILS_URL + 'efetch.fcgi', {
+        'db': 'pubmed',
+        'retmode': 'xml',
+        'id': ','.join(chunk),
+    }) for chunk in _chunks(ids, 100))
+    for resp in http_fetch.get_many(chunks):
         xml = xmltodict.parse(resp.text)
         open('pubmed.json', 'w').write(json.dumps(xml, indent=2))
 
@@ -261,14 +259,13 @@ def pubmed_citations_to_csv(q, limit=500):
     # get pubmed citations
     cited_by = {}
     articles_ids = list(articles_by_ids.keys())
-    for chunk in _chunks(articles_ids, 100):
-        params = {
-            'dbfrom': 'pubmed',
-            'linkname': 'pubmed_pubmed_citedin',
-            'id': chunk,
-            'retmode': 'json',
-        }
-        resp = requests.get('https://eutils.ncbi.nlm.nih.gov/entrez/eutils/elink.fcgi', params=params)
+    chunks = ((EUTILS_URL + 'elink.fcgi', {
+        'dbfrom': 'pubmed',
+        'linkname': 'pubmed_pubmed_citedin',
+        'id': chunk,
+        'retmode': 'json',
+    }) for chunk in _chunks(articles_ids, 100))
+    for resp in http_fetch.get_many(chunks):
         for linkset in resp.json()['linksets']:
             article_id = linkset['ids'][0]
             if 'linksetdbs' in linkset:
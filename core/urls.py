@@ -9,6 +9,11 @@ urlpatterns = [
     url(r'^$', views.landing),
     url(r'^result/(?P<pk>\d+)/$', views.result, name='result'),
     url(r'^result/(?P<pk>\d+)/data/$', views.api_result),
+    url(r'^result/(?P<pk>\d+)/matrix/$', views.api_result_matrix),
+    url(r'^result/(?P<pk>\d+)/top_nodes/$', views.api_result_top_nodes),
+    url(r'^result/(?P<pk>\d+)/edges/$', views.api_result_edges),
+    url(r'^result/(?P<pk>\d+)/edge_topics/$', views.api_result_edge_topics),
+    url(r'^result/(?P<pk>\d+)/quotient/$', views.api_result_quotient),
     url(r'^result/(?P<pk>\d+)/details/$', views.details),
     url(r'^result/(?P<pk>\d+)/cluster_it/$', views.api_cluster),
     url(r'^result/(?P<pk>\d+)/update_clusters_labels/$', views.api_clusters_labels),
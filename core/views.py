@@ -1,13 +1,14 @@
-from io import TextIOWrapper
-import hashlib
+from io import TextIOWrapper, BytesIO
+import hashlib, os
 from smtplib import SMTPRecipientsRefused
 from functools import wraps
 
 from django import forms
 from django.db import IntegrityError
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import condition
 from django.contrib.auth import login as auth_login
 from django.contrib.auth.models import User
 from django.contrib import messages
@@ -15,15 +16,19 @@ from django.core.exceptions import PermissionDenied
 from django.core.mail import send_mail
 from django.conf import settings
 
+import numpy
 from social_django.utils import load_strategy
 from raven.contrib.django.raven_compat.models import client
 import TwitterAPI
 
-from core import templates, models, third_party_import
+from core import templates, models, third_party_import, array_store, response_cache
 
 MAX_JOBS_PER_USER = None if settings.LINKAGE_ENTERPRISE else 10
 MAX_REQUESTS_RESULT = None if settings.LINKAGE_ENTERPRISE else 10000
 CLUSTERS_MAX = 50 if settings.LINKAGE_ENTERPRISE else 10
+MAX_TOP_NODES_PAGE = 1000
+WINDOW_PAGE = 1000 # edges sent at once by the result API of the big graphs
+MAX_WINDOW_PAGE = 10000
 
 
 class OrgForm(forms.Form):
@@ -72,7 +77,8 @@ def org_required():
 def index(request):
     from config.celery import import_graph_data, retrieve_graph_data
 
-    user_jobs = models.Graph.objects.filter(user=request.user, job_error_log='').order_by('-pk')
+    user_jobs = models.Graph.objects.filter(user=request.user, job_error_log='') \
+        .defer(*models.Graph.HEAVY_FIELDS).order_by('-pk')
     if not request.user.is_staff and MAX_JOBS_PER_USER and user_jobs.count() > MAX_JOBS_PER_USER:
         messages = [('danger', 'You are limited to %d jobs, please delete previous ones before importing a new one' % MAX_JOBS_PER_USER)]
         return HttpResponse(templates.index(
@@ -84,10 +90,12 @@ def index(request):
 
     messages = []
     graph = None
+    stats = None
     if request.POST and request.POST['action'] == 'import':
         clusters_min, clusters_max,topics_min, topics_max, \
             limit, valid_parameters = None, None, None, None, 200, True
         filter_largest_subgraph = 'filter_largest_subgraph' in request.POST
+        search = 'adaptive' if 'adaptive_search' in request.POST else 'grid'
         if request.POST['clustering'] == 'manual':
             try:
                 clusters_min = int(request.POST['clusters_min'])
@@ -115,7 +123,7 @@ def index(request):
 
             def make_graph(name, directed=True):
                 graph = models.Graph(name=name,
-                    user=request.user, directed=directed)
+                    user=request.user, directed=directed, job_param_search=search)
                 if clusters_min:
                     graph.job_param_clusters = clusters_min
                     graph.job_param_clusters_max = clusters_max
@@ -136,9 +144,14 @@ def index(request):
             elif 'choice_csv' in request.POST:
                 if 'csv_file' not in request.FILES:
                     messages.append(['danger', 'You must include a file to import'])
-                links = TextIOWrapper(request.FILES['csv_file'].file, encoding='utf-8').read()
                 graph = make_graph('CSV import of %s' % (request.FILES['csv_file'].name))
-                import_graph_data.delay(graph.pk, links, filter_largest_subgraph)
+                # stream the upload to disk, the worker then reads it without loading it in memory
+                csv_path = os.path.join(settings.MEDIA_ROOT, 'imports', '%d.csv' % graph.pk)
+                os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+                with open(csv_path, 'wb') as f:
+                    for chunk in request.FILES['csv_file'].chunks():
+                        f.write(chunk)
+                import_graph_data.delay(graph.pk, None, filter_largest_subgraph, csv_path=csv_path)
                 return redirect('/jobs/')
 
             elif 'choice_mbox' in request.POST:
@@ -226,7 +239,8 @@ def index(request):
                     content = open('csv_samples/' + filename).readlines()
                     links = third_party_import.mbox_to_csv(content, subject_only=False)
                     data = models.graph_data_from_links(links)
-                    graph = models.Graph(name='MBOX import of %s' % (filename), user=request.user, **data)
+                    graph = models.Graph(name='MBOX import of %s' % (filename), user=request.user)
+                    graph.set_data(**data)
                 elif '.csv' in filename:
                     content = open('csv_samples/' + filename).read()
                     graph = make_graph('CSV import of %s' % (filename))
@@ -238,10 +252,13 @@ def index(request):
                 if prev_job.user.pk == request.user.pk:
                     graph = models.Graph(name=prev_job.name,
                         user=request.user, directed=prev_job.directed,
+                        data_key=prev_job.data_key,
                         labels=prev_job.labels,
                         tdm=prev_job.tdm,
                         edges=prev_job.edges,
                         dictionnary=prev_job.dictionnary)
+                    # same data, same statistics
+                    stats = prev_job.stats()
             elif 'choice_gmail' in request.POST:
                 social = request.user.social_auth.get(provider='google-gmail')
                 access_token = social.get_access_token(load_strategy())
@@ -253,7 +270,7 @@ def index(request):
                 )
                 return redirect('/jobs/')
             if graph:
-                if len(graph.labels.strip()) < 2:
+                if len(graph.arrays.labels) == 0:
                     messages.append(['danger', 'There is no data for this graph'])
                 else:
                     if clusters_min:
@@ -261,7 +278,9 @@ def index(request):
                         graph.job_param_clusters_max = clusters_max
                         graph.job_param_topics = topics_min
                         graph.job_param_topics_max = topics_max
+                    graph.job_param_search = search
                     graph.save()
+                    graph.update_stats(stats)
 
                     from config.celery import process_graph
                     process_graph.delay(graph.pk, ws_delay=2)
@@ -283,31 +302,56 @@ def index(request):
     ))
 
 
+def _request_graph(request, pk):
+    """Graph of the request, fetched once for a view and its ETag and Last-Modified"""
+    if getattr(request, '_graph', None) is None:
+        request._graph = get_object_or_404(models.Graph, pk=pk)
+    return request._graph
+
+
+def _can_view(request, graph):
+    return graph.public or (not request.user.is_anonymous and request.user.pk == graph.user_id)
+
+
+def _result_etag(request, pk):
+    graph = _request_graph(request, pk)
+    if not _can_view(request, graph):
+        return None
+    # the page shows the user and the version of the static files
+    return response_cache.key(graph, 'page', request.user.pk, templates.COMMIT_HASH)
+
+
+@condition(etag_func=_result_etag)
 def result(request, pk):
-    graph = get_object_or_404(models.Graph, pk=pk)
-    if not graph.public and (request.user.is_anonymous or request.user.pk != graph.user.pk):
+    graph = _request_graph(request, pk)
+    if not _can_view(request, graph):
         raise PermissionDenied
-    result = None
-    try:
-        result = models.ProcessingResult.objects \
-            .filter(graph=graph) \
-            .order_by('-crit').exclude(crit=None) \
-            .first()
-    except:
-        pass
 
-    # export scores for histogram
-    scores = models.ProcessingResult.objects \
-            .filter(graph=graph) \
-            .exclude(crit=None) \
-            .order_by('-crit') \
-            .values_list('param_clusters', 'param_topics', 'crit')
-    if len(scores) < 2:
-        scores = None
-    else:
-        scores = list(scores)
+    def serialize():
+        result = None
+        try:
+            result = models.ProcessingResult.objects \
+                .filter(graph=graph) \
+                .order_by('-crit').exclude(crit=None) \
+                .first()
+        except:
+            pass
+
+        # export scores for histogram
+        scores = models.ProcessingResult.objects \
+                .filter(graph=graph) \
+                .exclude(crit=None) \
+                .order_by('-crit') \
+                .values_list('param_clusters', 'param_topics', 'crit')
+        if len(scores) < 2:
+            scores = None
+        else:
+            scores = list(scores)
+        return templates.serialize_graph(graph, result, scores=scores, binary=True)
 
-    return HttpResponse(templates.result(request, graph, result, scores=scores))
+    # the same for every user, only the page around it is not cached
+    serialized = response_cache.get_or_build(response_cache.key(graph, 'result'), serialize)
+    return HttpResponse(templates.result(request, graph, serialized))
 
 
 @login_required
@@ -354,12 +398,21 @@ def credits(request):
 def jobs(request):
     if request.POST and request.POST['action'] == 'delete':
         graph = get_object_or_404(models.Graph, pk=request.POST['graph_id'])
+        models.remove_exports(graph)
         graph.delete()
+    if request.POST and request.POST['action'] == 'cancel':
+        # the running linkage-cpp processes are killed by process_graph
+        graph = get_object_or_404(models.Graph, pk=request.POST['graph_id'], user=request.user)
+        graph.job_cancel_requested = True
+        graph.save()
 
+    # the data columns are never read to list the jobs, the sizes are in their JobStatus
     jobs = models.Graph.objects.filter(user=request.user) \
+        .defer(*models.Graph.HEAVY_FIELDS).select_related('status') \
         .order_by('-created_at')
 
     demo_jobs = models.Graph.objects.filter(public=True) \
+        .defer(*models.Graph.HEAVY_FIELDS).select_related('status') \
         .order_by('-created_at')
 
     if request.GET.get('as_json'):
@@ -374,43 +427,221 @@ def jobs(request):
 def addjob(request):
     return index(request)
 
+def _api_result_etag(request, pk):
+    graph = _request_graph(request, pk)
+    if request.user.pk != graph.user_id:
+        return None
+    return response_cache.key(graph, 'api', sorted(request.GET.lists()))
+
+
+def _api_result_last_modified(request, pk):
+    graph = _request_graph(request, pk)
+    if request.user.pk != graph.user_id:
+        return None
+    return response_cache.last_modified(graph)
+
+
 @login_required
+@condition(etag_func=_api_result_etag, last_modified_func=_api_result_last_modified)
 def api_result(request, pk):
-    graph = get_object_or_404(models.Graph, pk=pk)
+    graph = _request_graph(request, pk)
     if request.user.pk != graph.user.pk:
         raise PermissionDenied
 
-    result = None
+    def find_result():
+        result = None
 
-    try:
-        clusters = int(request.GET['clusters'])
-        topics = int(request.GET['topics'])
-        result = models.ProcessingResult.objects \
-            .get(graph=graph,
-                param_clusters=clusters,
-                param_topics=topics)
-    except:
-        print('no match for clusters/topics')
-
-    if not result:
         try:
+            clusters = int(request.GET['clusters'])
+            topics = int(request.GET['topics'])
             result = models.ProcessingResult.objects \
-                .filter(graph=graph) \
-                .order_by('-crit') \
-                .exclude(crit=None)
-            if 'all' not in request.GET:
-                result = result.first()
+                .get(graph=graph,
+                    param_clusters=clusters,
+                    param_topics=topics)
         except:
-            print('no match for graph')
-    
+            print('no match for clusters/topics')
+
+        if not result:
+            try:
+                result = models.ProcessingResult.objects \
+                    .filter(graph=graph) \
+                    .order_by('-crit') \
+                    .exclude(crit=None)
+                if 'all' not in request.GET:
+                    result = result.first()
+            except:
+                print('no match for graph')
+        return result
+
     if 'zip' in request.GET:
-        return HttpResponse(models.export_to_zip(graph, result),
+        if 'all' in request.GET and 'clusters' not in request.GET and 'topics' not in request.GET \
+                and os.path.exists(models.export_path(graph)):
+            # all the results, built by config.celery.build_export for their current version
+            return FileResponse(open(models.export_path(graph), 'rb'), content_type='application/zip')
+        return StreamingHttpResponse(models.iter_export_zip(graph, find_result()),
                 content_type='application/zip')
 
     if 'csv' in request.GET:
         return HttpResponse(graph.original_csv, content_type='text/csv')
 
-    return JsonResponse(templates.api_result(request, graph, result))
+    content = response_cache.get_or_build(_api_result_etag(request, pk),
+        lambda: JsonResponse(templates.api_result(request, graph, find_result())).content)
+    return HttpResponse(content, content_type='application/json')
+
+
+def api_result_matrix(request, pk):
+    """One matrix of a result as a .npy file (float32 with its shape in the header)"""
+    graph = get_object_or_404(models.Graph, pk=pk)
+    if not graph.public and (request.user.is_anonymous or request.user.pk != graph.user.pk):
+        raise PermissionDenied
+
+    name = request.GET.get('name')
+    if name not in models.ProcessingResult.MATRICES:
+        return JsonResponse({'message': 'error: invalid matrix name'}, status=400)
+
+    try:
+        clusters, topics = int(request.GET['clusters']), int(request.GET['topics'])
+    except (KeyError, ValueError):
+        return JsonResponse({'message': 'error: invalid clusters or topics'}, status=400)
+    result = get_object_or_404(models.ProcessingResult, graph=graph, param_clusters=clusters, param_topics=topics)
+
+    if result.data_key and not getattr(result, name):
+        # stored as .npy already, sent without loading it
+        response = FileResponse(open(array_store.array_path(result.data_key, name), 'rb'),
+            content_type='application/octet-stream')
+    else:
+        output = BytesIO()
+        numpy.save(output, result.matrix(name))
+        response = HttpResponse(output.getvalue(), content_type='application/octet-stream')
+    response['Content-Disposition'] = 'attachment; filename="%s.npy"' % name
+    return response
+
+
+def _request_result(request, pk):
+    """Graph and result (?clusters=&topics=) of a request to the result API, raises KeyError or ValueError if invalid"""
+    graph = get_object_or_404(models.Graph, pk=pk)
+    if not _can_view(request, graph):
+        raise PermissionDenied
+
+    clusters, topics = int(request.GET['clusters']), int(request.GET['topics'])
+    result = get_object_or_404(models.ProcessingResult, graph=graph, param_clusters=clusters, param_topics=topics)
+    return graph, result
+
+
+def _request_page(request, default_limit, max_limit):
+    """(offset, limit) of a request, raises ValueError if invalid"""
+    offset = max(int(request.GET.get('offset', 0)), 0)
+    limit = min(max(int(request.GET.get('limit', default_limit)), 0), max_limit)
+    return offset, limit
+
+
+def _request_clusters(request, name):
+    """Comma separated list of clusters, None if not given, raises ValueError if invalid"""
+    if not request.GET.get(name):
+        return None
+    return [int(cluster) for cluster in request.GET[name].split(',')]
+
+
+def api_result_top_nodes(request, pk):
+    """A page of the nodes of a cluster ranked by degree, with the number of nodes of each cluster"""
+    try:
+        graph, result = _request_result(request, pk)
+    except (KeyError, ValueError):
+        return JsonResponse({'message': 'error: invalid clusters or topics'}, status=400)
+
+    sizes = result.n_top_nodes()
+    try:
+        cluster = int(request.GET['cluster'])
+        offset, limit = _request_page(request, templates.TOP_NODES_PAGE, MAX_TOP_NODES_PAGE)
+    except (KeyError, ValueError):
+        return JsonResponse({'message': 'error: invalid cluster, offset or limit'}, status=400)
+    if not 0 <= cluster < len(sizes):
+        return JsonResponse({'message': 'error: invalid cluster'}, status=400)
+
+    labels = graph.arrays.labels
+    return JsonResponse({
+        'cluster': cluster,
+        'offset': offset,
+        'limit': limit,
+        'total': sizes[cluster],
+        'sizes': sizes,
+        'nodes': [labels[node] for node in result.top_nodes(cluster, offset, limit)],
+    })
+
+
+def api_result_edges(request, pk):
+    """
+    A page of the edges going from the clusters ?source_clusters=0,1 to the clusters ?target_clusters=2
+    (any cluster if not given), for the graphs too big to be sent whole
+
+    The edges are [index, source, target, topic, weight] with the index of the edge in the
+    columns of topics_per_edges_mat (see api_result_edge_topics) and its topic and weight as
+    in the zip export, the labels of their nodes are given by node.
+    """
+    try:
+        graph, result = _request_result(request, pk)
+    except (KeyError, ValueError):
+        return JsonResponse({'message': 'error: invalid clusters or topics'}, status=400)
+
+    try:
+        source_clusters = _request_clusters(request, 'source_clusters')
+        target_clusters = _request_clusters(request, 'target_clusters')
+        offset, limit = _request_page(request, WINDOW_PAGE, MAX_WINDOW_PAGE)
+    except ValueError:
+        return JsonResponse({'message': 'error: invalid clusters, offset or limit'}, status=400)
+
+    indexes, total = result.window_edges(source_clusters, target_clusters, offset, limit)
+    links = graph.links()[indexes]
+    topics_per_edges = result.matrix('topics_per_edges_mat')
+    # the indexes are sorted, those without a column of topics are the last ones
+    # no edge for a failed model
+    clusters = result.clusters() if total else numpy.zeros(0, dtype=numpy.int64)
+    best_topics, weights = models.links_topics(links, clusters,
+        topics_per_edges[:, indexes[indexes < topics_per_edges.shape[1]]])
+    n_topics = len(topics_per_edges)
+
+    labels = graph.arrays.labels
+    return JsonResponse({
+        'offset': offset,
+        'limit': limit,
+        'total': total,
+        'edges': [[index, source, target, topic if topic < n_topics else None, weight]
+            for index, (source, target), topic, weight in zip(
+                indexes.tolist(), links.tolist(), best_topics.tolist(), weights.tolist())],
+        'labels': {node: labels[node] for node in numpy.unique(links).tolist()},
+    })
+
+
+def api_result_edge_topics(request, pk):
+    """Topic vectors of the edges ?start= to ?stop= (excluded), as rows of topics_per_edges_mat transposed"""
+    try:
+        graph, result = _request_result(request, pk)
+    except (KeyError, ValueError):
+        return JsonResponse({'message': 'error: invalid clusters or topics'}, status=400)
+
+    try:
+        start = max(int(request.GET.get('start', 0)), 0)
+        stop = min(int(request.GET.get('stop', start + WINDOW_PAGE)), start + MAX_WINDOW_PAGE)
+    except ValueError:
+        return JsonResponse({'message': 'error: invalid start or stop'}, status=400)
+
+    topics_per_edges = result.matrix('topics_per_edges_mat')
+    topics = topics_per_edges[:, start:max(start, stop)]
+    return JsonResponse({
+        'start': start,
+        'stop': start + topics.shape[1],
+        'n_edges': topics_per_edges.shape[1],
+        'topics': topics.T.tolist(),
+    })
+
+
+def api_result_quotient(request, pk):
+    """Graph of the clusters of a result, small whatever the size of the graph"""
+    try:
+        graph, result = _request_result(request, pk)
+    except (KeyError, ValueError):
+        return JsonResponse({'message': 'error: invalid clusters or topics'}, status=400)
+    return JsonResponse(result.quotient())
 
 
 def api_cluster(request, pk):
@@ -421,6 +652,7 @@ def api_cluster(request, pk):
     if 'cluster_to_cluster_cutoff' in request.POST:
         graph.cluster_to_cluster_cutoff = float(request.POST['cluster_to_cluster_cutoff'])
         graph.save()
+        response_cache.invalidate(graph)
         return JsonResponse({'message': 'ok [cutoff-updated]'})
 
     clusters = int(request.POST['clusters'])
@@ -467,6 +699,7 @@ def api_clusters_labels(request, pk):
     result.nodes_meta = request.POST['nodes_meta']
 
     result.save()
+    response_cache.invalidate(graph)
 
     return JsonResponse({'message': 'ok [nodes-meta-saved]'})
 
@@ -66,8 +66,8 @@ function init(state_init = {}) {
 
     STATE.topics_per_edges = topics_per_edges;
 
-    STATE.rho = Papa.parse(GRAPH.result.rho_mat,
-      {delimiter: ',', dynamicTyping: true, skipEmptyLines: true}).data;
+    STATE.rho = typeof GRAPH.result.rho_mat === 'string' ? Papa.parse(GRAPH.result.rho_mat,
+      {delimiter: ',', dynamicTyping: true, skipEmptyLines: true}).data : parse_txt_mat(GRAPH.result.rho_mat);
 
     STATE.theta_qr = parse_txt_mat(GRAPH.result.theta_qr_mat);
 
@@ -158,9 +158,11 @@ function init(state_init = {}) {
     });
   }
 
+  var placed = place_nodes(graph, layout);
+
   STATE.graph_layout_running = true;
   RENDERER.run();
-  RENDERER.pause_in(4000);
+  RENDERER.pause_in(placed ? 500 : 4000);
 
   RENDERER.layout = layout;
   RENDERER.graph = graph;
@@ -207,11 +209,25 @@ function init(state_init = {}) {
 }
 
 function parse_txt_mat(mat) {
+  if (typeof mat !== 'string') {
+    return parse_binary_mat(mat);
+  }
   return mat.split('\n').map(line =>
     line.split(' ').filter(x => x).map(x => parseFloat(x))
   ).filter(line => line.length > 0);
 }
 
+// {dtype: 'float32', shape: [rows, cols], data: base64} as sent by ProcessingResult.serialize(binary=True)
+function parse_binary_mat(mat) {
+  var bytes = Uint8Array.from(atob(mat.data), c => c.charCodeAt(0));
+  var values = new Float32Array(bytes.buffer);
+  var rows = [];
+  for (var i = 0; i < mat.shape[0]; i++) {
+    rows.push(Array.from(values.subarray(i * mat.shape[1], (i + 1) * mat.shape[1])));
+  }
+  return rows;
+}
+
 function fit_graph() {
   // https://github.com/anvaka/VivaGraphJS/blob/a5c5c92cdecd6964b0bb0c1cb0aaa63c30ffc9e4/demos/other/precompute-advanced.html#L62-L77
   var graphRect = RENDERER.layout.getGraphRect();
@@ -239,9 +255,9 @@ function update_cluster_label(cluster, label) {
   if (label === '') {
     delete STATE.nodes_meta['c-' + cluster]['label'];
   } else {
-    STATE.nodes_meta['c-' + cluster] = {
+    STATE.nodes_meta['c-' + cluster] = Object.assign(STATE.nodes_meta['c-' + cluster] || {}, {
       label
-    };
+    });
   }
   GRAPH.result.nodes_meta = JSON.stringify(STATE.nodes_meta);
   renderSidebar(STATE);
@@ -254,9 +270,9 @@ function update_cluster_label(cluster, label) {
 }
 
 function update_topic_name(topic, label) {
-  STATE.nodes_meta['t-' + topic] = {
+  STATE.nodes_meta['t-' + topic] = Object.assign(STATE.nodes_meta['t-' + topic] || {}, {
     label
-  };
+  });
   GRAPH.result.nodes_meta = JSON.stringify(STATE.nodes_meta);
   renderSidebar(STATE);
   RENDERER.rerender();
@@ -311,7 +327,7 @@ function expand_clusters(graph, X, clusters) {
   });
 
   STATE.meta_mode = false;
-  RENDERER.pause_in(6000);
+  RENDERER.pause_in(place_nodes(graph, RENDERER.layout) ? 500 : 6000);
   renderSidebar(STATE);
 }
 
@@ -352,7 +368,31 @@ function collapse_clusters(graph, X, clusters) {
 
   _add_clusters(graph, X, clusters);
 
-  RENDERER.pause_in(2000);
+  RENDERER.pause_in(place_nodes(graph, RENDERER.layout) ? 500 : 2000);
+}
+
+// the positions computed on the server (graph_processing.layout) are in mean edge lengths
+var LAYOUT_SCALE = 80;
+
+function place_nodes(graph, layout) {
+  // start from the server side layout if any, returns whether some nodes were placed
+  var placed = false;
+  graph.forEachNode(node => {
+    var pos = null;
+    if (node.data && node.data.isCluster) {
+      var cluster = parseInt(node.id.slice(2));
+      if (GRAPH.result.cluster_positions && GRAPH.result.cluster_positions[cluster]) {
+        pos = GRAPH.result.cluster_positions[cluster];
+      }
+    } else if (GRAPH.positions && GRAPH.positions[node.id]) {
+      pos = GRAPH.positions[node.id];
+    }
+    if (pos) {
+      layout.setNodePosition(node.id, pos[0] * LAYOUT_SCALE, pos[1] * LAYOUT_SCALE);
+      placed = true;
+    }
+  });
+  return placed;
 }
 
 function save_clusters_pos(graph) {
@@ -30,6 +30,7 @@ class Job extends React.Component {
       };
       this.toggleShowLog = this.toggleShowLog.bind(this);
       this.doDelete = this.doDelete.bind(this);
+      this.doCancel = this.doCancel.bind(this);
     }
     toggleShowLog() {
         this.setState({showLog: !this.state.showLog});
@@ -41,6 +42,12 @@ class Job extends React.Component {
         'graph_id': this.props.job.id,
       });
     }
+    doCancel() {
+      $.post('/jobs/', {
+        'action': 'cancel',
+        'graph_id': this.props.job.id,
+      });
+    }
     render() {
       if (this.state.deleted) {
         return <div></div>;
@@ -66,6 +73,8 @@ class Job extends React.Component {
                   <em>Clustering with {job.job_param_topics} topics and {job.job_param_clusters} clusters</em>
                 }
               </div>
+              {finished && job.job_param_search == 'adaptive' ?
+                <div>Adaptive model selection: {job.job_models_skipped} models skipped</div> : null}
               <div>Created: {job.created_at}</div>
               {finished ? null : <div>Current step: {job.step}</div>}
               {finished && job.time_t > 0 ?
@@ -74,6 +83,12 @@ class Job extends React.Component {
               }
             </div>
             <div className='col-md-7 text-right'>
+              {!finished && job.n_results > 0 ? <span>
+                <a className='btn btn-default' href={job.url}>
+                  <Icon name='fullscreen'/>&nbsp;&nbsp;View best model so far ({job.n_results} done)
+                </a>
+                &nbsp;&nbsp;&nbsp;&nbsp;
+              </span> : null}
               {finished && job.job_error_log === '' ? <span>
                 <a className='btn btn-success' href={job.url}>
                   <Icon name='fullscreen'/>&nbsp;&nbsp;View
@@ -94,6 +109,12 @@ class Job extends React.Component {
                 </a>
                 &nbsp;&nbsp;&nbsp;&nbsp;
                 </span> : null}
+              {!finished ? <span>
+                <button className='btn btn-default' onClick={() => this.doCancel()}>
+                  <Icon name='stop'/>&nbsp;&nbsp;Cancel
+                </button>
+                &nbsp;&nbsp;&nbsp;&nbsp;
+              </span> : null}
               <button className='btn btn-danger' onClick={() => this.doDelete()}>
                 <Icon name='trash'/>
               </button>
@@ -145,8 +166,7 @@ function render_demo() {
 var ws_scheme = window.location.protocol == "https:" ? "wss" : "ws";
 var socket = new WebSocket(ws_scheme + "://" + window.location.host + '/jobs/');
 
-socket.onmessage = function(e) {
-  console.log(e);
+function refresh() {
   $.getJSON('/jobs/', {
     as_json: true,
   }, function(data) {
@@ -155,6 +175,22 @@ socket.onmessage = function(e) {
   });
 }
 
+// a burst of messages (several jobs updated at once) only refreshes the list once
+var refresh_timeout = null;
+socket.onmessage = function(e) {
+  console.log(e);
+  if (refresh_timeout) return;
+  refresh_timeout = setTimeout(() => {
+    refresh_timeout = null;
+    refresh();
+  }, 500);
+}
+
+// in case a message was missed (socket closed, worker restarted), poll while some jobs are running
+setInterval(() => {
+  if (JOBS.user.some(job => job.progress != 1 && job.job_error_log === '')) refresh();
+}, 30000);
+
 // Call onopen directly if socket is already open
 if (socket.readyState == WebSocket.OPEN) socket.onopen();
 
@@ -1,145 +1,437 @@
-import os, subprocess, time
+import collections, hashlib, os, shutil, tempfile, time
+
+from graph_processing.runner import Runner, Cancelled
+from graph_processing.run_dirs import run_dir_paths, FifoFeeder
+
+RESULT_FILES = (
+    # (result key, linkage-cpp output file)
+    ('clusters', 'cluster'),
+    ('topics', 'beta'),
+    ('topics_per_edges', 'phi_sum'),
+    ('rho_mat', 'rho'),
+    ('pi_mat', 'PI'),
+    ('theta_qr_mat', 'thetaQR'),
+)
+
+
+def grid_runs(n_topics, n_topics_max, n_clusters, n_clusters_max, n_jobs=1):
+    """
+    Split the (K, Q) grid in linkage-cpp runs: (Kmin, Kmax, Qmin, Qmax, subdir)
+
+    With one job, a single run sweeps the whole grid. Otherwise there is one run per (K, Q),
+    each in its own subdir of the run directory since they all write out/<rep>cluster(K,Q)...
+    """
+    if n_jobs <= 1:
+        return [(n_topics, n_topics_max, n_clusters, n_clusters_max, '')]
+    return [(k, k, q, q, '%d_%d/' % (k, q))
+        for q in range(n_clusters, n_clusters_max + 1)
+        for k in range(n_topics, n_topics_max + 1)]
+
+
+def _coarse_values(lo, hi, step):
+    values = list(range(lo, hi + 1, step))
+    if values[-1] != hi:
+        values.append(hi)
+    return values
+
+
+def _box(center, steps, bounds):
+    """The center and its 8 neighbours `steps` away, clipped to the bounds of each axis"""
+    points = []
+    for dq in (-steps[1], 0, steps[1]):
+        for dk in (-steps[0], 0, steps[0]):
+            point = tuple(min(max(x + dx, lo), hi)
+                for x, dx, (lo, hi) in zip(center, (dk, dq), bounds))
+            if point not in points:
+                points.append(point)
+    return points
+
+
+def adaptive_search(n_topics, n_topics_max, n_clusters, n_clusters_max, evaluate, patience=2):
+    """
+    Coarse-to-fine search of the (K, Q) maximizing crit, instead of evaluating the full grid
+
+    `evaluate(points)` runs a batch of (K, Q) and returns {(K, Q): crit}. A coarse lattice is
+    evaluated first, then the neighbourhood of the best model, getting finer each time it does
+    not improve. Once at the finest step, the neighbourhoods of the next best models are explored
+    until `patience` of them in a row bring no improvement: the regions with a lower crit are
+    never refined.
+
+    Returns {(K, Q): crit} for the evaluated models.
+    """
+    bounds = ((n_topics, n_topics_max), (n_clusters, n_clusters_max))
+    steps = tuple(max(1, (hi - lo + 1) // 2) for lo, hi in bounds)
+    scores = {}
+
+    def run(points):
+        points = [point for point in points if point not in scores]
+        if points:
+            scores.update(evaluate(points))
+
+    def score(point):
+        return scores[point] if scores[point] is not None else float('-inf')
+
+    run([(k, q)
+        for q in _coarse_values(n_clusters, n_clusters_max, steps[1])
+        for k in _coarse_values(n_topics, n_topics_max, steps[0])])
+    best = max(scores, key=score)
+    expanded = set()
+    stale = 0
+    while True:
+        centers = sorted((point for point in scores if (point, steps) not in expanded),
+            key=score, reverse=True)
+        if not centers:
+            if steps == (1, 1):
+                break
+            steps = tuple(max(1, step // 2) for step in steps)
+            continue
+        expanded.add((centers[0], steps))
+        run(_box(centers[0], steps, bounds))
+
+        new_best = max(scores, key=score)
+        if score(new_best) > score(best):
+            best = new_best
+            stale = 0
+        elif steps != (1, 1):
+            steps = tuple(max(1, step // 2) for step in steps)
+        else:
+            stale += 1
+            if stale >= patience:
+                break
+    return scores
+
+
+SIGNAL = '[linkage-web-signal] - (K|Q|rep) finished'
+
+
+def parse_signal(line):
+    """'[linkage-web-signal] - (K|Q|rep) finished: K;Q;rep' -> 'K,Q' (None for the other lines)"""
+    if SIGNAL not in line:
+        return None
+    values = line.split(SIGNAL, 1)[1].strip(' :\r\n').split(';')
+    try:
+        return '%d,%d' % (int(values[0]), int(values[1]))
+    except (IndexError, ValueError):
+        return None
+
+
+def read_group_result(out_prefix, group, n_repeat):
+    """
+    Read the outputs of the n_repeat repetitions of a (K,Q) group and keep the best one (highest crit)
+
+    Returns (best_result, max_clusters), max_clusters being the length of the longest clusters output
+    """
+    return read_reps_result([out_prefix + str(rep) for rep in range(n_repeat)], group)
+
+
+def read_reps_result(rep_prefixes, group):
+    """Same as read_group_result, given the output prefix of each repetition"""
+    n_topics, n_clusters = [int(x) for x in group.split(',')]
+    best_result = None
+    best_crit = None
+    max_clusters = 0
+    for group_run_prefix in rep_prefixes:
+        result = {}
+
+        result['n_topics'] = n_topics
+        result['n_clusters'] = n_clusters
+
+        for key, filename in RESULT_FILES:
+            try:
+                result[key] = open(group_run_prefix + '%s(%s)' % (filename, group)).read()
+            except FileNotFoundError:
+                print('ERROR: NO %s FOR %s' % (filename.upper(), group))
+                result[key] = ''
+        print('clusters:', len(result['clusters']), result['clusters'])
+        max_clusters = max(len(result['clusters']), max_clusters)
+
+        try:
+            crit = float(open(group_run_prefix + 'crit(%s)' % group).read())
+        except FileNotFoundError:
+            print('ERROR: NO CRIT FOR %s' % group)
+            crit = None
+        result['crit'] = crit
+
+        if not best_crit or (crit and crit > best_crit):
+            best_result = result
+            best_crit = crit
+
+    return best_result, max_clusters
+
 
 def process(X, tdm, n_clusters, n_topics, id=0,
         n_clusters_max=None, n_topics_max=None,
         update=lambda log, kq_done, msg: print('kq_done', kq_done) and print(msg),
-        n_repeat=3, max_inner_lda=10, max_outer_lda=10, directed=True):
+        n_repeat=3, max_inner_lda=10, max_outer_lda=10, directed=True, n_jobs=1,
+        search='grid', patience=2, stats=None, on_result=None, resume=False, done=None,
+        timeout=None, cancelled=None, cpu_limit=None, memory_limit=None,
+        run_backend='disk', tmpfs_root=None):
+    """
+    Run linkage-cpp on the (K, Q) grid and return ({'K,Q': best result}, log)
+
+    With n_jobs > 1, the grid is split in one run per (K, Q) and up to n_jobs runs are
+    executed at the same time, each one using its share of the CPUs for OpenMP.
+
+    With search='adaptive', only the (K, Q) picked by adaptive_search are run and returned.
+    The number of models of the full grid, evaluated and skipped are set in the `stats` dict if given.
+
+    Each (K, Q) is read as soon as its n_repeat repetitions are signaled (or its run exits)
+    and passed to `on_result(group, result)`, without waiting for the rest of the grid.
+
+    The finished (K, Q, rep) are recorded in the run directory, which is kept if the process
+    is interrupted. With resume=True, the outputs of a previous interrupted run with the same
+    data and parameters are reused and only the missing repetitions are computed. `done` is
+    {'K,Q': crit} of the results the caller already has, they are neither run nor returned.
+
+    timeout, cancelled, cpu_limit and memory_limit are passed to the graph_processing.runner.Runner,
+    which raises Timeout (the run directory is kept to resume) or Cancelled. The warnings of
+    linkage-cpp are set in stats['warnings'].
+
+    run_backend is one of graph_processing.run_dirs.RUN_BACKENDS (disk, tmpfs or fifo).
+    """
     linkage_dir = '../repos/linkage-cpp/'
-    run_dir = '%sruns/%d/' % (linkage_dir, id)
-    run_dir_for_linkage = 'runs/%d/' % id
+    run_dir, run_dir_for_linkage = run_dir_paths(run_backend, linkage_dir, id, tmpfs_root)
+    checkpoint_path = run_dir + 'checkpoint'
 
-    os.system('mkdir -p %s' % run_dir)
-    os.system('cd %s;rm -rf in' % (run_dir,))
-    os.system('cd %s;mkdir in' % (run_dir,))
-    os.system('cd %s;rm -rf out' % (run_dir,))
-    os.system('cd %s;mkdir out' % (run_dir,))
+    # the checkpoint is only valid for the same data and parameters
+    fingerprint = hashlib.sha256('\n'.join(str(x) for x in (
+        X, tdm, n_repeat, max_inner_lda, max_outer_lda, directed)).encode()).hexdigest()
+    try:
+        resume = resume and open(run_dir + 'fingerprint').read() == fingerprint
+    except FileNotFoundError:
+        resume = False
 
-    open(run_dir + 'in/X.sp_mat', 'w').write(X)
-    open(run_dir + 'in/tdm.sp_mat', 'w').write(tdm)
+    # rep_prefixes: {'K,Q': {rep: output prefix of this repetition, relative to run_dir}}
+    rep_prefixes = collections.defaultdict(dict)
+    checkpointed = collections.defaultdict(set)
+    if resume:
+        for line in open(checkpoint_path):
+            group, rep, prefix = line.split()
+            rep_prefixes[group][int(rep)] = prefix
+            checkpointed[group].add(int(rep))
+        print('resuming from', sum(len(reps) for reps in checkpointed.values()), 'finished repetitions')
+    else:
+        shutil.rmtree(run_dir, ignore_errors=True)
+        os.makedirs(run_dir + 'in')
+        os.makedirs(run_dir + 'out')
+
+        if run_backend != 'fifo':
+            open(run_dir + 'in/X.sp_mat', 'w').write(X)
+            open(run_dir + 'in/tdm.sp_mat', 'w').write(tdm)
+        open(run_dir + 'fingerprint', 'w').write(fingerprint)
+    checkpoint = open(checkpoint_path, 'a')
 
     n_topics_max = n_topics if n_topics_max is None else n_topics_max
     n_clusters_max = n_clusters if n_clusters_max is None else n_clusters_max
+    done = done or {}
 
-    log = ''
-    
-    cmd_cd = 'cd {link_dir};'.format(link_dir=linkage_dir) + 'export LD_LIBRARY_PATH="build/arma/";'
-    cmd_base = ('./build/linkage ' \
-            + '{Kmin} {Kmax} {Qmin} {Qmax} {n_repeat} 0 1 100 0.0001 {max_inner_lda} {max_outer_lda} {directed} {dir}').format(
-                Kmin=n_topics,
-                Kmax=n_topics_max,
-                Qmin=n_clusters,
-                Qmax=n_clusters_max,
-                n_repeat=n_repeat,
-                max_inner_lda=max_inner_lda,
-                max_outer_lda=max_outer_lda,
-                directed=1 if directed else 0,
-                dir=run_dir_for_linkage)
-
-    log += cmd_cd + cmd_base + '\n'
-    n_done = 0
-    update(log, n_done, log)
-    last_update = time.time()
-    print(cmd_base)
-    # TODO: capture warnings
-    for line in os.popen(cmd_cd + cmd_base):
-        # print(line.strip())
-        log += line
-
-        # signal: "[linkage-web-signal] - (K|Q) finished: " << K << ";" << Q << "" << endl
-        if '[linkage-web-signal] - (K|Q|rep) finished' in line:
-            n_done += 1
-
-        diff = time.time() - last_update
-        # if diff > 5 or '[linkage-web-signal] - (K|Q) finished' in line:
-        if '[linkage-web-signal] - (K|Q|rep) finished' in line:
-            update(log, n_done, line.strip())
-            last_update = time.time()
-    print('processing done')
+    grid = [(k, q)
+        for q in range(n_clusters, n_clusters_max + 1)
+        for k in range(n_topics, n_topics_max + 1)]
 
-    groups = {}
-    for q in range(n_clusters, n_clusters_max + 1):
-        for k in range(n_topics, n_topics_max + 1):
-            groups['%d,%d' % (k, q)] = {}
+    env = dict(os.environ, LD_LIBRARY_PATH='build/arma/')
+    if n_jobs > 1 and len(grid) > 1:
+        # share the CPUs between the runs executed at the same time
+        env['OMP_NUM_THREADS'] = str(max(1, (os.cpu_count() or 1) // n_jobs))
 
-    if len(groups.keys()) == 0:
-        print('ERROR: NO (?,?) RESULTS FOUND')
+    runner = Runner(timeout=timeout, cancelled=cancelled, cpu_limit=cpu_limit, memory_limit=memory_limit)
+    log = runner.log
+    n_done = sum(n_repeat if '%d,%d' % point in done else len(checkpointed['%d,%d' % point])
+        for point in grid)
+    update(str(log), n_done, '')
 
+    def start_run(run):
+        Kmin, Kmax, Qmin, Qmax, subdir, reps = run
+        cmd = ['./build/linkage'] + [str(x) for x in (
+            Kmin, Kmax, Qmin, Qmax, len(reps), 0, 1, 100, 0.0001,
+            max_inner_lda, max_outer_lda, 1 if directed else 0,
+        )] + [run_dir_for_linkage + subdir]
+        print(' '.join(cmd))
+        log.append('cd {link_dir};export LD_LIBRARY_PATH="build/arma/";'.format(link_dir=linkage_dir)
+            + ' '.join(cmd) + '\n')
+        if use_fifo:
+            # each run reads its own pipes
+            feeders[run] = FifoFeeder(run_dir + subdir + 'in', {'X.sp_mat': X, 'tdm.sp_mat': tdm})
+        elif run_backend == 'fifo':
+            inputs_on_disk(subdir)
+        runner.start(run, cmd, cwd=linkage_dir, env=env)
+
+    def inputs_on_disk(subdir):
+        """After a fallback from the pipes, the inputs of the runs written in in/ like with disk"""
+        in_dir = run_dir + 'in/'
+        if not os.path.isfile(in_dir + 'X.sp_mat'):
+            for filename, text in (('X.sp_mat', X), ('tdm.sp_mat', tdm)):
+                if os.path.lexists(in_dir + filename):
+                    os.remove(in_dir + filename)
+                open(in_dir + filename, 'w').write(text)
+        if subdir and not os.path.islink(run_dir + subdir + 'in'):
+            shutil.rmtree(run_dir + subdir + 'in')
+            os.symlink('../in', run_dir + subdir + 'in')
+
+    feeders = {}
+    # fifo runs until one fails on its pipes, then all the runs read their inputs on disk
+    use_fifo = run_backend == 'fifo'
+
+    def stop_feeders():
+        while feeders:
+            feeders.popitem()[1].stop()
+
+    groups = {}
+    # repetitions signaled by the current run of each group
+    reps_signaled = collections.Counter()
     max_clusters = 0
-    for group, group_result in groups.items():
-        best_result = None
-        best_crit = None
-        for rep in range(n_repeat):
-            result = {}
-            group_run_prefix = run_dir + 'out/' + str(rep)
-
-            n_topics, n_clusters = [int(x) for x in group.split(',')]
-            result['n_topics'] = n_topics
-            result['n_clusters'] = n_clusters
-            try:
-                clusters = open(group_run_prefix + 'cluster(%s)' % group).read()
-            except FileNotFoundError:
-                print('ERROR: NO CLUSTERS FOR %s' % group)
-                clusters = ''
-            print('clusters:', len(clusters), clusters)
-            max_clusters = max(len(clusters), max_clusters)
-            result['clusters'] = clusters
 
-            try:
-                topics = open(group_run_prefix + 'beta(%s)' % group).read()
-            except FileNotFoundError:
-                print('ERROR: NO TOPICS FOR %s' % group)
-                topics = ''
-            result['topics'] = topics
+    def run_groups(run):
+        Kmin, Kmax, Qmin, Qmax = run[:4]
+        return ['%d,%d' % (k, q) for q in range(Qmin, Qmax + 1) for k in range(Kmin, Kmax + 1)]
 
-            try:
-                topics_per_edges = open(group_run_prefix + 'phi_sum(%s)' % group).read()
-            except FileNotFoundError:
-                print('ERROR: NO TOPICS FOR %s' % group)
-                topics_per_edges = ''
-            result['topics_per_edges'] = topics_per_edges
+    def save_checkpoint(group, rep):
+        if rep in checkpointed[group] \
+                or not os.path.exists(run_dir + rep_prefixes[group][rep] + 'crit(%s)' % group):
+            return
+        checkpointed[group].add(rep)
+        checkpoint.write('%s %d %s\n' % (group, rep, rep_prefixes[group][rep]))
+        checkpoint.flush()
 
-            try:
-                rho_mat = open(group_run_prefix + 'rho(%s)' % group).read()
-            except FileNotFoundError:
-                print('ERROR: NO TOPICS FOR %s' % group)
-                rho_mat = ''
-            result['rho_mat'] = rho_mat
+    def ingest(group):
+        nonlocal max_clusters
+        if group in groups:
+            return
+        prefixes = rep_prefixes[group]
+        best_result, group_max_clusters = read_reps_result(
+            [run_dir + prefixes[rep] for rep in sorted(prefixes)], group)
+        max_clusters = max(group_max_clusters, max_clusters)
+        groups[group] = best_result
+        if on_result:
+            on_result(group, best_result)
 
-            try:
-                pi_mat = open(group_run_prefix + 'PI(%s)' % group).read()
-            except FileNotFoundError:
-                print('ERROR: NO TOPICS FOR %s' % group)
-                pi_mat = ''
-            result['pi_mat'] = pi_mat
+    def plan_runs(runs):
+        """Add the repetitions to compute to each run, on resume only the missing ones of each (K, Q)"""
+        if not resume:
+            return [run + (tuple(range(n_repeat)),) for run in runs]
+        planned = []
+        for run in runs:
+            for group in run_groups(run):
+                k, q = [int(x) for x in group.split(',')]
+                missing = [rep for rep in range(n_repeat) if rep not in checkpointed[group]]
+                if missing:
+                    # a new subdir, the outputs of the interrupted run may be needed
+                    subdir = os.path.basename(tempfile.mkdtemp(prefix='%d_%d.' % (k, q), dir=run_dir)) + '/'
+                    planned.append((k, k, q, q, subdir, tuple(missing)))
+        return planned
 
-            try:
-                theta_qr_mat = open(group_run_prefix + 'thetaQR(%s)' % group).read()
-            except FileNotFoundError:
-                print('ERROR: NO TOPICS FOR %s' % group)
-                theta_qr_mat = ''
-            result['theta_qr_mat'] = theta_qr_mat
+    def execute(runs):
+        nonlocal n_done, use_fifo
+        for group in (group for run in runs for group in run_groups(run)):
+            if len(checkpointed[group]) == n_repeat:
+                ingest(group)
+        runs = plan_runs(runs)
+        for run in runs:
+            subdir, reps = run[-2:]
+            if subdir:
+                os.makedirs(run_dir + subdir + 'out', exist_ok=True)
+                if run_backend == 'fifo':
+                    os.makedirs(run_dir + subdir + 'in', exist_ok=True)
+                else:
+                    os.symlink('../in', run_dir + subdir + 'in')
+            for group in run_groups(run):
+                reps_signaled[group] = 0
+                for i, rep in enumerate(reps):
+                    rep_prefixes[group][rep] = subdir + 'out/' + str(i)
 
-            try:
-                crit = float(open(group_run_prefix + 'crit(%s)' % group).read())
-            except FileNotFoundError:
-                print('ERROR: NO CRIT FOR %s' % group)
-                crit = None
-            result['crit'] = crit
+        pending = list(runs)
+        while pending and runner.running < n_jobs:
+            start_run(pending.pop(0))
+
+        for run, line in runner.lines():
+            if line is None:
+                if run in feeders:
+                    feeders.pop(run).stop()
+                    if runner.returncodes[run] and not any(reps_signaled[g] for g in run_groups(run)):
+                        # failed before finishing any repetition, maybe while reading a pipe
+                        msg = '[linkage-web] %s failed reading its inputs from named pipes, ' \
+                            'running again with the inputs on disk\n' % ' '.join(str(x) for x in run[:4])
+                        print(msg, end='')
+                        log.append(msg)
+                        use_fifo = False
+                        start_run(run)
+                        continue
+                # whatever the signals said, the outputs of an exited run are final
+                for group in run_groups(run):
+                    for rep in run[-1]:
+                        save_checkpoint(group, rep)
+                    ingest(group)
+                if pending:
+                    start_run(pending.pop(0))
+                continue
+
+            # signal: "[linkage-web-signal] - (K|Q|rep) finished: " << K << ";" << Q << ";" << rep << endl
+            if SIGNAL in line:
+                n_done += 1
+                update(str(log), n_done, line.strip())
+                group = parse_signal(line)
+                if group in reps_signaled and reps_signaled[group] < len(run[-1]):
+                    # the repetitions of a (K, Q) are run one after the other
+                    save_checkpoint(group, run[-1][reps_signaled[group]])
+                    reps_signaled[group] += 1
+                    if len(checkpointed[group]) == n_repeat:
+                        ingest(group)
+
+    def read_groups(points):
+        for k, q in points:
+            ingest('%d,%d' % (k, q))
 
-            if not best_crit or (crit and crit > best_crit):
-                best_result = result
-                best_crit = crit
+    def evaluate(points):
+        todo = [point for point in points if '%d,%d' % point not in done]
+        # one run per (K, Q) so that any subset of the grid can be evaluated
+        execute([(k, k, q, q, '%d_%d/' % (k, q)) for k, q in todo])
+        read_groups(todo)
+        return {(k, q): done['%d,%d' % (k, q)] if '%d,%d' % (k, q) in done
+            else groups['%d,%d' % (k, q)]['crit'] for k, q in points}
 
-        for key in best_result:
-            group_result[key] = best_result[key]
+    try:
+        if search == 'adaptive':
+            evaluated = adaptive_search(n_topics, n_topics_max, n_clusters, n_clusters_max, evaluate, patience)
+            n_evaluated = len(evaluated)
+            msg = '[linkage-web] adaptive search: %d/%d models evaluated, %d skipped\n' % (
+                n_evaluated, len(grid), len(grid) - n_evaluated)
+            print(msg, end='')
+            log.append(msg)
+        else:
+            todo = [point for point in grid if '%d,%d' % point not in done]
+            if len(todo) == len(grid):
+                execute(grid_runs(n_topics, n_topics_max, n_clusters, n_clusters_max, n_jobs))
+            else:
+                execute([(k, k, q, q, '%d_%d/' % (k, q)) for k, q in todo])
+            read_groups(todo)
+            n_evaluated = len(grid)
+    except Cancelled:
+        stop_feeders()
+        checkpoint.close()
+        shutil.rmtree(run_dir, ignore_errors=True)
+        raise
+    finally:
+        stop_feeders()
+        checkpoint.close()
+        if stats is not None:
+            stats['warnings'] = runner.warnings
+    print('processing done')
+
+    if stats is not None:
+        stats['models'] = len(grid)
+        stats['models_evaluated'] = n_evaluated
+        stats['models_skipped'] = len(grid) - n_evaluated
+
+    if len(groups.keys()) + len(done) == 0:
+        print('ERROR: NO (?,?) RESULTS FOUND')
 
     if max_clusters == 0:
         print('LOG:')
         print(log)
 
-    os.system('rm -rf %s' % (run_dir,))
+    shutil.rmtree(run_dir, ignore_errors=True)
 
-    return groups, log
+    return groups, str(log)
 
 if __name__ == '__main__':
     from sample_graph import X, tdm
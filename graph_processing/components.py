@@ -0,0 +1,95 @@
+class DisjointSet:
+    """
+    Union-find over hashable nodes, with path compression and union by size
+
+    Nodes are added the first time they are seen in `union` (or with `add`),
+    each node starts in its own component.
+    """
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+        # {root: index of the first node added of its component}
+        self.first = {}
+
+    def __len__(self):
+        return len(self.parent)
+
+    def __contains__(self, node):
+        return node in self.parent
+
+    def add(self, node):
+        if node not in self.parent:
+            self.first[node] = len(self.parent)
+            self.parent[node] = node
+            self.size[node] = 1
+
+    def find(self, node):
+        parent = self.parent
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        # path compression: attach every node on the way directly to the root
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    def union(self, a, b):
+        self.add(a)
+        self.add(b)
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return root_a
+        # union by size: the smallest tree goes under the root of the biggest one
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size.pop(root_b)
+        self.first[root_a] = min(self.first[root_a], self.first.pop(root_b))
+        return root_a
+
+    def component_size(self, node):
+        return self.size[self.find(node)]
+
+    def roots(self):
+        """Roots of the components, in the order their first node was added"""
+        return sorted(self.size, key=self.first.__getitem__)
+
+    def labels(self):
+        """{node: component}, components are numbered in the order their first node was added"""
+        components = {}
+        labels = {}
+        for node in self.parent:
+            root = self.find(node)
+            if root not in components:
+                components[root] = len(components)
+            labels[node] = components[root]
+        return labels
+
+
+def disjoint_set(edges):
+    """Build the DisjointSet of the (source, target) edges"""
+    components = DisjointSet()
+    for source, target in edges:
+        components.union(source, target)
+    return components
+
+
+def connected_components(edges):
+    """Label the nodes of the (source, target) edges with their connected component"""
+    return disjoint_set(edges).labels()
+
+
+def largest_component(edges):
+    """
+    Nodes of the largest connected component of the (source, target) edges,
+    ties are broken by the order the nodes were first seen
+    """
+    components = disjoint_set(edges)
+    if len(components) == 0:
+        return set()
+    best_root = None
+    for root in components.roots():
+        if best_root is None or components.size[root] > components.size[best_root]:
+            best_root = root
+    return {node for node in components.parent if components.find(node) == best_root}
@@ -1,33 +1,314 @@
-import os, subprocess, time
+"""
+Force-directed layout of the graphs, computed in process with NumPy
+
+    positions = spacialize(links, n_nodes)
+
+ForceAtlas2 (Jacomy et al. 2014): linear attraction along the edges, repulsion
+between all the nodes proportional to their degree + 1, gravity toward the center
+and the adaptive speed of Gephi. The repulsion is approximated Barnes-Hut style on
+a quadtree of the positions: the nodes of neighbour cells of the finest level repel
+each other exactly, the cells further away by their total mass at their center of
+mass, at the coarsest level where they are not neighbours.
+"""
+import numpy as np
+
+ITERATIONS = 100
+MULTILEVEL_ITERATIONS = 30 # of each cluster, started from their centroids the layouts need fewer
+REFINE_ITERATIONS = 10 # of the whole graph after a multilevel layout
+SCALING = 2.0 # kr, repulsion
+GRAVITY = 1.0 # kg
+JITTER_TOLERANCE = 1.0
+MAX_DEPTH = 20 # levels of the quadtree, cell ids stay within an int64
+NEAR_PAIRS_PER_NODE = 64 # the quadtree is refined until the exact pairs are fewer than this per node
+
+NEIGHBOURS = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+# children of the neighbours of the parent cell, relative to the children of the parent
+PARENT_NEIGHBOURS_CHILDREN = np.array([(dx, dy) for dx in range(-2, 4) for dy in range(-2, 4)])
+
+
+def _lookup(keys, ids):
+    """Index of each of `ids` in the sorted `keys`, -1 if missing"""
+    if not len(keys):
+        return np.full(len(ids), -1)
+    indexes = np.searchsorted(keys, ids)
+    indexes[indexes == len(keys)] = 0
+    return np.where(keys[indexes] == ids, indexes, -1)
+
+
+def _interleave(x, y):
+    """Morton code of the cells (x, y): sorted by code, the nodes of each cell at every level are contiguous"""
+    codes = []
+    for v in (x, y):
+        v = v.astype(np.int64)
+        for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                (2, 0x3333333333333333), (1, 0x5555555555555555)):
+            v = (v | (v << shift)) & mask
+        codes.append(v)
+    return codes[0] << 1 | codes[1]
+
+
+def _deinterleave(codes):
+    xy = []
+    for v in (codes >> 1, codes):
+        v = v & 0x5555555555555555
+        for shift, mask in ((1, 0x3333333333333333), (2, 0x0F0F0F0F0F0F0F0F), (4, 0x00FF00FF00FF00FF),
+                (8, 0x0000FFFF0000FFFF), (16, 0x00000000FFFFFFFF)):
+            v = (v | (v >> shift)) & mask
+        xy.append(v)
+    return np.stack(xy, axis=1)
+
+
+def _cells(codes, level):
+    """(keys, starts, counts, inverse) of the occupied cells of `level` for the sorted Morton `codes`"""
+    level_codes = codes >> (2 * (MAX_DEPTH - level))
+    new = np.ones(len(codes), dtype=bool)
+    new[1:] = level_codes[1:] != level_codes[:-1]
+    starts = np.flatnonzero(new)
+    counts = np.diff(np.append(starts, len(codes)))
+    return level_codes[starts], starts, counts, np.cumsum(new) - 1
+
+
+def _depth(codes, n_nodes):
+    """Finest level of the quadtree, where the exact pairs are few enough"""
+    depth = 1
+    while 4 ** depth < n_nodes / 4:
+        depth += 1
+    while depth < MAX_DEPTH:
+        counts = _cells(codes, depth)[2].astype(np.float64)
+        if len(NEIGHBOURS) * (counts ** 2).sum() <= NEAR_PAIRS_PER_NODE * n_nodes:
+            break
+        depth += 1
+    return depth
+
+
+def repulsion(positions, masses, scaling=SCALING):
+    """ForceAtlas2 repulsion on each node, approximated on a quadtree of `positions`"""
+    n_nodes = len(positions)
+    forces = np.zeros((n_nodes, 2))
+    if n_nodes < 2:
+        return forces
+
+    origin = positions.min(axis=0)
+    size = max(float((positions.max(axis=0) - origin).max()), 1e-9) * (1 + 1e-9)
+    xy = ((positions - origin) / size * (1 << MAX_DEPTH)).astype(np.int64)
+    np.clip(xy, 0, (1 << MAX_DEPTH) - 1, out=xy)
+    codes = _interleave(xy[:, 0], xy[:, 1])
+    order = np.argsort(codes, kind='stable')
+    codes, positions, masses = codes[order], positions[order], masses[order]
+    depth = _depth(codes, n_nodes)
+    sorted_forces = np.zeros((n_nodes, 2))
+
+    # far field: cell to cell, from the cells of the interaction list of each level
+    for level in range(2, depth + 1):
+        side = 1 << level
+        keys, starts, counts, _ = _cells(codes, level)
+        mass = np.add.reduceat(masses, starts)
+        center = np.stack([np.add.reduceat(masses * positions[:, axis], starts) for axis in (0, 1)], axis=1)
+        center /= mass[:, None]
+        cells = _deinterleave(keys)
+
+        # one offset at a time, the arrays stay the size of the cells (or of the nodes below)
+        parents = cells >> 1 << 1
+        cell_forces = np.zeros((len(keys), 2))
+        for offset in PARENT_NEIGHBOURS_CHILDREN:
+            targets = parents + offset
+            far = (np.abs(targets - cells) > 1).any(axis=1) & ((targets >= 0) & (targets < side)).all(axis=1)
+            sources = np.flatnonzero(far)
+            found = _lookup(keys, _interleave(targets[far, 0], targets[far, 1]))
+            sources, found = sources[found >= 0], found[found >= 0]
+            delta = center[sources] - center[found]
+            weights = scaling * mass[found] / np.maximum((delta ** 2).sum(axis=1), 1e-9)
+            for axis in (0, 1):
+                cell_forces[:, axis] += np.bincount(sources, weights=weights * delta[:, axis], minlength=len(keys))
+        sorted_forces += masses[:, None] * np.repeat(cell_forces, counts, axis=0)
 
-def spacialize(X, labels, id=0):
-    viz_dir = '/home/mel/prog/scratch/mega-viz'
-    runs_dir = 'pm_runs/'
-    run_dir = '%s/%d/' % (runs_dir, id)
+    # near field: node to node, within the neighbour cells of the finest level
+    side = 1 << depth
+    keys, starts, counts, inverse = _cells(codes, depth)
+    cells = _deinterleave(keys)
+    for offset in NEIGHBOURS:
+        targets = cells + offset
+        inside = ((targets >= 0) & (targets < side)).all(axis=1)
+        found = np.full(len(keys), -1)
+        found[inside] = _lookup(keys, _interleave(targets[inside, 0], targets[inside, 1]))
+        # every node of a cell with every node of the neighbour cell
+        lengths = np.where(found >= 0, counts[found], 0)[inverse]
+        sources = np.repeat(np.arange(n_nodes), lengths)
+        shifts = np.arange(len(sources)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        others = np.repeat(starts[found][inverse], lengths) + shifts
+        pairs = sources != others
+        sources, others = sources[pairs], others[pairs]
+        delta = positions[sources] - positions[others]
+        weights = scaling * masses[sources] * masses[others] / np.maximum((delta ** 2).sum(axis=1), 1e-9)
+        for axis in (0, 1):
+            sorted_forces[:, axis] += np.bincount(sources, weights=weights * delta[:, axis], minlength=n_nodes)
 
-    abs_run_dir = os.getcwd() + '/' + run_dir
+    forces[order] = sorted_forces
+    return forces
 
-    os.system('mkdir -p %s' % run_dir)
-    os.system('cd %s;rm -rf in' % (run_dir,))
-    os.system('cd %s;mkdir in' % (run_dir,))
-    os.system('cd %s;rm -rf out' % (run_dir,))
-    os.system('cd %s;mkdir out' % (run_dir,))
-    os.system('cd %s;rm -rf layout' % (run_dir,))
-    os.system('cd %s;mkdir layout' % (run_dir,))
 
-    open(run_dir + 'in/X', 'w').write(X)
-    open(run_dir + 'in/labels', 'w').write(labels)
+def force_atlas2(links, n_nodes, iterations=ITERATIONS, positions=None, weights=None, masses=None, seed=0,
+        scaling=SCALING, gravity=GRAVITY, cancelled=None):
+    """
+    (n_nodes, 2) positions after `iterations` of ForceAtlas2 on the (n, 2) `links`,
+    from `positions` or from random ones, the `masses` are the degrees + 1 by default
+    """
+    links = np.asarray(links, dtype=np.int64).reshape(-1, 2)
+    weights = np.ones(len(links)) if weights is None else np.asarray(weights, dtype=np.float64)
+    if masses is None:
+        masses = np.bincount(links.ravel(), minlength=n_nodes)[:n_nodes] + 1.0
+    masses = np.asarray(masses, dtype=np.float64)
+    if positions is None:
+        positions = np.random.RandomState(seed).uniform(-1, 1, (n_nodes, 2)) * np.sqrt(n_nodes) * 10
+    positions = np.array(positions, dtype=np.float64).reshape(n_nodes, 2)
+    if not n_nodes:
+        return positions
 
-    os.system('cd %s;node to_bin.js %s' % (viz_dir, abs_run_dir))
+    previous = np.zeros((n_nodes, 2))
+    speed, speed_efficiency = 1.0, 1.0
+    for i in range(iterations):
+        if cancelled and cancelled():
+            break
+        forces = repulsion(positions, masses, scaling)
+
+        delta = positions[links[:, 1]] - positions[links[:, 0]]
+        for axis in (0, 1):
+            attraction = np.bincount(links[:, 0], weights=weights * delta[:, axis], minlength=n_nodes)
+            attraction -= np.bincount(links[:, 1], weights=weights * delta[:, axis], minlength=n_nodes)
+            forces[:, axis] += attraction
+
+        distance = np.sqrt((positions ** 2).sum(axis=1))
+        forces -= positions * (gravity * masses / np.maximum(distance, 1e-9))[:, None]
+
+        # adaptive speed of Gephi's ForceAtlas2
+        swinging = masses * np.sqrt(((forces - previous) ** 2).sum(axis=1))
+        traction = masses * np.sqrt(((forces + previous) ** 2).sum(axis=1)) / 2
+        total_swinging, total_traction = swinging.sum(), traction.sum()
+        estimated_jitter = 0.05 * np.sqrt(n_nodes)
+        jitter = JITTER_TOLERANCE * max(np.sqrt(estimated_jitter),
+            min(10, estimated_jitter * total_traction / n_nodes ** 2))
+        if total_swinging > 0:
+            if total_swinging / total_traction > 2:
+                if speed_efficiency > 0.05:
+                    speed_efficiency *= 0.5
+                jitter = max(jitter, JITTER_TOLERANCE)
+            target_speed = jitter * speed_efficiency * total_traction / total_swinging
+            if total_swinging > jitter * total_traction:
+                if speed_efficiency > 0.05:
+                    speed_efficiency *= 0.7
+            elif speed < 1000:
+                speed_efficiency *= 1.3
+            speed += min(target_speed - speed, 0.5 * speed)
+
+        positions += forces * (speed / (1 + np.sqrt(speed * swinging)))[:, None]
+        previous = forces
+    return positions
+
+
+def normalize(positions, links):
+    """`positions` centered, scaled to a mean edge length of 1, as float32"""
+    positions = positions - positions.mean(axis=0) if len(positions) else positions
+    if len(links):
+        lengths = np.sqrt(((positions[links[:, 0]] - positions[links[:, 1]]) ** 2).sum(axis=1))
+        if lengths.mean() > 0:
+            positions = positions / lengths.mean()
+    return positions.astype(np.float32)
+
+
+def spacialize(links, n_nodes, iterations=ITERATIONS, cancelled=None, clusters=None, pi=None, n_workers=1):
+    """
+    Positions of the nodes of a graph for the frontend, from its (n, 2) links,
+    with a multilevel layout if the `clusters` of the nodes and their `pi` are given
+    """
+    links = np.asarray(links, dtype=np.int64).reshape(-1, 2)
+    if clusters is not None:
+        positions = multilevel(links, n_nodes, clusters, pi, iterations, n_workers=n_workers, cancelled=cancelled)
+    else:
+        positions = force_atlas2(links, n_nodes, iterations, cancelled=cancelled)
+    return normalize(positions, links)
+
+
+def _pool(n_workers):
+    try:
+        # celery workers are daemonic processes, only billiard (celery's fork of
+        # multiprocessing) allows them to have children
+        from billiard import Pool
+    except ImportError:
+        from multiprocessing import Pool
+    return Pool(n_workers)
+
+
+def _layout_cluster(links, n_nodes, iterations, seed):
+    """Layout of the nodes of a cluster, centered on 0, and its radius"""
+    if not n_nodes:
+        return np.zeros((0, 2)), 0.0
+    positions = force_atlas2(links, n_nodes, iterations, seed=seed)
+    positions -= positions.mean(axis=0)
+    return positions, float(np.sqrt((positions ** 2).sum(axis=1)).max())
+
+
+def multilevel(links, n_nodes, clusters, pi, iterations=MULTILEVEL_ITERATIONS, refine_iterations=REFINE_ITERATIONS,
+        n_workers=1, cancelled=None):
+    """
+    ForceAtlas2 positions of the nodes of a clustered graph, without running it on the whole graph
+    from random positions: the graph of the clusters (weighted by `pi`) and the nodes of each
+    cluster (`iterations`, on `n_workers` processes) are laid out separately, each cluster is put
+    at the position of its centroid, then ForceAtlas2 refines the whole (`refine_iterations`)
+    """
+    links = np.asarray(links, dtype=np.int64).reshape(-1, 2)
+    clusters = np.asarray(clusters, dtype=np.int64)[:n_nodes]
+    if len(clusters) < n_nodes:
+        # nodes without cluster, together
+        clusters = np.append(clusters, np.full(n_nodes - len(clusters), clusters.max() + 1 if len(clusters) else 0))
+    n_clusters = max(int(clusters.max()) + 1 if len(clusters) else 0, len(pi))
+
+    # the nodes of each cluster numbered from 0, and the links within the clusters
+    order = np.argsort(clusters, kind='stable')
+    sizes = np.bincount(clusters, minlength=n_clusters)
+    starts = np.cumsum(sizes) - sizes
+    local = np.empty(n_nodes, dtype=np.int64)
+    local[order] = np.arange(n_nodes) - np.repeat(starts, sizes)
+    internal = links[clusters[links[:, 0]] == clusters[links[:, 1]]]
+    internal = internal[np.argsort(clusters[internal[:, 0]], kind='stable')]
+    link_counts = np.bincount(clusters[internal[:, 0]], minlength=n_clusters)
+    link_starts = np.cumsum(link_counts) - link_counts
+    tasks = [(local[internal[link_starts[q]:link_starts[q] + link_counts[q]]], int(sizes[q]), iterations, q)
+        for q in range(n_clusters)]
+
+    pool = _pool(n_workers) if n_workers > 1 else None
+    try:
+        pending = pool.starmap_async(_layout_cluster, tasks) if pool else None
+
+        # the centroids, heavy as their number of nodes, attracted as their cluster to cluster probability
+        pi = np.pad(np.asarray(pi, dtype=np.float64)[:n_clusters, :n_clusters],
+            (0, max(n_clusters - len(pi), 0)))
+        pi = pi + pi.T
+        sources, targets = np.nonzero(np.triu(pi, 1))
+        centroids = force_atlas2(np.stack([sources, targets], axis=1), n_clusters, iterations,
+            weights=pi[sources, targets] / pi.max() if len(sources) else None, masses=sizes + 1.0)
+
+        layouts = pending.get() if pool else [_layout_cluster(*task) for task in tasks]
+        if pool:
+            pool.close()
+            pool.join()
+    finally:
+        if pool:
+            pool.terminate()
+
+    # the centroids are spread or brought closer until the clusters just do not overlap
+    radiuses = np.array([radius for _, radius in layouts]) + 1
+    if n_clusters > 1:
+        distances = np.sqrt(((centroids[:, None] - centroids[None]) ** 2).sum(axis=2))
+        np.fill_diagonal(distances, np.inf)
+        centroids *= ((radiuses[:, None] + radiuses[None]) / np.maximum(distances, 1e-9)).max()
+
+    positions = np.concatenate([layout for layout, _ in layouts]) if n_clusters else np.zeros((0, 2))
+    positions = positions[local + starts[clusters]] + centroids[clusters]
+    if cancelled and cancelled():
+        return positions
+    return force_atlas2(links, n_nodes, refine_iterations, positions=positions, cancelled=cancelled)
 
-    # TODO: stop after step N
-    os.system('cd %s/layout; %s/ngraph.native/layout++ ../out/links.bin' % (run_dir, viz_dir))
 
 if __name__ == '__main__':
-    X = """0 1 1
-0 2 1
-3 4 1
-4 0 1
-"""
-    labels = "a b c d e"
-    spacialize(X, labels)
+    links = np.array([[0, 1], [0, 2], [3, 4], [4, 0]])
+    print(spacialize(links, 5))
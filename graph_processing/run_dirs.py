@@ -0,0 +1,90 @@
+"""
+Where the linkage-cpp runs read their inputs and write their outputs
+
+    - disk: runs/<id>/ in the linkage-cpp directory
+    - tmpfs: <tmpfs_root>/linkage-runs/<id>/, on a memory-backed filesystem (/dev/shm by
+      default) so the inputs, the outputs read back and the final cleanup never touch the disk
+    - fifo: runs/<id>/ like disk, but the inputs are not written: each run reads them from
+      named pipes fed by a thread of the worker. Opt-in, linkage-cpp is not known to read its
+      inputs sequentially: a run that fails before finishing any repetition is run again with
+      its inputs on disk, like the rest of the job
+"""
+import errno, os, tempfile, threading
+
+RUN_BACKENDS = ('disk', 'tmpfs', 'fifo')
+TMPFS_ROOT = '/dev/shm'
+
+
+def run_dir_paths(backend, linkage_dir, id, tmpfs_root=None):
+    """(run_dir, run_dir_for_linkage): the run directory for the worker and for linkage-cpp (relative to linkage_dir)"""
+    if backend not in RUN_BACKENDS:
+        raise ValueError('unknown run backend: %s' % backend)
+    if backend == 'tmpfs':
+        run_dir = os.path.join(os.path.abspath(tmpfs_root or TMPFS_ROOT), 'linkage-runs', str(id)) + '/'
+        return run_dir, run_dir
+    return '%sruns/%d/' % (linkage_dir, id), 'runs/%d/' % id
+
+
+class Busy(Exception):
+    """The run directory is used by another process"""
+
+
+def lock_run(id):
+    """
+    Exclusive lease of this process on the run directory `id`, whatever its backend, released
+    when the returned file is closed or the process dies, raises Busy if another process has it
+    """
+    import fcntl
+
+    lock = open(os.path.join(tempfile.gettempdir(), 'linkage-run-%s.lock' % id), 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        raise Busy(id)
+    return lock
+
+
+class FifoFeeder:
+    """
+    Serve {filename: text} through named pipes created in `in_dir`
+
+    Each input is written whole every time the run opens it, so it can be read again from
+    the start by opening it again (not by seeking back). stop() ends the threads once the
+    run exited, or if it never opened them.
+    """
+
+    def __init__(self, in_dir, inputs):
+        self.stopped = threading.Event()
+        self.threads = []
+        for filename, text in inputs.items():
+            path = os.path.join(in_dir, filename)
+            if os.path.lexists(path):
+                os.remove(path)
+            os.mkfifo(path)
+            thread = threading.Thread(target=self._feed, args=(path, text.encode()), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _feed(self, path, data):
+        while not self.stopped.is_set():
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno != errno.ENXIO: # ENXIO: nobody opened it for reading yet
+                    raise
+                self.stopped.wait(0.01)
+                continue
+            os.set_blocking(fd, True)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+            except BrokenPipeError:
+                pass
+            # the run may open an input again for another pass, serve it again
+            self.stopped.wait(0.01)
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,176 @@
+"""
+Managed execution of the external programs (linkage-cpp, the layout tools)
+
+The processes are started without a shell, in their own process group, with
+optional CPU time and memory limits. Their stdout and stderr are streamed line
+by line by reader threads, so several processes can be followed at once, and
+the log only keeps the last lines. All the processes of a Runner share a
+deadline and can be cancelled: they are killed and Timeout/Cancelled raised.
+"""
+import collections, os, queue, re, signal, subprocess, threading, time
+
+LOG_LINES = 5000 # lines kept in a RingLog
+MAX_WARNINGS = 100
+POLL_INTERVAL = 2 # seconds between two checks of the deadline and of the cancellation
+
+WARNING_RE = re.compile(r'warn', re.IGNORECASE)
+
+
+class RunnerError(Exception):
+    pass
+
+
+class Timeout(RunnerError):
+    pass
+
+
+class Cancelled(RunnerError):
+    pass
+
+
+class RingLog:
+    """Text log keeping only the last `maxlen` lines"""
+
+    def __init__(self, maxlen=LOG_LINES):
+        self.lines = collections.deque(maxlen=maxlen)
+        self.n_lines = 0
+
+    def append(self, line):
+        self.lines.append(line)
+        self.n_lines += 1
+
+    def __str__(self):
+        dropped = self.n_lines - len(self.lines)
+        head = '[... %d lines dropped]\n' % dropped if dropped else ''
+        return head + ''.join(self.lines)
+
+
+def _set_limits(pid, cpu_limit, memory_limit):
+    # set from the parent once started, a preexec_fn is not safe with the reader threads running
+    import resource
+    try:
+        if cpu_limit:
+            resource.prlimit(pid, resource.RLIMIT_CPU, (cpu_limit, cpu_limit))
+        if memory_limit:
+            resource.prlimit(pid, resource.RLIMIT_AS, (memory_limit, memory_limit))
+    except ProcessLookupError:
+        pass # already exited
+
+
+class Runner:
+    """
+    Run processes and follow their output
+
+        runner = Runner(timeout=3600)
+        runner.start('a', ['./build/linkage', ...], cwd=...)
+        for tag, line in runner.lines():
+            ... # line is None once the process `tag` exited
+
+    timeout: seconds for all the processes of the runner
+    cancelled: callable polled every POLL_INTERVAL, the processes are killed when it returns True
+    cpu_limit: CPU seconds per process, memory_limit: bytes of address space per process
+    """
+
+    def __init__(self, timeout=None, cancelled=None, cpu_limit=None, memory_limit=None, log=None):
+        self.deadline = time.time() + timeout if timeout else None
+        self.cancelled = cancelled
+        self.cpu_limit = cpu_limit
+        self.memory_limit = memory_limit
+        self.log = log if log is not None else RingLog()
+        self.warnings = []
+        self.events = queue.Queue()
+        self.procs = {}
+        self.returncodes = {}
+        self.running = 0
+
+    def warn(self, msg):
+        if len(self.warnings) < MAX_WARNINGS:
+            self.warnings.append(msg)
+
+    def start(self, tag, cmd, cwd=None, env=None):
+        self.running += 1
+        try:
+            proc = subprocess.Popen(cmd, cwd=cwd, env=env,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                start_new_session=True)
+        except OSError as e:
+            self.log.append('ERROR: %s\n' % e)
+            self.warn('%s: %s' % (cmd[0], e))
+            self.events.put((tag, None, None))
+            return
+        if self.cpu_limit or self.memory_limit:
+            _set_limits(proc.pid, self.cpu_limit, self.memory_limit)
+        self.procs[tag] = proc
+
+        def read(stream, name):
+            for line in stream:
+                self.events.put((tag, name, line))
+
+        readers = [threading.Thread(target=read, args=(stream, name), daemon=True)
+            for stream, name in ((proc.stdout, 'stdout'), (proc.stderr, 'stderr'))]
+
+        def wait():
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join()
+            self.events.put((tag, None, proc.wait()))
+
+        threading.Thread(target=wait, daemon=True).start()
+
+    def kill(self):
+        for proc in self.procs.values():
+            if proc.poll() is None:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        self.procs = {}
+        self.running = 0
+
+    def _check(self):
+        if self.deadline and time.time() > self.deadline:
+            self.kill()
+            raise Timeout('timeout exceeded')
+        if self.cancelled and self.cancelled():
+            self.kill()
+            raise Cancelled('cancelled')
+
+    def lines(self):
+        """Yield (tag, stdout line) until no process is running, (tag, None) when a process exits"""
+        last_check = time.time()
+        while self.running:
+            try:
+                tag, stream, line = self.events.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                tag = None
+            if time.time() - last_check >= POLL_INTERVAL:
+                self._check()
+                last_check = time.time()
+            if tag is None:
+                continue
+
+            if stream is None:
+                self.running -= 1
+                self.returncodes[tag] = line
+                proc = self.procs.pop(tag, None)
+                if proc is not None and line:
+                    msg = '%s exited with code %d' % (proc.args[0], line)
+                    self.log.append('ERROR: %s\n' % msg)
+                    self.warn(msg)
+                yield tag, None
+                continue
+
+            self.log.append(line)
+            if stream == 'stderr' or WARNING_RE.search(line):
+                self.warn(line.strip())
+            if stream == 'stdout':
+                yield tag, line
+
+    def run(self, cmd, cwd=None, env=None):
+        """Run a single process until it exits, returns its exit code (None if it could not start)"""
+        tag = object()
+        self.start(tag, cmd, cwd=cwd, env=env)
+        for _ in self.lines():
+            pass
+        return self.returncodes.pop(tag)
@@ -0,0 +1,74 @@
+from graph_processing.components import DisjointSet
+
+
+class GraphStats:
+    """
+    Statistics of a graph accumulated edge by edge
+
+        stats = GraphStats(directed)
+        for start, end, n_tokens in edges:
+            stats.add_edge(start, end, n_tokens)
+        stats.result(n_nodes, n_terms)
+
+    The memory used only grows with the number of nodes. Undirected graphs are given
+    with their edges in both directions, like in linkage-cpp inputs.
+    """
+
+    def __init__(self, directed=True):
+        self.directed = directed
+        self.n_edges = 0
+        self.n_tokens = 0
+        self.out_degrees = {}
+        self.in_degrees = {}
+        self.components = DisjointSet()
+
+    def add_edge(self, start, end, n_tokens=0):
+        self.n_edges += 1
+        self.n_tokens += n_tokens
+        self.out_degrees[start] = self.out_degrees.get(start, 0) + 1
+        self.in_degrees[end] = self.in_degrees.get(end, 0) + 1
+        self.components.union(start, end)
+
+    def add_tokens(self, n_tokens):
+        self.n_tokens += n_tokens
+
+    def degrees(self, n_nodes):
+        """Degree of each node: in + out degree if directed, number of neighbours otherwise"""
+        if self.directed:
+            return [self.out_degrees.get(node, 0) + self.in_degrees.get(node, 0) for node in range(n_nodes)]
+        return [self.out_degrees.get(node, 0) for node in range(n_nodes)]
+
+    def result(self, n_nodes, n_terms):
+        degrees = sorted(self.degrees(n_nodes))
+        n_pairs = n_nodes * (n_nodes - 1)
+        if degrees:
+            middle = len(degrees) // 2
+            median = degrees[middle] if len(degrees) % 2 else (degrees[middle - 1] + degrees[middle]) / 2
+            degree = {
+                'min': degrees[0],
+                'max': degrees[-1],
+                'mean': sum(degrees) / len(degrees),
+                'median': median,
+            }
+        else:
+            degree = {'min': 0, 'max': 0, 'mean': 0, 'median': 0}
+        return {
+            'n_nodes': n_nodes,
+            'n_edges': self.n_edges,
+            'n_terms': n_terms,
+            'n_tokens': self.n_tokens,
+            'density': self.n_edges / n_pairs if n_pairs else 0,
+            'degree': degree,
+            # the nodes without any edge are components of their own
+            'n_components': len(self.components.size) + n_nodes - len(self.components),
+        }
+
+
+def graph_stats(edges, tdm, n_nodes, n_terms, directed=True):
+    """Statistics of a graph from its (n, 3) edges and tdm coordinate arrays"""
+    stats = GraphStats(directed)
+    for start, end, value in edges.tolist():
+        if value != 0:
+            stats.add_edge(start, end)
+    stats.add_tokens(int(tdm[:, 2].sum()) if len(tdm) else 0)
+    return stats.result(n_nodes, n_terms)
@@ -0,0 +1,33 @@
+"""
+Benchmark of the union-find component labelling used by filter_largest_subgraph
+
+    python mockup/bench_components.py [max_edges]
+
+The time per edge should stay roughly constant as the graph grows (near-linear scaling)
+"""
+import os, sys, random, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from graph_processing.components import disjoint_set, largest_component
+
+max_edges = int(sys.argv[1]) if len(sys.argv) > 1 else 10**7
+
+random.seed(0)
+n_edges = 10**4
+while n_edges <= max_edges:
+    # sparse random graph: a giant component and a lot of small ones
+    n_nodes = n_edges
+    edges = [(random.randrange(n_nodes), random.randrange(n_nodes)) for _ in range(n_edges)]
+
+    t = time.time()
+    components = disjoint_set(edges)
+    t_union = time.time() - t
+
+    t = time.time()
+    largest = largest_component(edges)
+    t_largest = time.time() - t
+
+    print('edges: %9d  union-find: %7.2fs (%.2f us/edge)  largest component: %7.2fs (%d nodes)' % (
+        n_edges, t_union, t_union / n_edges * 10**6, t_largest, len(largest)))
+    n_edges *= 10
@@ -0,0 +1,230 @@
+"""
+Benchmark of the zip export (core.models.iter_export_zip) against the per-edge loops it replaced
+
+    python mockup/bench_export_zip.py [n_edges] [n_results]
+
+Run from the repository root, with the settings of the web app. A random graph and random
+results (10 topics, 10 clusters) are exported without touching the database.
+"""
+import os, sys, io, csv, json, time, zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+import django
+django.setup()
+
+import numpy as np
+from core import models, array_store
+
+n_edges = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+n_results = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+N_TOPICS = N_CLUSTERS = 10
+
+
+class Graph:
+    data_key = 'bench'
+
+    def __init__(self, n_edges):
+        rng = np.random.RandomState(0)
+        n_nodes, n_terms = n_edges // 5, 5000
+        links = np.unique(rng.randint(0, n_nodes, size=(n_edges, 2)), axis=0)
+        edges = np.hstack([links, np.ones((len(links), 1), dtype=links.dtype)]).astype(np.int32)
+        tdm = np.stack([rng.randint(0, n_terms, len(edges)), np.arange(len(edges)), np.ones(len(edges))], axis=1)
+        self.arrays = models.GraphArrays(
+            edges=edges,
+            tdm=tdm.astype(np.int32),
+            labels=array_store.StringTable.from_strings(['node %d' % node for node in range(n_nodes)]),
+            dictionnary=array_store.StringTable.from_strings(['term%d' % term for term in range(n_terms)]),
+        )
+
+    def text_data(self, name):
+        array = getattr(self.arrays, name)
+        if name in ('edges', 'tdm'):
+            return array_store.format_sp_mat(array)
+        return array.to_text()
+
+
+class Result:
+    MATRICES = models.ProcessingResult.MATRICES
+    TXT_DELIMITERS = models.ProcessingResult.TXT_DELIMITERS
+    data_key = 'bench'
+
+    def __init__(self, graph, seed):
+        rng = np.random.RandomState(seed)
+        n_nodes, n_links = len(graph.arrays.labels), int((graph.arrays.edges[:, 2] != 0).sum())
+        self.param_topics, self.param_clusters, self.crit = N_TOPICS, N_CLUSTERS + seed, rng.rand()
+        self.nodes_meta = json.dumps({'c-0': {'label': 'first cluster'}})
+        self.matrices = {
+            'clusters_mat': rng.randint(0, N_CLUSTERS, (1, n_nodes)).astype(np.float32),
+            'topics_mat': rng.rand(N_TOPICS, len(graph.arrays.dictionnary)).astype(np.float32),
+            'topics_per_edges_mat': rng.rand(N_TOPICS, n_links).astype(np.float32),
+            'rho_mat': rng.rand(1, N_CLUSTERS).astype(np.float32),
+            'pi_mat': rng.rand(N_CLUSTERS, N_CLUSTERS).astype(np.float32),
+            'theta_qr_mat': rng.rand(N_TOPICS, N_CLUSTERS).astype(np.float32),
+        }
+        for name in self.MATRICES:
+            setattr(self, name, '')
+
+    def matrix(self, name):
+        return self.matrices[name]
+
+    def text_matrix(self, name):
+        return array_store.format_txt_mat(self.matrices[name], self.TXT_DELIMITERS.get(name, ' '))
+
+
+def reference_export_to_zip(graph, results):
+    """export_to_zip before the export was streamed and vectorized"""
+    zip_out = io.BytesIO()
+    z = zipfile.ZipFile(zip_out, 'w')
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    labels = list(graph.arrays.labels)
+    dictionnary = list(graph.arrays.dictionnary)
+    edges = graph.arrays.edges.tolist()
+    for source, target, val in edges:
+        if val == 0:
+            continue
+        writer.writerow([labels[source], labels[target]])
+    z.writestr('edges.csv', output.getvalue())
+    z.writestr('raw/X.sp_mat', graph.text_data('edges'))
+    z.writestr('raw/labels', graph.text_data('labels'))
+    z.writestr('raw/tdm.sp_mat', graph.text_data('tdm'))
+    z.writestr('raw/dictionnary', graph.text_data('dictionnary'))
+
+    for result in results:
+        prefix = 'k%d_q%d/' % (result.param_topics, result.param_clusters)
+        meta = json.loads(result.nodes_meta) if result.nodes_meta else {}
+
+        output = io.StringIO()
+        writer = csv.writer(output)
+        clusters = [int(c) for c in result.matrix('clusters_mat')[0].tolist()]
+        clusters_labeleds = [[] for _ in range(max(clusters) + 1)]
+        for node, cluster in enumerate(clusters):
+            clusters_labeleds[cluster].append(labels[node])
+        writer.writerows(clusters_labeleds)
+        z.writestr(prefix + 'clusters.csv', output.getvalue())
+
+        def cluster_name(cluster):
+            return meta.get('c-'+str(cluster),{}).get('label', cluster)
+
+        output = io.StringIO()
+        writer = csv.writer(output)
+        nodes_done = set()
+        writer.writerow(['id', 'cluster'])
+        for source, target, val in edges:
+            if val == 0:
+                continue
+            for node in (source, target):
+                if node not in nodes_done:
+                    writer.writerow([labels[node], cluster_name(clusters[node])])
+                    nodes_done.add(node)
+        z.writestr(prefix + 'nodes_with_clusters.csv', output.getvalue())
+
+        def topic_name(topic):
+            return meta.get('t-'+str(topic),{}).get('label', topic)
+
+        output = io.StringIO()
+        writer = csv.writer(output)
+        topics = result.matrix('topics_per_edges_mat').tolist()
+        edge_i = 0
+        writer.writerow(['source', 'target', 'topic', 'weight'])
+        for source, target, val in edges:
+            if val == 0:
+                continue
+            best_topic = None
+            best_topic_value = None
+            for i, topic in enumerate(topics):
+                if len(topic) > edge_i:
+                    val = topic[edge_i]
+                    if best_topic is None or val > best_topic_value:
+                        best_topic = i
+                        best_topic_value = val
+            weigth = 2 if clusters[source] == clusters[target] else 1
+            writer.writerow([labels[source], labels[target], topic_name(best_topic), weigth])
+            edge_i += 1
+        z.writestr(prefix + 'edges_with_topics.csv', output.getvalue())
+
+        output = io.StringIO()
+        writer = csv.writer(output)
+        for topic in result.matrix('topics_mat').tolist():
+            row = []
+            for word, word_perc in sorted(zip(dictionnary, topic), key=lambda x: -x[1]):
+                row += [word, word_perc]
+            writer.writerow(row)
+        z.writestr(prefix + 'topics.csv', output.getvalue())
+
+        for name, filename in (('clusters_mat', 'clusters'), ('topics_mat', 'topics'),
+                ('topics_per_edges_mat', 'topics_per_edges'), ('rho_mat', 'rho'), ('pi_mat', 'PI'),
+                ('theta_qr_mat', 'thetaQR')):
+            z.writestr(prefix + 'raw/' + filename, result.text_matrix(name))
+        z.writestr(prefix + 'raw/crit', str(result.crit))
+
+    z.close()
+    return zip_out.getvalue()
+
+
+def reference_links_topics(graph, result):
+    """Topic and weight of each link with the per-edge loop of the reference export"""
+    clusters = [int(c) for c in result.matrix('clusters_mat')[0].tolist()]
+    topics = result.matrix('topics_per_edges_mat').tolist()
+    best_topics, weights = [], []
+    edge_i = 0
+    for source, target, val in graph.arrays.edges.tolist():
+        if val == 0:
+            continue
+        best_topic = None
+        best_topic_value = None
+        for i, topic in enumerate(topics):
+            if len(topic) > edge_i:
+                val = topic[edge_i]
+                if best_topic is None or val > best_topic_value:
+                    best_topic = i
+                    best_topic_value = val
+        best_topics.append(best_topic)
+        weights.append(2 if clusters[source] == clusters[target] else 1)
+        edge_i += 1
+    return best_topics, weights
+
+
+graph = Graph(n_edges)
+results = [Result(graph, seed) for seed in range(n_results)]
+print('%d edges, %d nodes, %d results' % ((graph.arrays.edges[:, 2] != 0).sum(), len(graph.arrays.labels), n_results))
+
+# topic and weight of the links
+edges = graph.arrays.edges
+result = results[0]
+t = time.time()
+reference_topics, reference_weights = reference_links_topics(graph, result)
+reference_topics_time = time.time() - t
+t = time.time()
+links = edges[edges[:, 2] != 0][:, :2].astype(np.int64)
+best_topics, weights = models.links_topics(links,
+    result.matrix('clusters_mat')[0].astype(np.int64), result.matrix('topics_per_edges_mat'))
+topics_time = time.time() - t
+assert best_topics.tolist() == reference_topics and weights.tolist() == reference_weights
+
+t = time.time()
+reference = zipfile.ZipFile(io.BytesIO(reference_export_to_zip(graph, results)))
+reference_time = time.time() - t
+
+t = time.time()
+largest_chunk = 0
+chunks = []
+for chunk in models.iter_export_zip(graph, results):
+    largest_chunk = max(largest_chunk, len(chunk))
+    chunks.append(chunk)
+streamed_time = time.time() - t
+
+streamed = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+assert reference.namelist() == streamed.namelist()
+for name in reference.namelist():
+    assert reference.read(name) == streamed.read(name), name
+
+print('%-24s %10s %10s %9s' % ('', 'reference', 'numpy', 'speed-up'))
+print('%-24s %9.2fs %9.3fs %8.0fx' % ('topics of the links', reference_topics_time, topics_time,
+    reference_topics_time / topics_time))
+print('%-24s %9.2fs %9.2fs %8.1fx' % ('whole export', reference_time, streamed_time,
+    reference_time / streamed_time))
+print('largest chunk of the streamed export: %.1f MB' % (largest_chunk / 2**20))
@@ -0,0 +1,91 @@
+"""
+Benchmark of core.http_fetch against a local stub server, compared to one requests.get after the other
+
+    python mockup/bench_http_fetch.py [n_pages] [latency_ms]
+
+The stub answers GET /page?n=<n> with {"n": <n>} after `latency_ms`. The first request of each page
+gets a 503, one page in ten a 429 with Retry-After: 0, so that every page is retried once. The stub
+also records the most requests it had to answer at the same time, which must stay within the limit
+of core.http_fetch for a host.
+"""
+import os, sys, json, threading, time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import requests
+from core import http_fetch
+
+n_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+latency = (int(sys.argv[2]) if len(sys.argv) > 2 else 100) / 1000
+
+
+class Stub(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.lock = threading.Lock()
+        self.seen = set()
+        self.in_flight = self.max_in_flight = 0
+        self.fail = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, the connections can be pooled
+
+    def do_GET(self):
+        server = self.server
+        n = int(parse_qs(urlsplit(self.path).query)['n'][0])
+        with server.lock:
+            first = n not in server.seen
+            server.seen.add(n)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(latency)
+        if server.fail and first:
+            status, headers, body = (429, {'Retry-After': '0'}, b'') if n % 10 == 0 else (503, {}, b'')
+        else:
+            status, headers, body = 200, {'Content-Type': 'application/json'}, json.dumps({'n': n}).encode()
+        with server.lock:
+            server.in_flight -= 1
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+stub = Stub()
+threading.Thread(target=stub.serve_forever, daemon=True).start()
+url = 'http://127.0.0.1:%d/page' % stub.server_address[1]
+http_fetch.BACKOFF = 0.05
+
+# reference: the importers before core.http_fetch, without the failures they did not retry
+stub.fail = False
+t = time.time()
+serial = [requests.get(url, params={'n': n}).json()['n'] for n in range(n_pages)]
+serial_time = time.time() - t
+
+
+def fetch_all(fail):
+    stub.fail, stub.seen, stub.max_in_flight = fail, set(), 0
+    t = time.time()
+    fetched = [resp.json()['n'] for resp in http_fetch.get_many((url, {'n': n}) for n in range(n_pages))]
+    assert fetched == serial == list(range(n_pages)), 'pages missing or out of order'
+    assert stub.max_in_flight <= http_fetch.PER_HOST, stub.max_in_flight
+    return time.time() - t
+
+
+print('%d pages, %d ms per request' % (n_pages, latency * 1000))
+print('%-46s %6.2fs' % ('requests.get one after the other, no failure', serial_time))
+for fail in (False, True):
+    elapsed = fetch_all(fail)
+    print('%-46s %6.2fs (%.1fx), at most %d requests at once' % ('http_fetch.get_many, ' + (
+        'every page retried once' if fail else 'no failure'), elapsed, serial_time / elapsed, stub.max_in_flight))
@@ -0,0 +1,68 @@
+"""
+Memory of the import of a big CSV once streamed to disk (core.models.stream_graph_data):
+the files loaded whole (read_graph_data) against parsed a block at a time (open_graph_data)
+
+    python mockup/bench_import_memory.py [n_links]
+
+Run from the repository root, with the settings of the web app. A random CSV of links is imported
+into a Graph that is not saved, the arrays go to a temporary array store. The peaks are those of
+tracemalloc, beyond what is already allocated: the streamed one must be about the size of the
+arrays, the text of the files is never held whole.
+"""
+import os, sys, csv, random, tempfile, time, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+import django
+django.setup()
+
+from django.conf import settings
+from core import models
+
+n_links = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+WORDS = ['word%d' % i for i in range(5000)]
+
+
+def measure(name, load):
+    tracemalloc.start()
+    t = time.time()
+    graph = models.Graph(name='bench')
+    load(graph)
+    elapsed = time.time() - t
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('%-32s %8.1fs %10.1f MB' % (name, elapsed, peak / 2**20))
+    return graph, peak
+
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    settings.LINKAGE_ARRAYS_ROOT = os.path.join(tmp_dir, 'arrays')
+    random.seed(0)
+    csv_path = os.path.join(tmp_dir, 'links.csv')
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for _ in range(n_links):
+            writer.writerow(['node%d' % random.randrange(n_links // 5), 'node%d' % random.randrange(n_links // 5),
+                ' '.join(random.choice(WORDS) for _ in range(10))])
+
+    out_dir = os.path.join(tmp_dir, 'out')
+    os.makedirs(out_dir)
+    paths = models.stream_graph_data(csv_path, out_dir, directed=True)
+    size = sum(os.path.getsize(paths[key]) for key in ('edges', 'tdm'))
+    print('%d links, %.1f MB of edges and tdm' % (n_links, size / 2**20))
+
+    def load_whole(graph):
+        graph.set_data(**models.read_graph_data(paths))
+
+    def load_streamed(graph):
+        with models.open_graph_data(paths) as data:
+            graph.set_data(**data)
+
+    whole, _ = measure('read_graph_data + set_data', load_whole)
+    streamed, peak = measure('open_graph_data + set_data', load_streamed)
+    assert whole.data_key == streamed.data_key, 'different arrays'
+    arrays_size = streamed.arrays.edges.nbytes + streamed.arrays.tdm.nbytes
+    print('%-32s %20.1f MB' % ('int32 edges and tdm', arrays_size / 2**20))
+    # loaded whole, the text of the files would come on top of the arrays
+    assert peak - arrays_size < size / 2, 'the files are loaded whole'
@@ -0,0 +1,69 @@
+"""
+Benchmark of the multilevel layout (graph_processing.layout.multilevel) against the flat ForceAtlas2
+
+    python mockup/bench_layout.py [n_nodes] [n_clusters] [n_workers]
+
+A random graph with planted clusters (5 edges per node, 90% of them within the clusters) is laid
+out both ways, with their default number of iterations, and with as many iterations of the flat
+layout as the multilevel one runs on each cluster. The quality is measured on the normalized
+positions: mean edge length over mean distance between random nodes (lower is better) and share
+of the nodes closer to the center of their own cluster than to any other (higher is better).
+"""
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from graph_processing import layout
+
+n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+n_clusters = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+n_workers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+
+def planted_graph(n_nodes, n_clusters, edges_per_node=5, inside=0.9):
+    rng = np.random.RandomState(0)
+    clusters = rng.randint(0, n_clusters, n_nodes)
+    members = [np.flatnonzero(clusters == q) for q in range(n_clusters)]
+    sources = rng.randint(0, n_nodes, n_nodes * edges_per_node)
+    targets = rng.randint(0, n_nodes, len(sources))
+    local = rng.rand(len(sources)) < inside
+    for q in range(n_clusters):
+        selected = local & (clusters[sources] == q)
+        targets[selected] = rng.choice(members[q], selected.sum())
+    links = np.stack([sources, targets], axis=1)
+    links = links[links[:, 0] != links[:, 1]]
+    # pi: share of the edges from a cluster going to each cluster
+    counts = np.zeros((n_clusters, n_clusters))
+    np.add.at(counts, (clusters[links[:, 0]], clusters[links[:, 1]]), 1)
+    return links, clusters, counts / counts.sum(axis=1, keepdims=True)
+
+
+def quality(positions, links, clusters):
+    rng = np.random.RandomState(1)
+    pairs = rng.randint(0, len(positions), (len(links), 2))
+    edge_length = np.sqrt(((positions[links[:, 0]] - positions[links[:, 1]]) ** 2).sum(axis=1)).mean()
+    random_length = np.sqrt(((positions[pairs[:, 0]] - positions[pairs[:, 1]]) ** 2).sum(axis=1)).mean()
+    centers = np.array([positions[clusters == q].mean(axis=0) for q in range(clusters.max() + 1)])
+    nearest = np.argmin(((positions[:, None] - centers[None]) ** 2).sum(axis=2), axis=1)
+    return edge_length / random_length, (nearest == clusters).mean()
+
+
+links, clusters, pi = planted_graph(n_nodes, n_clusters)
+print('%d nodes, %d edges, %d clusters' % (n_nodes, len(links), n_clusters))
+print('%-30s %9s %12s %10s' % ('', 'time (s)', 'edge/random', 'in cluster'))
+
+
+def run(name, **options):
+    t = time.time()
+    positions = layout.spacialize(links, n_nodes, **options)
+    elapsed = time.time() - t
+    edge_ratio, in_cluster = quality(positions, links, clusters)
+    print('%-30s %9.1f %12.3f %9.1f%%' % (name, elapsed, edge_ratio, 100 * in_cluster))
+
+
+for iterations in (layout.ITERATIONS, layout.MULTILEVEL_ITERATIONS):
+    run('flat, %d iterations' % iterations, iterations=iterations)
+for workers in sorted({1, n_workers}):
+    run('multilevel, %d worker(s)' % workers, iterations=layout.MULTILEVEL_ITERATIONS,
+        clusters=clusters, pi=pi, n_workers=workers)
@@ -0,0 +1,61 @@
+"""
+Benchmark of the job latency of graph_processing.process with each run backend
+
+    cd <directory of the celery worker>; python <path to>/mockup/bench_run_backends.py [n_runs] [large_edges]
+
+Like the worker, it expects linkage-cpp to be built in ../repos/linkage-cpp/. A small graph
+(graph_processing/sample_graph.py) and a large random one are clustered with K = Q = 2, one
+repetition and a few LDA iterations, so that the time spent outside of linkage-cpp (inputs,
+outputs read back, cleanup) is visible. The tmpfs backend needs /dev/shm.
+"""
+import os, sys, random, statistics, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import graph_processing
+from graph_processing.run_dirs import RUN_BACKENDS
+from graph_processing.sample_graph import X as small_X, tdm as small_tdm
+
+n_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+large_edges = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+
+
+def random_graph(n_edges, n_terms=5000, terms_per_edge=20):
+    """X and tdm laid out like core.models.stream_graph_data writes them for an undirected graph"""
+    random.seed(0)
+    n_nodes = n_edges // 5
+    links = set()
+    while len(links) < n_edges:
+        start, end = random.randrange(n_nodes), random.randrange(n_nodes)
+        if start != end:
+            links.update([(start, end), (end, start)])
+    # the nodes are numbered in order of appearance, the edges sorted by end then start
+    nodes = {}
+    for start, end in sorted(links, key=lambda edge: (edge[1], edge[0])):
+        nodes.setdefault(start, len(nodes))
+        nodes.setdefault(end, len(nodes))
+    edges = sorted(((nodes[start], nodes[end]) for start, end in links), key=lambda edge: (edge[1], edge[0]))
+    # "start end 1", and an empty link to make the matrix square
+    X = ''.join('%d %d 1\r\n' % edge for edge in edges) + '%d %d 0\r\n' % (len(nodes) - 1, len(nodes) - 1)
+    # "term edge count", distinct terms on each edge
+    tdm = ''.join('%d %d %d\r\n' % (term, edge, random.randint(1, 3))
+        for edge in range(len(edges)) for term in random.sample(range(n_terms), terms_per_edge))
+    return X, tdm
+
+
+graphs = [
+    ('small', small_X, small_tdm),
+    ('large (%d edges)' % large_edges,) + random_graph(large_edges),
+]
+
+print('%-22s %-6s %10s %10s' % ('graph', 'backend', 'median (s)', 'min (s)'))
+for name, X, tdm in graphs:
+    for backend in RUN_BACKENDS:
+        times = []
+        for i in range(n_runs):
+            t = time.time()
+            graph_processing.process(X, tdm, 2, 2, id=90000 + i,
+                update=lambda log, kq_done, msg: None,
+                n_repeat=1, max_inner_lda=2, max_outer_lda=2, run_backend=backend)
+            times.append(time.time() - t)
+        print('%-22s %-6s %10.3f %10.3f' % (name, backend, statistics.median(times), min(times)))
@@ -1,5 +1,10 @@
+import os, sys
 from pprint import pprint as pp
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from graph_processing.components import connected_components, largest_component
+
 edges = [
     ['a', 'b'],
     ['b', 'c'],
@@ -11,36 +16,12 @@ edges = [
     ['p', 't'],
 ]
 
-groups = {}
-groups_sizes = []
-g = 0
-for source, target in edges:
-    if source not in groups and target in groups:
-        groups[source] = groups[target]
-        groups_sizes[groups[target]] += 1
-    elif source in groups and target not in groups:
-        groups[target] = groups[source]
-        groups_sizes[groups[source]] += 1
-    elif source not in groups and target not in groups:
-        groups[target], groups[source] = g, g
-        groups_sizes.append(0)
-        groups_sizes[g] += 2
-        g += 1
-    elif groups[target] != groups[source]:
-        if groups_sizes[groups[target]] > groups_sizes[groups[source]]:
-            for node, group in groups.items():
-                if group == groups[source]:
-                    groups[node] = groups[target]
-        else:
-            for node, group in groups.items():
-                if group == groups[target]:
-                    groups[node] = groups[source]
-
+groups = connected_components(edges)
 pp(groups)
-pp(groups_sizes)
-best_group = groups_sizes.index(max(groups_sizes))
+
+best_group = largest_component(edges)
 print('best group is ', best_group)
 
-edges = [(source,target) for source, target in edges if groups[source] == best_group]
+edges = [(source,target) for source, target in edges if source in best_group]
 
 pp(edges)